@@ -0,0 +1,122 @@
+""" Admission control for BootNotification storms.
+
+After a restart of the central system every station reconnects and boots at
+once. BootAdmission accepts boots at the rate of a token bucket and answers
+the rest with Pending and a retry interval. The interval is sized to the
+number of stations already waiting and jittered, so retries arrive spread
+out at about the rate the bucket admits them.
+
+A storm starts with the first Pending answer and ends when every station
+that got one has been accepted; its duration and the waits of the stations
+are logged and kept in `last_storm`.
+"""
+import logging
+import random
+import time
+
+LOGGER = logging.getLogger('central_system.admission')
+
+
+class TokenBucket:
+
+    def __init__(self, rate, burst=None, clock=time.monotonic):
+        """
+        Args:
+
+            rate (float): Tokens added per second.
+            burst (float): Bucket size, defaults to one second worth of
+                tokens.
+
+        """
+        self.rate = rate
+        self.burst = burst if burst is not None else max(rate, 1)
+        self._clock = clock
+        self._tokens = self.burst
+        self._updated = clock()
+
+    def take(self):
+        now = self._clock()
+        self._tokens = min(self.burst,
+                           self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+
+class BootAdmission:
+
+    def __init__(self, rate, burst=None, min_interval=1, max_interval=300,
+                 clock=time.monotonic):
+        """
+        Args:
+
+            rate (float): BootNotifications accepted per second.
+            burst (float): Boots accepted at once after a quiet period,
+                defaults to `rate`.
+            min_interval (int): Shortest retry interval sent with Pending.
+            max_interval (int): Longest retry interval sent with Pending.
+
+        """
+        self.bucket = TokenBucket(rate, burst, clock)
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self._clock = clock
+        # station id -> time of its first Pending answer
+        self._waiting = {}
+        self._storm_start = None
+        self._storm_pending = 0
+        self._storm_waits = []
+        self.last_storm = None
+
+    def admit(self, station_id):
+        """ Return ('Accepted', None) or ('Pending', retry interval) for a
+        BootNotification of the station.
+        """
+        now = self._clock()
+        if self.bucket.take():
+            started = self._waiting.pop(station_id, None)
+            if started is not None:
+                self._storm_waits.append(now - started)
+                if not self._waiting:
+                    self._end_storm(now)
+            return 'Accepted', None
+
+        if self._storm_start is None:
+            self._storm_start = now
+            LOGGER.warning("Boot storm: admitting %g stations/s",
+                           self.bucket.rate)
+        self._waiting.setdefault(station_id, now)
+        self._storm_pending += 1
+        # Expected time until the stations already waiting are admitted,
+        # jittered by +-50% so retries don't arrive in lockstep.
+        backlog = len(self._waiting) / self.bucket.rate
+        interval = backlog * random.uniform(0.5, 1.5)
+        return 'Pending', int(min(max(interval, self.min_interval),
+                                  self.max_interval))
+
+    def forget(self, station_id):
+        """ A waiting station disconnected. """
+        if self._waiting.pop(station_id, None) is not None and \
+                not self._waiting:
+            self._end_storm(self._clock())
+
+    def _end_storm(self, now):
+        waits = sorted(self._storm_waits)
+        self.last_storm = {
+            'duration': now - self._storm_start,
+            'stations': len(waits),
+            'pending_answers': self._storm_pending,
+            'max_wait': waits[-1] if waits else 0.0,
+            'p50_wait': waits[len(waits) // 2] if waits else 0.0,
+        }
+        LOGGER.warning(
+            "Boot storm over: all stations accepted after %.1fs, %d stations "
+            "waited (p50 %.1fs, max %.1fs), %d Pending answers",
+            self.last_storm['duration'], self.last_storm['stations'],
+            self.last_storm['p50_wait'], self.last_storm['max_wait'],
+            self._storm_pending)
+        self._storm_start = None
+        self._storm_pending = 0
+        self._storm_waits = []
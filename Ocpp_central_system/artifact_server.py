@@ -0,0 +1,280 @@
+""" Minimal async HTTP artifact server for firmware downloads and log uploads.
+
+* GET/HEAD /firmware/<name> serves files from the firmware directory with
+  sendfile(), honouring a single byte Range so stations can resume broken
+  downloads.
+* PUT/POST /logs/<station>/<name> streams the request body to the upload
+  directory in chunks. A `Content-Range: bytes <first>-<last>/<total>`
+  header uploads one piece of a file (`/*` while the total is still
+  unknown); HEAD on the same path returns the number of bytes received so
+  far in `Upload-Offset`, so an interrupted upload can be resumed.
+
+Only what stations need is implemented; this is not a general web server.
+"""
+import asyncio
+import logging
+import os
+import re
+import socket
+
+LOGGER = logging.getLogger('central_system.artifact_server')
+
+CHUNK_SIZE = 64 * 1024
+MAX_HEADER_SIZE = 16 * 1024
+
+# Addresses that listen on every interface; stations can't connect to them.
+WILDCARD_HOSTS = ('', '0.0.0.0', '::')
+
+RANGE = re.compile(r'bytes=(\d*)-(\d*)$')
+CONTENT_RANGE = re.compile(r'bytes (\d+)-(\d+)/(\d+|\*)$')
+
+REASONS = {
+    200: 'OK', 201: 'Created', 204: 'No Content', 206: 'Partial Content',
+    400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+    409: 'Conflict', 411: 'Length Required',
+    416: 'Range Not Satisfiable', 500: 'Internal Server Error',
+}
+
+
+class HTTPError(Exception):
+
+    def __init__(self, status, headers=None):
+        super().__init__(status)
+        self.status = status
+        self.headers = headers or {}
+
+
+def _safe_path(root, parts):
+    if not parts or any(p in ('', '.', '..') or '\\' in p for p in parts):
+        raise HTTPError(404)
+    return os.path.join(root, *parts)
+
+
+class ArtifactServer:
+
+    def __init__(self, firmware_dir, upload_dir, host='0.0.0.0', port=8080,
+                 public_url=None, chunk_size=CHUNK_SIZE):
+        self.firmware_dir = firmware_dir
+        self.upload_dir = upload_dir
+        self.host = host
+        self.port = port
+        if public_url is None:
+            public_url = f'http://{self._public_host(host)}:{port}'
+        self.public_url = public_url.rstrip('/')
+        self.chunk_size = chunk_size
+        self._server = None
+
+    @staticmethod
+    def _public_host(host):
+        """ Host name to advertise in URLs when no public URL is given. """
+        if host not in WILDCARD_HOSTS:
+            return f'[{host}]' if ':' in host else host
+        name = socket.getfqdn()
+        LOGGER.warning("Artifact server listens on all interfaces; "
+                       "advertising http://%s:<port>, pass --artifact-url if "
+                       "stations can't resolve it", name)
+        return name
+
+    def firmware_url(self, name):
+        return f'{self.public_url}/firmware/{name}'
+
+    def upload_url(self, station_id):
+        return f'{self.public_url}/logs/{station_id}/'
+
+    async def start(self):
+        os.makedirs(self.upload_dir, exist_ok=True)
+        self._server = await asyncio.start_server(
+            self._handle_connection, self.host, self.port)
+        LOGGER.info("Artifact server listening on %s", self.public_url)
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b'\r\n\r\n')
+                except asyncio.IncompleteReadError:
+                    break
+                except asyncio.LimitOverrunError:
+                    await self._respond(writer, 400)
+                    break
+                if len(head) > MAX_HEADER_SIZE:
+                    await self._respond(writer, 400)
+                    break
+                method, path, headers = self._parse_head(head)
+                try:
+                    keep_alive = await self._dispatch(
+                        method, path, headers, reader, writer)
+                except HTTPError as e:
+                    await self._respond(writer, e.status, e.headers)
+                    keep_alive = e.status < 500 and method in ('GET', 'HEAD')
+                if not keep_alive or \
+                        headers.get('connection', '').lower() == 'close':
+                    break
+        except (ConnectionError, ValueError) as e:
+            LOGGER.debug("Artifact connection dropped: %r", e)
+        finally:
+            writer.close()
+
+    @staticmethod
+    def _parse_head(head):
+        lines = head.decode('latin-1').split('\r\n')
+        try:
+            method, target, _ = lines[0].split(' ', 2)
+        except ValueError:
+            raise ValueError(f"Malformed request line {lines[0]!r}")
+        headers = {}
+        for line in lines[1:]:
+            if ':' in line:
+                name, value = line.split(':', 1)
+                headers[name.strip().lower()] = value.strip()
+        return method.upper(), target.split('?', 1)[0], headers
+
+    async def _respond(self, writer, status, headers=None, body=b''):
+        headers = dict(headers or {})
+        headers.setdefault('Content-Length', str(len(body)))
+        lines = [f'HTTP/1.1 {status} {REASONS.get(status, "")}']
+        lines += [f'{name}: {value}' for name, value in headers.items()]
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') +
+                     body)
+        await writer.drain()
+
+    async def _dispatch(self, method, path, headers, reader, writer):
+        parts = path.strip('/').split('/')
+        if parts[0] == 'firmware':
+            if method not in ('GET', 'HEAD'):
+                raise HTTPError(405, {'Allow': 'GET, HEAD'})
+            await self._send_firmware(_safe_path(self.firmware_dir,
+                                                 parts[1:]),
+                                      method, headers, writer)
+            return True
+        if parts[0] == 'logs' and 2 <= len(parts) <= 3:
+            target = _safe_path(self.upload_dir, parts[1:])
+            if method == 'HEAD':
+                await self._respond(writer, 204, {
+                    'Upload-Offset': str(self._received(target))})
+                return True
+            if method in ('PUT', 'POST'):
+                await self._receive_upload(target, headers, reader, writer)
+                return True
+            raise HTTPError(405, {'Allow': 'HEAD, PUT, POST'})
+        raise HTTPError(404)
+
+    # Firmware downloads
+
+    async def _send_firmware(self, path, method, headers, writer):
+        try:
+            f = open(path, 'rb')
+        except (FileNotFoundError, IsADirectoryError):
+            raise HTTPError(404)
+        with f:
+            size = os.fstat(f.fileno()).st_size
+            first, last = 0, size - 1
+            status = 200
+            response_headers = {'Accept-Ranges': 'bytes',
+                                'Content-Type': 'application/octet-stream'}
+
+            requested = RANGE.match(headers.get('range', ''))
+            if requested:
+                start, end = requested.groups()
+                if start:
+                    first = int(start)
+                    last = min(int(end), size - 1) if end else size - 1
+                elif end:
+                    first = max(size - int(end), 0)
+                if not (start or end) or first > last or first >= size:
+                    raise HTTPError(416, {'Content-Range': f'bytes */{size}'})
+                status = 206
+                response_headers['Content-Range'] = \
+                    f'bytes {first}-{last}/{size}'
+
+            count = last - first + 1 if size else 0
+            response_headers['Content-Length'] = str(count)
+            await self._respond(writer, status, response_headers)
+            if method == 'GET' and count:
+                # Zero-copy where the platform supports it, a read/write
+                # loop otherwise.
+                await asyncio.get_running_loop().sendfile(
+                    writer.transport, f, first, count)
+
+    # Log uploads
+
+    @staticmethod
+    def _received(target):
+        for path in (target, target + '.part'):
+            try:
+                return os.path.getsize(path)
+            except OSError:
+                continue
+        return 0
+
+    async def _receive_upload(self, target, headers, reader, writer):
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        partial = target + '.part'
+        # Without a Content-Range the body is the whole file; a total of
+        # '*' means more pieces follow.
+        offset, total = 0, None
+
+        content_range = CONTENT_RANGE.match(headers.get('content-range', ''))
+        if content_range:
+            offset = int(content_range.group(1))
+            if content_range.group(3) != '*':
+                total = int(content_range.group(3))
+            received = os.path.getsize(partial) \
+                if os.path.exists(partial) else 0
+            if offset > received:
+                # A gap would corrupt the file; tell the station where to
+                # continue.
+                raise HTTPError(409, {'Upload-Offset': str(received)})
+
+        loop = asyncio.get_running_loop()
+        f = await loop.run_in_executor(None, open, partial,
+                                       'r+b' if offset else 'wb')
+        try:
+            await loop.run_in_executor(None, f.seek, offset)
+            await loop.run_in_executor(None, f.truncate, offset)
+            async for chunk in self._body(headers, reader):
+                await loop.run_in_executor(None, f.write, chunk)
+            received = await loop.run_in_executor(None, f.tell)
+        finally:
+            await loop.run_in_executor(None, f.close)
+
+        if not content_range or (total is not None and received >= total):
+            os.replace(partial, target)
+            LOGGER.info("Received upload %s (%d bytes)", target, received)
+            await self._respond(writer, 201, {'Upload-Offset': str(received)})
+        else:
+            await self._respond(writer, 200, {'Upload-Offset': str(received)})
+
+    async def _body(self, headers, reader):
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            while True:
+                size_line = await reader.readline()
+                size = int(size_line.split(b';', 1)[0].strip(), 16)
+                if size == 0:
+                    # Skip trailers up to the terminating empty line.
+                    while (await reader.readline()) not in (b'\r\n', b''):
+                        pass
+                    return
+                remaining = size
+                while remaining:
+                    chunk = await reader.read(min(remaining, self.chunk_size))
+                    if not chunk:
+                        raise ConnectionError("Upload interrupted")
+                    remaining -= len(chunk)
+                    yield chunk
+                await reader.readexactly(2)
+        elif 'content-length' in headers:
+            remaining = int(headers['content-length'])
+            while remaining:
+                chunk = await reader.read(min(remaining, self.chunk_size))
+                if not chunk:
+                    raise ConnectionError("Upload interrupted")
+                remaining -= len(chunk)
+                yield chunk
+        else:
+            raise HTTPError(411)
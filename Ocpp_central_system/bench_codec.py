@@ -0,0 +1,168 @@
+""" Benchmark of the frame codec against the ocpp library's own path.
+
+Replays B01 (BootNotification, StatusNotification, Heartbeat) and K01
+(SetChargingProfile) traffic through a ChargePoint with an in-memory
+connection, once with the library conversion and once with FastCodec for
+every available JSON backend:
+
+    $ python bench_codec.py --messages 20000
+
+Schema validation runs in every variant, as it does in the central system;
+the codec variants use the compiled validators when fastjsonschema is
+installed. --trust-after samples validation like the central system's
+option of the same name, --skip-validation shows the conversion cost on its
+own.
+"""
+import argparse
+import asyncio
+import json
+import time
+from datetime import datetime
+
+import ocpp.charge_point
+from ocpp.routing import on
+from ocpp.v201 import ChargePoint as cp
+from ocpp.v201 import call
+from ocpp.v201 import call_result
+
+import codec
+from codec import FastCodec
+from validation import ValidationPolicy
+
+NOW = datetime.utcnow().isoformat()
+
+B01_FRAMES = [
+    json.dumps([2, '1', 'BootNotification', {
+        'chargingStation': {'model': 'Wallbox XYZ', 'vendorName': 'anewone',
+                            'serialNumber': 'SN-0001',
+                            'firmwareVersion': '1.2.3'},
+        'reason': 'PowerUp'}]),
+    json.dumps([2, '2', 'StatusNotification', {
+        'timestamp': NOW, 'connectorStatus': 'Available', 'evseId': 1,
+        'connectorId': 1}]),
+    json.dumps([2, '3', 'Heartbeat', {}]),
+]
+
+K01_PROFILE = {
+    'id': 1, 'stack_level': 0, 'charging_profile_purpose': 'TxDefaultProfile',
+    'charging_profile_kind': 'Absolute',
+    'charging_schedule': [{
+        'id': 1, 'start_schedule': NOW, 'duration': 86400,
+        'charging_rate_unit': 'W',
+        'charging_schedule_period': [
+            {'start_period': i * 3600, 'limit': 11000.0 - i * 100,
+             'number_phases': 3}
+            for i in range(24)]}],
+}
+
+
+class LibraryChargePoint(cp):
+
+    @on('BootNotification')
+    def on_boot_notification(self, charging_station, reason, **kwargs):
+        return call_result.BootNotificationPayload(
+            current_time=NOW, interval=10, status='Accepted')
+
+    @on('StatusNotification')
+    def on_status_notification(self, **kwargs):
+        return call_result.StatusNotificationPayload()
+
+    @on('Heartbeat')
+    def on_heartbeat(self):
+        return call_result.HeartbeatPayload(current_time=NOW)
+
+
+class CodecChargePoint(FastCodec, LibraryChargePoint):
+    pass
+
+
+class Connection:
+    """ Answers every CALL with an accepting CALLRESULT. """
+
+    def __init__(self):
+        self.charge_point = None
+
+    async def send(self, message):
+        if message.startswith('[2'):
+            unique_id = message.split('"', 2)[1]
+            await self.charge_point.route_message(
+                f'[3,"{unique_id}",{{"status":"Accepted"}}]')
+
+    async def recv(self):
+        await asyncio.Future()
+
+
+def _skip_validation():
+    def validate_payload(message, ocpp_version):
+        pass
+
+    ocpp.charge_point.validate_payload = validate_payload
+    codec.validate_payload = validate_payload
+
+
+async def bench_b01(charge_point, messages):
+    frames = B01_FRAMES
+    start = time.perf_counter()
+    for i in range(messages):
+        await charge_point.route_message(frames[i % len(frames)])
+    return time.perf_counter() - start
+
+
+async def bench_k01(charge_point, messages):
+    payload = call.SetChargingProfilePayload(evse_id=1,
+                                             charging_profile=K01_PROFILE)
+    start = time.perf_counter()
+    for _ in range(messages):
+        await charge_point.call(payload)
+    return time.perf_counter() - start
+
+
+async def run(args):
+    variants = [('library', LibraryChargePoint, None)]
+    variants += [(f'codec/{name}', CodecChargePoint, name)
+                 for name in codec.BACKENDS]
+
+    if args.skip_validation:
+        _skip_validation()
+    elif args.trust_after is not None:
+        CodecChargePoint.validation_policy = ValidationPolicy(
+            args.trust_after, args.sample_rate)
+
+    results = {}
+    for label, cls, backend in variants:
+        if backend is not None:
+            codec.set_backend(backend)
+        connection = Connection()
+        charge_point = connection.charge_point = cls('CP_BENCH', connection)
+
+        # Warm up validators and caches.
+        await bench_b01(charge_point, 100)
+        await bench_k01(charge_point, 100)
+
+        results[label] = (await bench_b01(charge_point, args.messages),
+                          await bench_k01(charge_point, args.messages))
+
+    baseline = results['library']
+    print(f"{'variant':<16}{'B01 us/msg':>12}{'speedup':>9}"
+          f"{'K01 us/call':>13}{'speedup':>9}")
+    for label, (b01, k01) in results.items():
+        print(f"{label:<16}{b01 / args.messages * 1e6:>12.1f}"
+              f"{baseline[0] / b01:>8.2f}x"
+              f"{k01 / args.messages * 1e6:>13.1f}"
+              f"{baseline[1] / k01:>8.2f}x")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--messages', type=int, default=20000,
+                        help="Messages per traffic type and variant.")
+    parser.add_argument('--skip-validation', action='store_true',
+                        help="Leave out JSON schema validation.")
+    parser.add_argument('--trust-after', type=int, default=None,
+                        help="Sample validation after this many messages.")
+    parser.add_argument('--sample-rate', type=float, default=0.01)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    asyncio.run(run(parse_args()))
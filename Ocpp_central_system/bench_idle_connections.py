@@ -0,0 +1,265 @@
+""" Benchmark of the memory the central system needs per idle station.
+
+Starts central_system.py as a subprocess and opens idle station connections
+to it in steps, e.g. 10k, 50k and 100k. Every station completes the
+WebSocket handshake, boots with a BootNotification, answers pings and then
+stays silent. After each step the resident set size (RSS) of the server is
+read from /proc and reported per station:
+
+    $ python bench_idle_connections.py --stations 10000 50000 100000
+    $ python bench_idle_connections.py --server-args "--ws-max-size 1048576"
+
+The stations are minimal asyncio protocols rather than ocpp ChargePoints, so
+the benchmark itself stays small next to the server. Connections are spread
+over several loopback source addresses, since one address has only about
+28k ephemeral ports. Linux only; the open file limit is raised as far as
+the hard limit, or beyond it when running as root.
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import resource
+import shlex
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+
+CONNECTIONS_PER_SOURCE_ADDRESS = 20000
+
+BOOT_NOTIFICATION = json.dumps(
+    [2, '1', 'BootNotification',
+     {'chargingStation': {'model': 'Idle', 'vendorName': 'bench'},
+      'reason': 'PowerUp'}], separators=(',', ':')).encode()
+
+
+def _masked_frame(opcode, payload):
+    """ A client frame: FIN, the opcode and the masked payload. """
+    mask = os.urandom(4)
+    length = len(payload)
+    if length < 126:
+        header = struct.pack('!BB', 0x80 | opcode, 0x80 | length)
+    else:
+        header = struct.pack('!BBH', 0x80 | opcode, 0x80 | 126, length)
+    masked = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+    return header + mask + masked
+
+
+class Stats:
+
+    def __init__(self):
+        self.connected = 0
+        self.booted = 0
+        self.failed = 0
+        self.closed = 0
+
+
+class IdleStation(asyncio.Protocol):
+
+    def __init__(self, station_id, host, stats, booted):
+        self.station_id = station_id
+        self.host = host
+        self.stats = stats
+        self.booted = booted
+        self.transport = None
+        self.buffer = b''
+        self.upgraded = False
+
+    def connection_made(self, transport):
+        self.transport = transport
+        key = base64.b64encode(os.urandom(16)).decode()
+        transport.write(
+            f'GET /{self.station_id} HTTP/1.1\r\n'
+            f'Host: {self.host}\r\n'
+            f'Upgrade: websocket\r\n'
+            f'Connection: Upgrade\r\n'
+            f'Sec-WebSocket-Key: {key}\r\n'
+            f'Sec-WebSocket-Version: 13\r\n'
+            f'Sec-WebSocket-Protocol: ocpp2.0.1\r\n\r\n'.encode())
+
+    def data_received(self, data):
+        self.buffer += data
+        if not self.upgraded:
+            head, separator, rest = self.buffer.partition(b'\r\n\r\n')
+            if not separator:
+                return
+            if not head.startswith(b'HTTP/1.1 101'):
+                self._fail()
+                return
+            self.upgraded = True
+            self.buffer = rest
+            self.stats.connected += 1
+            self.transport.write(_masked_frame(0x1, BOOT_NOTIFICATION))
+        self._read_frames()
+
+    def _read_frames(self):
+        # Server frames are unmasked.
+        while len(self.buffer) >= 2:
+            opcode = self.buffer[0] & 0x0f
+            length = self.buffer[1] & 0x7f
+            offset = 2
+            if length == 126:
+                if len(self.buffer) < 4:
+                    return
+                length, = struct.unpack_from('!H', self.buffer, 2)
+                offset = 4
+            elif length == 127:
+                if len(self.buffer) < 10:
+                    return
+                length, = struct.unpack_from('!Q', self.buffer, 2)
+                offset = 10
+            if len(self.buffer) < offset + length:
+                return
+            payload = self.buffer[offset:offset + length]
+            self.buffer = self.buffer[offset + length:]
+            if opcode == 0x9:
+                self.transport.write(_masked_frame(0xa, payload))
+            elif opcode == 0x8:
+                self.transport.write(_masked_frame(0x8, payload[:2]))
+                self.transport.close()
+            elif opcode == 0x1 and payload.startswith(b'[3,"1"'):
+                self.stats.booted += 1
+                self.booted.set_result(None)
+
+    def _fail(self):
+        self.stats.failed += 1
+        if not self.booted.done():
+            self.booted.set_result(None)
+        self.transport.close()
+
+    def connection_lost(self, exc):
+        if self.upgraded:
+            self.stats.closed += 1
+        if not self.booted.done():
+            self.stats.failed += 1
+            self.booted.set_result(None)
+
+
+def rss(pid):
+    """ Resident set size of a process in bytes. """
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+def raise_open_file_limit(needed):
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft >= needed:
+        return soft
+    for limit in (max(needed, hard), hard):
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (limit, limit))
+            return limit
+        except (ValueError, OSError):
+            continue
+    return soft
+
+
+async def wait_for_port(host, port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            _, writer = await asyncio.open_connection(host, port)
+        except OSError:
+            await asyncio.sleep(0.2)
+            continue
+        writer.close()
+        return True
+    return False
+
+
+async def open_stations(start, stop, args, stats):
+    """ Connect and boot stations start..stop-1, concurrency at a time. """
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def station(i):
+        async with semaphore:
+            booted = loop.create_future()
+            source = f'127.0.{i // CONNECTIONS_PER_SOURCE_ADDRESS // 250}.' \
+                     f'{i // CONNECTIONS_PER_SOURCE_ADDRESS % 250 + 1}'
+            try:
+                await loop.create_connection(
+                    lambda: IdleStation(f'IDLE_{i}', args.host, stats,
+                                        booted),
+                    args.host, args.port, local_addr=(source, 0))
+            except OSError:
+                stats.failed += 1
+                return
+            try:
+                await asyncio.wait_for(booted, args.boot_timeout)
+            except asyncio.TimeoutError:
+                stats.failed += 1
+
+    await asyncio.gather(*[station(i) for i in range(start, stop)])
+
+
+async def run(args):
+    steps = sorted(args.stations)
+    limit = raise_open_file_limit(steps[-1] + 1000)
+    if limit < steps[-1] + 1000:
+        print(f"Open file limit is {limit}, use at most {limit - 1000} "
+              f"stations or run as root.")
+        return
+
+    data_dir = tempfile.mkdtemp(prefix='bench_idle_connections-')
+    command = [sys.executable, 'central_system.py', '--host', args.host,
+               '--port', str(args.port), '--data-dir', data_dir,
+               '--log-format', 'text'] + shlex.split(args.server_args)
+    print(' '.join(command))
+    server = subprocess.Popen(
+        command, stdout=subprocess.DEVNULL,
+        stderr=None if args.server_log else subprocess.DEVNULL)
+    try:
+        if not await wait_for_port(args.host, args.port):
+            print("The central system didn't start.")
+            return
+        await asyncio.sleep(args.settle)
+        baseline = rss(server.pid)
+        print(f"baseline RSS       : {baseline / 2 ** 20:.1f} MiB")
+
+        stats = Stats()
+        opened = 0
+        for count in steps:
+            started = time.monotonic()
+            await open_stations(opened, count, args, stats)
+            opened = count
+            elapsed = time.monotonic() - started
+            await asyncio.sleep(args.settle)
+            used = rss(server.pid)
+            print(f"{count:>7} stations : RSS {used / 2 ** 20:8.1f} MiB, "
+                  f"{(used - baseline) / max(stats.booted, 1) / 1024:6.2f} "
+                  f"KiB per idle station ({stats.booted} booted, "
+                  f"{stats.failed} failed, {stats.closed} closed, "
+                  f"opened in {elapsed:.1f} s)")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--stations', type=int, nargs='+',
+                        default=[10000, 50000, 100000],
+                        help="Numbers of idle stations to measure at.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9300)
+    parser.add_argument('--concurrency', type=int, default=500,
+                        help="Stations connecting at the same time.")
+    parser.add_argument('--boot-timeout', type=float, default=60)
+    parser.add_argument('--settle', type=float, default=5,
+                        help="Seconds to wait before reading the RSS.")
+    parser.add_argument('--server-args', default='',
+                        help="Further options of central_system.py.")
+    parser.add_argument('--server-log', action='store_true',
+                        help="Show the log of the central system.")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    asyncio.run(run(parse_args()))
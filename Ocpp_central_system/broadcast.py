@@ -0,0 +1,94 @@
+""" Serialize-once broadcast of a CALL to many stations.
+
+The payload is converted, validated and JSON encoded a single time into a
+codec.EncodedCall. It is sent with every station's call(), so it is queued,
+timed out and retried like any other CALL; per station only the message id
+is spliced into the pre-encoded frame.
+"""
+import asyncio
+import logging
+from collections import Counter
+
+from codec import EncodedCall
+
+LOGGER = logging.getLogger('central_system.broadcast')
+
+
+class BroadcastReport:
+    """ Aggregated outcome of a broadcast. """
+
+    def __init__(self, action):
+        self.action = action
+        self.sent = 0
+        self.responses = 0
+        self.call_errors = 0
+        self.timeouts = 0
+        self.disconnected = 0
+        # Status counts, e.g. {'Accepted': 49890, 'Rejected': 110}
+        self.statuses = Counter()
+        # (station id, status, details) of every non Accepted result
+        self.failures = []
+
+    def __repr__(self):
+        return (f"<BroadcastReport - action={self.action}, sent={self.sent}, "
+                f"responses={self.responses}, "
+                f"call_errors={self.call_errors}, timeouts={self.timeouts}, "
+                f"disconnected={self.disconnected}, "
+                f"statuses={dict(self.statuses)}>")
+
+
+def _collect_set_variables(report, station_id, response):
+    for result in response.set_variable_result:
+        status = result['attribute_status']
+        report.statuses[status] += 1
+        if status != 'Accepted':
+            report.failures.append((station_id, status, result))
+
+
+def _collect_status(report, station_id, response):
+    report.statuses[response.status] += 1
+    if response.status != 'Accepted':
+        report.failures.append((station_id, response.status, None))
+
+
+COLLECTORS = {
+    'SetVariables': _collect_set_variables,
+}
+
+
+async def broadcast(charge_points, payload, concurrency=500,
+                    ocpp_version='2.0.1', on_response=None):
+    """ Send the same CALL payload to all given charge points, with at most
+    `concurrency` calls in flight, and return a BroadcastReport.
+
+    `on_response`, if given, is called with the charge point and the
+    response of every station that answered.
+    """
+    encoded = EncodedCall(payload, ocpp_version)
+    collect = COLLECTORS.get(encoded.action, _collect_status)
+    report = BroadcastReport(encoded.action)
+    pending = iter(charge_points)
+
+    async def worker():
+        for charge_point in pending:
+            report.sent += 1
+            try:
+                response = await charge_point.call(encoded)
+            except asyncio.TimeoutError:
+                report.timeouts += 1
+                continue
+            except Exception as e:
+                # Mostly websockets.exceptions.ConnectionClosed.
+                LOGGER.debug("Broadcast to %s failed: %r", charge_point.id, e)
+                report.disconnected += 1
+                continue
+            if response is None:
+                report.call_errors += 1
+                continue
+            report.responses += 1
+            collect(report, charge_point.id, response)
+            if on_response is not None:
+                on_response(charge_point, response)
+
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return report
@@ -0,0 +1,273 @@
+""" Fleet-wide table of outbound CALLs waiting for their response.
+
+asyncio.wait_for() gives every CALL its own timer, all with the same
+timeout, and a station that drops its socket leaves the CALL waiting until
+that timer fires. CallTable keeps the outstanding CALLs of all connections
+in one place instead:
+
+* the timeout depends on the action: a few seconds for requests a station
+  answers from memory, minutes for UpdateFirmware,
+* all timeouts are run by one DeadlineScheduler, a heap with a single loop
+  timer armed for the earliest deadline,
+* cancel(connection) fails every CALL of a connection at once when its
+  socket closes,
+* retry_delay() tells the caller whether, and after how long, a CALL of an
+  idempotent action that timed out may be sent again: exponential backoff
+  with jitter, so a fleet that stopped answering isn't hit in lockstep.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+import time
+
+LOGGER = logging.getLogger('central_system.call_table')
+
+# Action -> seconds to wait for the response.
+TIMEOUTS = {
+    'GetVariables': 10,
+    'SetVariables': 10,
+    'TriggerMessage': 10,
+    'SetChargingProfile': 15,
+    'ClearChargingProfile': 15,
+    'GetLog': 30,
+    'UpdateFirmware': 120,
+}
+DEFAULT_TIMEOUT = 30
+
+# Actions that can be sent again without changing the outcome. Sending
+# UpdateFirmware or GetLog again restarts the operation on the station.
+IDEMPOTENT = frozenset({
+    'GetVariables',
+    'SetVariables',
+    'SetChargingProfile',
+    'ClearChargingProfile',
+    'GetChargingProfiles',
+    'GetCompositeSchedule',
+})
+
+
+class Deadline:
+
+    __slots__ = ('when', 'callback', 'args', 'cancelled', '_scheduler')
+
+    def __init__(self, scheduler, when, callback, args):
+        self._scheduler = scheduler
+        self.when = when
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        if not self.cancelled:
+            self.cancelled = True
+            self._scheduler._cancelled += 1
+
+
+class DeadlineScheduler:
+    """ Runs callbacks at time.monotonic() deadlines from a heap, with one
+    loop timer armed for the earliest of them. Cancelled deadlines stay in
+    the heap until they come up, or until they are the majority and the
+    heap is compacted.
+    """
+
+    def __init__(self):
+        # (when, sequence, Deadline)
+        self._heap = []
+        self._sequence = itertools.count()
+        self._cancelled = 0
+        self._timer = None
+        self._timer_when = None
+
+    def __len__(self):
+        return len(self._heap) - self._cancelled
+
+    def call_at(self, when, callback, *args):
+        """ Call callback(*args) at the time.monotonic() value `when`.
+        Returns a Deadline that can be cancelled.
+        """
+        deadline = Deadline(self, when, callback, args)
+        heapq.heappush(self._heap, (when, next(self._sequence), deadline))
+        if self._cancelled > 64 and self._cancelled * 2 > len(self._heap):
+            self._compact()
+        if self._timer_when is None or when < self._timer_when:
+            self._arm(when)
+        return deadline
+
+    def call_later(self, delay, callback, *args):
+        return self.call_at(time.monotonic() + delay, callback, *args)
+
+    async def sleep(self, delay):
+        future = asyncio.get_running_loop().create_future()
+        deadline = self.call_later(delay, _set_result, future)
+        try:
+            await future
+        finally:
+            deadline.cancel()
+
+    def _compact(self):
+        self._heap = [item for item in self._heap if not item[2].cancelled]
+        heapq.heapify(self._heap)
+        self._cancelled = 0
+
+    def _arm(self, when):
+        if self._timer is not None:
+            self._timer.cancel()
+        loop = asyncio.get_running_loop()
+        # The loop's clock is time.monotonic().
+        self._timer = loop.call_at(when, self._run)
+        self._timer_when = when
+
+    def _run(self):
+        self._timer = self._timer_when = None
+        now = time.monotonic()
+        heap = self._heap
+        while heap and heap[0][0] <= now:
+            _, _, deadline = heapq.heappop(heap)
+            if deadline.cancelled:
+                self._cancelled -= 1
+                continue
+            deadline.cancelled = True
+            try:
+                deadline.callback(*deadline.args)
+            except Exception:
+                LOGGER.exception("Deadline callback %r failed",
+                                 deadline.callback)
+        # Skip cancelled deadlines at the top rather than waking up for
+        # them.
+        while heap and heap[0][2].cancelled:
+            heapq.heappop(heap)
+            self._cancelled -= 1
+        if heap:
+            self._arm(heap[0][0])
+
+
+def _set_result(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class CallTable:
+
+    def __init__(self, scheduler=None, timeouts=None,
+                 default_timeout=DEFAULT_TIMEOUT, idempotent=IDEMPOTENT,
+                 retries=2, backoff=1.0, max_backoff=30.0):
+        """
+        Args:
+
+            scheduler (DeadlineScheduler): Runs the timeouts.
+            timeouts (dict): Action -> seconds to wait for a response,
+                in addition to TIMEOUTS.
+            default_timeout (float): Timeout of other actions.
+            idempotent: Actions retried after a timeout.
+            retries (int): Retries of an idempotent CALL at most.
+            backoff (float): Delay before the first retry in seconds; it
+                doubles with every retry, up to max_backoff.
+
+        """
+        self.scheduler = scheduler or DeadlineScheduler()
+        self.timeouts = dict(TIMEOUTS, **(timeouts or {}))
+        self.default_timeout = default_timeout
+        self.idempotent = idempotent
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        # connection -> {unique id: (future, Deadline)}; connections
+        # without outstanding CALLs have no entry.
+        self._calls = {}
+        self.timed_out = 0
+        self.cancelled = 0
+        self.retried = 0
+
+    def __len__(self):
+        return sum(len(calls) for calls in self._calls.values())
+
+    def register_metrics(self, metrics):
+        metrics.register(
+            'ocpp_calls_outstanding', 'gauge',
+            "CALLs sent to stations waiting for their response.",
+            self.__len__)
+        metrics.register(
+            'ocpp_calls_timed_out_total', 'counter',
+            "CALLs that weren't answered within the timeout of the action.",
+            lambda: self.timed_out)
+        metrics.register(
+            'ocpp_calls_cancelled_total', 'counter',
+            "CALLs cancelled because the station disconnected.",
+            lambda: self.cancelled)
+        metrics.register(
+            'ocpp_calls_retried_total', 'counter',
+            "CALLs sent again after a timeout.",
+            lambda: self.retried)
+
+    def timeout(self, action):
+        return self.timeouts.get(action, self.default_timeout)
+
+    def budget(self, action):
+        """ Seconds a CALL of the action may take at most: its timeout and,
+        for idempotent actions, every retry with the longest backoff before
+        it.
+        """
+        timeout = self.timeout(action)
+        if action not in self.idempotent:
+            return timeout
+        backoff = sum(min(self.backoff * 2 ** attempt, self.max_backoff)
+                      for attempt in range(self.retries))
+        # retry_delay() jitters the backoff by up to 1.5 times.
+        return timeout * (self.retries + 1) + backoff * 1.5
+
+    async def wait(self, connection, unique_id, future, timeout):
+        """ Await the future of a CALL's response; raise
+        asyncio.TimeoutError after timeout seconds, or ConnectionError when
+        the connection is cancelled.
+        """
+        deadline = self.scheduler.call_later(timeout, self._expire, future)
+        calls = self._calls.get(connection)
+        if calls is None:
+            calls = self._calls[connection] = {}
+        calls[unique_id] = (future, deadline)
+        try:
+            return await future
+        finally:
+            deadline.cancel()
+            calls.pop(unique_id, None)
+            if not calls and self._calls.get(connection) is calls:
+                del self._calls[connection]
+
+    def _expire(self, future):
+        if not future.done():
+            self.timed_out += 1
+            future.set_exception(asyncio.TimeoutError())
+
+    def cancel(self, connection, error=None):
+        """ Fail all outstanding CALLs of a connection. """
+        calls = self._calls.pop(connection, None)
+        if not calls:
+            return 0
+        for future, deadline in calls.values():
+            deadline.cancel()
+            if not future.done():
+                self.cancelled += 1
+                future.set_exception(
+                    error or ConnectionError("Station disconnected"))
+        return len(calls)
+
+    def retry_delay(self, action, attempt):
+        """ Seconds to wait before sending a CALL that timed out again, or
+        None if it must not be retried. attempt counts from 0.
+        """
+        if action not in self.idempotent or attempt >= self.retries:
+            return None
+        self.retried += 1
+        delay = min(self.backoff * 2 ** attempt, self.max_backoff)
+        return delay * random.uniform(0.5, 1.5)
+
+
+def parse_timeouts(values):
+    """ Parse ACTION=SECONDS arguments, e.g. ['UpdateFirmware=300']. """
+    timeouts = {}
+    for value in values or []:
+        action, _, seconds = value.partition('=')
+        timeouts[action] = float(seconds)
+    return timeouts
@@ -0,0 +1,1219 @@
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import tempfile
+import time
+from datetime import datetime
+
+try:
+    import websockets
+except ModuleNotFoundError:
+    print("This example relies on the 'websockets' package.")
+    print("Please install it by running: ")
+    print()
+    print(" $ pip install websockets")
+    import sys
+    sys.exit(1)
+
+from ocpp.charge_point import snake_to_camel_case
+from ocpp.routing import on
+from ocpp.v201 import call
+from ocpp.v201 import call_result
+
+from admission import BootAdmission, TokenBucket
+from artifact_server import ArtifactServer
+from broadcast import broadcast
+from call_table import CallTable, parse_timeouts
+from charging_schedule import CompositeScheduleEngine
+from codec import action_of
+from connector_status import ConnectorStatusTable, load_sites, \
+    parse_timestamp
+from device_model import LIMIT_VARIABLES, DeviceModelCache, batches, \
+    variable_key
+from ev_certificate import CertificateService
+from firmware_rollout import FIRMWARE_STATUSES, FAILED, INSTALLED, \
+    FirmwareRollout
+from heartbeat import AdaptiveInterval, CachedClock, LivenessTracker
+from load_balancer import SiteLoadBalancer, parse_capacities, \
+    site_limit_profile
+from metrics import Metrics, timed_handler
+from outbound_queue import Dropped, OutboundQueue, Superseded
+from profile_store import ChargingProfileStore
+from sharding import Broker, WorkerBus, home_worker
+from state_store import StateStore
+from station_connection import StationConnection
+from structured_log import StationLogger, parse_sample_rates, setup_logging
+import traffic_journal
+from validation import ValidationPolicy
+
+LOGGER = logging.getLogger('central_system')
+
+HEARTBEAT_INTERVAL = 10
+# Longest time the liveness wheel can wait for a station.
+LIVENESS_MAX_TIMEOUT = 3600
+
+# Device model variable of the heartbeat interval, pushed with SetVariables.
+HEARTBEAT_INTERVAL_VARIABLE = {
+    'component': {'name': 'OCPPCommCtrlr'},
+    'variable': {'name': 'HeartbeatInterval'},
+}
+
+# Seconds a site limit may wait in a station's outbound queue.
+SITE_LIMIT_DEADLINE = 30
+
+# Payloads validated even for trusted stations: they drive firmware
+# rollouts and certificate handling.
+ALWAYS_VALIDATE = ('BootNotification', 'FirmwareStatusNotification',
+                   'Get15118EVCertificate')
+
+
+class StationRegistry:
+    """ Maps a station id to the ChargePoint instance of its live
+    connection. Lookups, registration and removal are all O(1).
+    """
+
+    def __init__(self):
+        self._stations = {}
+
+    def register(self, charge_point):
+        previous = self._stations.get(charge_point.id)
+        self._stations[charge_point.id] = charge_point
+        return previous
+
+    def unregister(self, charge_point):
+        # A station that reconnected before its old socket was torn down
+        # must not be removed by the stale connection.
+        if self._stations.get(charge_point.id) is charge_point:
+            del self._stations[charge_point.id]
+
+    def get(self, station_id):
+        return self._stations.get(station_id)
+
+    def __contains__(self, station_id):
+        return station_id in self._stations
+
+    def __len__(self):
+        return len(self._stations)
+
+    def __iter__(self):
+        return iter(list(self._stations.values()))
+
+
+registry = StationRegistry()
+clock = CachedClock()
+liveness = LivenessTracker(interval=HEARTBEAT_INTERVAL,
+                           max_timeout=LIVENESS_MAX_TIMEOUT)
+heartbeat_intervals = AdaptiveInterval(min_interval=HEARTBEAT_INTERVAL)
+profile_store = ChargingProfileStore('charging_profiles.jsonl')
+schedule_engine = CompositeScheduleEngine(profile_store)
+device_model = DeviceModelCache()
+metrics = Metrics()
+# CALLs waiting for a station's response, with per-action timeouts run by
+# one scheduler, see --call-timeout.
+calls = CallTable()
+calls.register_metrics(metrics)
+# Last status of every connector with per-site counters, see --sites.
+connectors = ConnectorStatusTable()
+# Admits BootNotifications at a rate the server sustains, see --boot-rate.
+admission = BootAdmission(rate=200)
+# Used by ChargePoint when enabled with --trust-after.
+validation_policy = ValidationPolicy(always_validate=ALWAYS_VALIDATE)
+# (station id, transactionId) -> EVSE id of a transaction in progress;
+# TransactionEvent only has to name the EVSE in its first message.
+transaction_evses = {}
+# requestId of a firmware rollout in progress -> FirmwareRollout
+rollouts = {}
+# Rollout request ids start here; with several workers every worker takes
+# every n-th id, so the id tells which worker runs the rollout.
+ROLLOUT_REQUEST_ID_BASE = 1000
+_rollout_request_ids = itertools.count(ROLLOUT_REQUEST_ID_BASE)
+# Set in serve() when the bundled artifact server is enabled.
+artifact_server = None
+firmware_image = None
+# Set in serve() when running as one of several worker processes.
+bus = None
+workers = 1
+# Seconds a connecting station waits for its state from another worker.
+STATE_FETCH_TIMEOUT = 5
+# Set in serve() when recording traffic with --journal-dir.
+journal = None
+# Set in serve() when sites have a grid capacity, see --site-capacity.
+load_balancer = None
+# Processes Get15118EVCertificate off the event loop, see --certificate-*.
+certificates = CertificateService()
+certificates.register_metrics(metrics)
+profile_store.add_listener(schedule_engine.invalidate)
+# site name -> (times, summed composite limits in W) for the next horizon,
+# refreshed every schedule step, see /forecast.
+site_forecasts = {}
+# Boots, connector statuses, requests in progress and device model
+# variables, recovered on restart.
+state = StateStore('.')
+
+
+class ChargePoint(StationConnection):
+
+    __slots__ = ('_outstanding_call', '_handled_call', '_received_size',
+                 '_outbound', 'heartbeat_interval')
+
+    call_table = calls
+
+    @classmethod
+    def wrap_handler(cls, action, handler):
+        return timed_handler(metrics, action, handler)
+
+    def __init__(self, id, connection, **kwargs):
+        super().__init__(id, connection, **kwargs)
+        # OCPP allows one outstanding CALL per direction, so the action of
+        # the last CALL sent / received identifies the frames answering it.
+        self._outstanding_call = None
+        self._handled_call = None
+        self._received_size = 0
+        self._outbound = None
+        self.heartbeat_interval = (state.heartbeat_interval(id) or
+                                   HEARTBEAT_INTERVAL)
+
+    # Created on first use; most stations are idle most of the time.
+
+    @property
+    def outbound(self):
+        if self._outbound is None:
+            self._outbound = OutboundQueue(self._send_call,
+                                           scheduler=calls.scheduler)
+        return self._outbound
+
+    @property
+    def log(self):
+        return StationLogger(LOGGER, self.id)
+
+    async def call(self, payload, suppress=True, priority=None,
+                   deadline=None):
+        """ Queue the CALL behind the station's outstanding requests by
+        priority. deadline is a time.monotonic() value after which the
+        request is dropped, unsent, with outbound_queue.Expired.
+        """
+        return await self.outbound.submit(payload, suppress, priority,
+                                          deadline)
+
+    async def _send_call(self, payload, suppress=True):
+        action = action_of(payload)
+        for attempt in itertools.count():
+            start = time.perf_counter()
+            try:
+                return await super().call(payload, suppress)
+            except asyncio.TimeoutError:
+                # Only idempotent actions are sent again.
+                delay = calls.retry_delay(action, attempt)
+                if delay is None:
+                    raise
+            finally:
+                metrics.observe('ocpp_call_seconds', action,
+                                time.perf_counter() - start)
+            self.log.info("%s timed out, sending it again in %.1f s", action,
+                          delay, action=action)
+            await calls.scheduler.sleep(delay)
+
+    async def route_message(self, raw_msg):
+        # Any message from the station shows it is alive, not only
+        # Heartbeats.
+        liveness.touch(self.id, self.heartbeat_interval)
+        self._received_size = len(raw_msg)
+        if raw_msg.lstrip('[ \r\n\t')[:1] != '2':
+            metrics.observe('ocpp_payload_bytes_received',
+                            self._outstanding_call, self._received_size)
+            action = self._outstanding_call
+        elif journal is not None:
+            try:
+                action = raw_msg.split('"', 4)[3]
+            except IndexError:
+                action = None
+        if journal is not None:
+            journal.record(self.id, traffic_journal.IN, action, raw_msg)
+        await super().route_message(raw_msg)
+
+    async def _handle_call(self, msg):
+        self._handled_call = msg.action
+        metrics.observe('ocpp_payload_bytes_received', msg.action,
+                        self._received_size)
+        await super()._handle_call(msg)
+
+    async def _send(self, message):
+        if message.startswith('[2'):
+            # [2,"<unique id>","<action>",{...}]
+            self._outstanding_call = message.split('"', 4)[3]
+            action = self._outstanding_call
+        else:
+            action = self._handled_call
+        metrics.observe('ocpp_payload_bytes_sent', action, len(message))
+        if journal is not None:
+            journal.record(self.id, traffic_journal.OUT, action, message)
+        await super()._send(message)
+
+    # B01 - Cold Boot Charging Station
+    @on('BootNotification')
+    def on_boot_notification(self, charging_station, reason, **kwargs):
+        status, retry_interval = admission.admit(self.id)
+        if status == 'Accepted':
+            self.heartbeat_interval = heartbeat_intervals.interval(
+                len(registry))
+            # The interval of the response replaces the station's
+            # configured HeartbeatInterval.
+            device_model.set(self.id,
+                             variable_key(HEARTBEAT_INTERVAL_VARIABLE),
+                             str(self.heartbeat_interval))
+            state.boot(self.id, charging_station, reason,
+                       self.heartbeat_interval)
+        interval = retry_interval or self.heartbeat_interval
+        liveness.touch(self.id, interval)
+        return call_result.BootNotificationPayload(
+            current_time=datetime.utcnow().isoformat(),
+            interval=interval,
+            status=status
+        )
+
+    @on('StatusNotification')
+    def on_status_notification(self, timestamp, connector_status, evse_id,
+                               connector_id, **kwargs):
+        if connectors.update(self.id, evse_id, connector_id,
+                             connector_status, parse_timestamp(timestamp)):
+            state.status(self.id, evse_id, connector_id, connector_status)
+        return call_result.StatusNotificationPayload(
+        )
+
+    @on('Heartbeat')
+    def on_heartbeat(self):
+        # Hot path: no stdout write and no datetime formatting per station.
+        # route_message() already recorded the sign of life.
+        return call_result.HeartbeatPayload(
+            current_time=clock.now
+        )
+
+    # B05 - Set Variables
+    async def set_variables_request(self, set_variable_data=None,
+                                    deadline=None):
+        if set_variable_data is None:
+            set_variable_data = [
+                {
+                    'attributeType': 'Actual',
+                    'attributeValue': 'Required',
+                    'component': {
+                        'name': 'Akka EVACharge',
+                        'instance': 'some random value'
+                    },
+                    'variable': {
+                        'name': 'Required. Name of the variable'
+                    }
+                }
+            ]
+        request = call.SetVariablesPayload(
+            set_variable_data=set_variable_data
+        )
+        response = await self.call(request, deadline=deadline)
+        if response is not None:
+            device_model.record_set_results(
+                self.id, set_variable_data, response.set_variable_result)
+        return response
+
+    async def set_desired_variables(self, desired):
+        """ Bring the station to the desired set_variable_data state, only
+        sending variables that differ from the cached device model. Returns
+        the set_variable_result entries of all messages sent.
+        """
+        changed = device_model.diff(self.id, desired)
+        if changed and device_model.needs_limits(self.id):
+            await self.fetch_message_limits()
+        results = []
+        for batch in batches(changed, *device_model.limits(self.id)):
+            response = await self.set_variables_request(batch)
+            if response is not None:
+                results.extend(response.set_variable_result)
+        return results
+
+    async def fetch_message_limits(self):
+        """ Read the ItemsPerMessage and BytesPerMessage of Get- and
+        SetVariables into the device model; defaults are used when the
+        station doesn't report them.
+        """
+        request = call.GetVariablesPayload(get_variable_data=LIMIT_VARIABLES)
+        try:
+            response = await self.call(request)
+        except Exception as e:
+            self.log.warning("Reading the message limits failed: %r", e,
+                             action='GetVariables')
+            return
+        if response is not None:
+            device_model.record_get_results(self.id,
+                                            response.get_variable_result)
+
+    async def set_heartbeat_interval(self, interval):
+        """ Push a new HeartbeatInterval to the station with SetVariables.
+        Nothing is sent if the station already has it.
+        """
+        item = dict(HEARTBEAT_INTERVAL_VARIABLE, attributeValue=str(interval))
+        results = await self.set_desired_variables([item])
+        # The device model only holds values the station accepted.
+        if device_model.get(self.id, variable_key(item)) == str(interval):
+            self.heartbeat_interval = interval
+            liveness.touch(self.id, interval)
+        return results
+
+    # K01 - SetChargingProfile
+    async def set_charging_profile_request(self, evse_id=123456,
+                                           charging_profile=None,
+                                           deadline=None):
+        if charging_profile is None:
+            charging_profile = {
+                "id": 86087905,
+                "stackLevel": -42295823,
+                "chargingProfilePurpose": "TxProfile",
+                "chargingProfileKind": "Recurring",
+                "chargingSchedule": [
+                    {
+                        "id": 10452648,
+                        "chargingRateUnit": "A",
+                        "chargingSchedulePeriod": [
+                            {
+                                "startPeriod": 91941227,
+                                "limit": -27956571.491987333
+                            }
+                        ]
+                    }
+                ]
+            }
+        request = call.SetChargingProfilePayload(
+            evse_id=evse_id,
+            charging_profile=charging_profile
+        )
+
+        # A queued profile for the same EVSE and profile id is replaced by
+        # this one and its caller gets outbound_queue.Superseded.
+        response = await self.call(request, deadline=deadline)
+        if response is not None and response.status == 'Accepted':
+            self.log.info("SetChargingProfile accepted",
+                          action='SetChargingProfile')
+            profile_store.install(self.id, evse_id, charging_profile)
+        return response
+
+    async def clear_charging_profile_request(self, charging_profile_id=None,
+                                             charging_profile_criteria=None):
+        request = call.ClearChargingProfilePayload(
+            charging_profile_id=charging_profile_id,
+            charging_profile_criteria=charging_profile_criteria
+        )
+        response = await self.call(request)
+        if response is not None and response.status == 'Accepted':
+            if charging_profile_id is not None:
+                profile_store.remove(self.id, charging_profile_id)
+            else:
+                criteria = snake_to_camel_case(charging_profile_criteria or {})
+                profile_store.remove_matching(
+                    self.id, criteria.get('evseId'),
+                    criteria.get('chargingProfilePurpose'),
+                    criteria.get('stackLevel'))
+        return response
+
+    @on('TransactionEvent')
+    def on_transaction_event(self, event_type, transaction_info, evse=None,
+                             **kwargs):
+        key = (self.id, transaction_info['transaction_id'])
+        if evse is not None:
+            transaction_evses[key] = evse['id']
+        if event_type == 'Ended':
+            evse_id = transaction_evses.pop(key, None)
+            # TxProfiles end with their transaction on the station.
+            if evse_id is not None:
+                profile_store.remove_matching(
+                    self.id, evse_id, 'TxProfile',
+                    transaction_id=key[1])
+        return call_result.TransactionEventPayload()
+
+    # L02 - Secure Firmware Update
+    async def send_update_firmware_request(self, location=None,
+                                           request_id=123):
+        if location is None:
+            location = (artifact_server.firmware_url(firmware_image)
+                        if artifact_server else 'evacharge.akka.eu/software')
+        request = call.UpdateFirmwarePayload(
+            firmware={
+                'location': location,
+                'retrieve_date_time': datetime.utcnow().strftime(
+                    '%Y-%m-%dT%H:%M:%S'),
+                'signing_certificate': 'Optional: Certificate  with which the firmware was signed. PEM encoded X.509 certificate ',
+                'signature': 'Optional: Base64 encoded firmware signature'
+            },
+            request_id=request_id
+        )
+        response = await self.call(request)
+        if response is not None and response.status == 'Accepted':
+            self.log.info("Firmware update accepted", action='UpdateFirmware')
+            state.start_request(self.id, request_id, 'UpdateFirmware')
+        return response
+
+    @on('FirmwareStatusNotification')
+    def on_firmware_status_notification(self, status, request_id=None,
+                                        **kwargs):
+        if request_id is not None:
+            state.request_status(
+                self.id, request_id, status,
+                FIRMWARE_STATUSES.get(status) in (INSTALLED, FAILED))
+        rollout = rollouts.get(request_id)
+        owner = rollout_worker(request_id)
+        if rollout is not None:
+            rollout.on_status(self.id, status)
+        elif owner is not None:
+            bus.notify(owner, 'firmware_status', {
+                'station_id': self.id, 'status': status,
+                'request_id': request_id})
+        else:
+            self.log.info("FirmwareStatusNotification %s", status,
+                          action='FirmwareStatusNotification')
+        return call_result.FirmwareStatusNotificationPayload()
+
+    # M01 - Certificate installation EV
+    @on('Get15118EVCertificate')
+    async def on_get_15118_ev_certificate(self, iso15118_schema_version,
+                                          action, exi_request, **kwargs):
+        status, exi_response = await certificates.get(
+            iso15118_schema_version, action, exi_request)
+        return call_result.Get15118EVCertificatePayload(
+            status=status,
+            exi_response=exi_response
+        )
+
+    # N01 - Retrieve Log Information
+    async def get_log_request(self, remote_location=None,
+                              request_id=1234, retries=2, retry_interval=30):
+        if remote_location is None:
+            remote_location = (artifact_server.upload_url(self.id)
+                               if artifact_server else 'eiusmod ut')
+        request = call.GetLogPayload(
+            log_type='DiagnosticsLog',
+            request_id=request_id,
+            retries=retries,
+            retry_interval=retry_interval,
+            log={
+                'remoteLocation': remote_location,
+                'oldestTimestamp': '2007-05-29T05:26:25.665Z',
+                'latestTimestamp': '2020-12-05T19:31:32.232Z'
+            }
+        )
+
+        response = await self.call(request)
+        if response is not None and response.status == 'Accepted':
+            self.log.info("GetLog accepted", action='GetLog')
+            state.start_request(self.id, request_id, 'GetLog')
+        return response
+
+    @on('LogStatusNotification')
+    def on_log_status_notification(self, status, request_id=None, **kwargs):
+        if request_id is not None:
+            state.request_status(self.id, request_id, status,
+                                 status != 'Uploading')
+        self.log.info("LogStatusNotification %s", status,
+                      action='LogStatusNotification')
+        return call_result.LogStatusNotificationPayload()
+
+
+# Outbound operation each use case used to send as soon as a station
+# connected to its own central_system_<use case>.py script.
+ON_CONNECT_OPERATIONS = {
+    'B05': 'set_variables_request',
+    'K01': 'set_charging_profile_request',
+    'L02': 'send_update_firmware_request',
+    'N01': 'get_log_request',
+}
+
+
+# Actions of the CALLs an outbound operation sends; an operation routed over
+# the bus is waited for as long as they may take, with their retries.
+OPERATION_ACTIONS = {
+    'set_variables_request': ('SetVariables',),
+    'set_desired_variables': ('GetVariables', 'SetVariables'),
+    'set_heartbeat_interval': ('GetVariables', 'SetVariables'),
+    'fetch_message_limits': ('GetVariables',),
+    'set_charging_profile_request': ('SetChargingProfile',),
+    'clear_charging_profile_request': ('ClearChargingProfile',),
+    'send_update_firmware_request': ('UpdateFirmware',),
+    'get_log_request': ('GetLog',),
+}
+# Seconds a routed operation may wait behind the station's other CALLs, on
+# top of the time its own CALLs take.
+ROUTE_QUEUE_MARGIN = 30
+
+
+def route_timeout(operation):
+    """ Seconds to wait for an operation run by another worker. """
+    actions = OPERATION_ACTIONS.get(operation, (None,))
+    return ROUTE_QUEUE_MARGIN + sum(calls.budget(a) for a in actions)
+
+
+async def _send_local_request(station_id, operation, **kwargs):
+    charge_point = registry.get(station_id)
+    if charge_point is None:
+        raise KeyError(f"Station {station_id} is not connected")
+    return await getattr(charge_point, operation)(**kwargs)
+
+
+async def send_request(station_id, operation, **kwargs):
+    """ Run an outbound operation, e.g. 'get_log_request', against the
+    station with the given id. When running with several workers, stations
+    connected to another worker are reached over the bus. Raises KeyError,
+    or sharding.RemoteError, if the station isn't connected.
+    """
+    if bus is None or station_id in registry:
+        return await _send_local_request(station_id, operation, **kwargs)
+    return await bus.route(station_id, operation, kwargs,
+                           route_timeout(operation))
+
+
+async def broadcast_set_variables(set_variable_data, station_ids=None,
+                                  concurrency=500):
+    """ Send the same SetVariables request to the given stations, or to
+    every connected station, and return the aggregated BroadcastReport.
+    """
+    if station_ids is None:
+        charge_points = list(registry)
+    else:
+        charge_points = [registry.get(i) for i in station_ids
+                         if i in registry]
+    request = call.SetVariablesPayload(set_variable_data=set_variable_data)
+
+    def record(charge_point, response):
+        device_model.record_set_results(
+            charge_point.id, set_variable_data, response.set_variable_result)
+
+    return await broadcast(charge_points, request, concurrency,
+                           on_response=record)
+
+
+async def _run_on_connect(charge_point, operation):
+    # Done before the station reconnected, or before a restart.
+    if state.done(charge_point.id, operation):
+        return
+    # A station that doesn't implement one of the use cases must not lose
+    # its connection because of it.
+    try:
+        response = await getattr(charge_point, operation)()
+        if response is not None and \
+                getattr(response, 'status', 'Accepted') == 'Accepted':
+            state.operation_done(charge_point.id, operation)
+    except Dropped as e:
+        charge_point.log.info("%s not sent: %s", operation, e)
+    except Exception:
+        charge_point.log.exception("%s failed", operation)
+
+
+def rollout_worker(request_id):
+    """ Id of the other worker running the rollout of the request id, or
+    None.
+    """
+    if bus is None or request_id is None or \
+            request_id < ROLLOUT_REQUEST_ID_BASE:
+        return None
+    worker_id = (request_id - ROLLOUT_REQUEST_ID_BASE) % workers
+    return worker_id if worker_id != bus.worker_id else None
+
+
+def is_home(station_id):
+    """ Whether this worker keeps the persisted state of the station. """
+    return bus is None or home_worker(station_id, workers) == bus.worker_id
+
+
+def _forward_state(record):
+    bus.notify(home_worker(record['s'], workers), 'state_record',
+               {'record': record})
+
+
+def _forward_profile(record):
+    bus.notify(home_worker(record['station'], workers), 'profile_record',
+               {'record': record})
+
+
+async def fetch_station_state(station_id):
+    """ Load the state and charging profiles of a station that connected to
+    this worker from the worker keeping them.
+    """
+    home = home_worker(station_id, workers)
+    try:
+        kept = await bus.ask(home, 'station_state',
+                             {'station_id': station_id},
+                             STATE_FETCH_TIMEOUT)
+    except Exception as e:
+        LOGGER.warning("Fetching the state of %s from worker %d failed: %r",
+                       station_id, home, e)
+        return
+    state.adopt(station_id, kept['state'])
+    profile_store.adopt(station_id, kept['profiles'])
+    device_model.restore(station_id, state.variables(station_id))
+
+
+def _forget_station(station_id):
+    # Another worker holds the station now and watches it.
+    liveness.forget(station_id)
+    connectors.forget(station_id)
+
+
+def _on_bus_event(event, **kwargs):
+    if event == 'firmware_status':
+        # Stations of a rollout report to the worker they are connected
+        # to, which passes it on to the worker running the rollout.
+        rollout = rollouts.get(kwargs['request_id'])
+        if rollout is not None:
+            rollout.on_status(kwargs['station_id'], kwargs['status'])
+    elif event == 'state_record':
+        state.apply_remote(kwargs['record'])
+    elif event == 'profile_record':
+        profile_store.apply_remote(kwargs['record'])
+    elif event == 'station_state':
+        station_id = kwargs['station_id']
+        if station_id not in registry:
+            _forget_station(station_id)
+        return {'state': state.export(station_id),
+                'profiles': profile_store.export(station_id)}
+    elif event == 'station_moved':
+        station_id = kwargs['station_id']
+        # Unless it has reconnected here meanwhile.
+        if station_id not in registry:
+            _forget_station(station_id)
+            if not is_home(station_id):
+                state.drop(station_id)
+                profile_store.drop(station_id)
+                device_model.forget(station_id)
+
+
+def start_firmware_rollout(station_ids, location, **kwargs):
+    """ Start a staged UpdateFirmware rollout to the given stations. Keyword
+    arguments are passed on to FirmwareRollout. Await rollout.done to wait
+    for completion.
+    """
+    request_id = next(_rollout_request_ids)
+
+    async def send(station_id, request_id):
+        response = await send_request(
+            station_id, 'send_update_firmware_request',
+            location=location, request_id=request_id)
+        return response is not None and response.status == 'Accepted'
+
+    rollout = FirmwareRollout(station_ids, send, request_id, **kwargs)
+    rollouts[request_id] = rollout
+    # The rollout logged its summary when done resolves; later notifications
+    # of its request id are only logged.
+    rollout.start().add_done_callback(
+        lambda _: rollouts.pop(request_id, None))
+    return rollout
+
+
+async def retune_heartbeat_intervals(period=60, threshold=0.25,
+                                     concurrency=100):
+    """ Every period, push the current adaptive heartbeat interval to
+    connected stations whose interval differs from it by more than the
+    threshold.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def retune(charge_point, interval):
+        async with semaphore:
+            try:
+                await charge_point.set_heartbeat_interval(interval)
+            except Exception as e:
+                charge_point.log.warning("Setting HeartbeatInterval failed: "
+                                         "%r", e, action='SetVariables')
+
+    while True:
+        await asyncio.sleep(period)
+        interval = heartbeat_intervals.interval(len(registry))
+        stale = [charge_point for charge_point in registry
+                 if abs(charge_point.heartbeat_interval - interval) >
+                 threshold * charge_point.heartbeat_interval]
+        if stale:
+            LOGGER.info("Pushing HeartbeatInterval %d to %d stations",
+                        interval, len(stale))
+            await asyncio.gather(*[retune(charge_point, interval)
+                                   for charge_point in stale])
+
+
+async def push_site_limit(station_id, evse_id, limit):
+    """ Install the load balancer's limit on an EVSE. Returns True when
+    the station accepted it, or a newer limit replaced it in the queue.
+    """
+    charge_point = registry.get(station_id)
+    if charge_point is None:
+        return False
+    try:
+        response = await charge_point.set_charging_profile_request(
+            evse_id, site_limit_profile(limit),
+            deadline=time.monotonic() + SITE_LIMIT_DEADLINE)
+    except Superseded:
+        return True
+    except Dropped:
+        return False
+    return response is not None and response.status == 'Accepted'
+
+
+async def forecast_sites():
+    """ Once per schedule step, sum the composite schedules of the EVSEs
+    of every site into the site's forecast.
+    """
+    while True:
+        now = time.time()
+        evses = connectors.site_evses()
+        try:
+            for site, keys in evses.items():
+                site_forecasts[site] = schedule_engine.site_forecast(keys,
+                                                                     now)
+        except Exception:
+            LOGGER.exception("Failed to forecast the site limits")
+        for site in set(site_forecasts) - set(evses):
+            del site_forecasts[site]
+        await asyncio.sleep(schedule_engine.step)
+
+
+def forecast_query(params):
+    """ Answer an HTTP query: ?site=X. Returns a JSON body with the site's
+    limit in W per schedule step.
+    """
+    site = params['site']
+    if site not in site_forecasts:
+        # A site that got its first EVSE since the last step.
+        site_forecasts[site] = schedule_engine.site_forecast(
+            connectors.site_evses()[site])
+    times, limits = site_forecasts[site]
+    return json.dumps({'site': site, 'start': float(times[0]),
+                       'step': schedule_engine.step,
+                       'limits': limits.tolist()}).encode()
+
+
+def restore_state():
+    """ Load the persisted state and bring the in-memory caches up to date
+    with it, without asking any station.
+    """
+    state.load()
+    in_progress = 0
+    for station_id, station in state.stations.items():
+        for key, value in state.variables(station_id):
+            device_model.set(station_id, key, value)
+        # Known stations that don't come back are flagged as usual.
+        if station['boot'] is not None:
+            liveness.touch(station_id, station['interval'])
+        in_progress += len(station['pending'])
+        # Without a timestamp; any new StatusNotification replaces these.
+        for connector, status in station['connectors'].items():
+            evse_id, connector_id = connector.split('/')
+            connectors.update(station_id, int(evse_id), int(connector_id),
+                              status, 0)
+        # Not connected until it connects again.
+        connectors.set_offline(station_id)
+    device_model.add_listener(state.variable)
+    logging.info("Restored %d stations with %d requests in progress",
+                 len(state), in_progress)
+
+
+def _on_connect_factory(use_cases):
+    operations = [ON_CONNECT_OPERATIONS[u] for u in use_cases
+                  if u in ON_CONNECT_OPERATIONS]
+
+    async def on_connect(websocket, path):
+        """ For every new charge point that connects, create a ChargePoint
+        instance, register it and start listening for messages.
+        """
+        try:
+            requested_protocols = websocket.request_headers[
+                'Sec-WebSocket-Protocol']
+        except KeyError:
+            logging.info("Client hasn't requested any Subprotocol. "
+                         "Closing Connection")
+            return await websocket.close()
+        if websocket.subprotocol:
+            logging.info("Protocols Matched: %s", websocket.subprotocol)
+        else:
+            # In the websockets lib if no subprotocols are supported by the
+            # client and the server, it proceeds without a subprotocol,
+            # so we have to manually close the connection.
+            logging.warning('Protocols Mismatched | Expected Subprotocols: %s,'
+                            ' but client supports %s | Closing connection',
+                            websocket.available_subprotocols,
+                            requested_protocols)
+            return await websocket.close()
+
+        charge_point_id = path.strip('/')
+        if not is_home(charge_point_id):
+            await fetch_station_state(charge_point_id)
+        charge_point = ChargePoint(charge_point_id, websocket)
+        registry.register(charge_point)
+        connectors.set_offline(charge_point_id, False)
+        if bus is not None:
+            await bus.register(charge_point_id)
+        # The handshake headers aren't needed any more; don't keep them for
+        # the lifetime of the connection.
+        websocket.request_headers = websocket.response_headers = None
+        try:
+            if operations:
+                await asyncio.gather(
+                    charge_point.start(),
+                    *[_run_on_connect(charge_point, op) for op in operations]
+                )
+            else:
+                await charge_point.start()
+        except websockets.exceptions.ConnectionClosed:
+            charge_point.log.info("Station disconnected")
+        finally:
+            if registry.get(charge_point_id) is charge_point:
+                # The station stays on the liveness wheel with its last
+                # deadline: a station that dropped its socket and doesn't
+                # come back is what the wheel reports.
+                connectors.set_offline(charge_point_id)
+                validation_policy.forget(charge_point_id)
+                admission.forget(charge_point_id)
+                if bus is not None:
+                    await bus.unregister(charge_point_id)
+            registry.unregister(charge_point)
+            # Fail what waits for a response on this socket now, rather
+            # than when the timeouts expire.
+            calls.cancel(charge_point)
+            if charge_point._outbound is not None:
+                charge_point.outbound.close()
+
+    return on_connect
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Central system serving all OCPP use cases on one port.")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=9000)
+    parser.add_argument(
+        '--on-connect', nargs='*', default=[], metavar='USE_CASE',
+        choices=sorted(ON_CONNECT_OPERATIONS),
+        help="Use cases whose request is sent to every station when it "
+             "connects, e.g. --on-connect B05 L02.")
+    parser.add_argument(
+        '--data-dir', default='.',
+        help="Directory holding the charging profile store.")
+    parser.add_argument(
+        '--artifact-port', type=int, default=None,
+        help="Serve firmware and receive log uploads over HTTP on this "
+             "port, and advertise it in UpdateFirmware and GetLog.")
+    parser.add_argument('--artifact-url', default=None,
+                        help="Public base URL of the artifact server. "
+                             "Defaults to --host, or to the fully qualified "
+                             "name of this machine when --host is a "
+                             "wildcard address.")
+    parser.add_argument('--firmware-dir', default='firmware')
+    parser.add_argument('--firmware-image', default='firmware.bin')
+    parser.add_argument('--upload-dir', default='uploads')
+    parser.add_argument(
+        '--metrics-port', type=int, default=None,
+        help="Serve per-action histograms on http://localhost:<port>/metrics.")
+    parser.add_argument(
+        '--metrics-interval', type=float, default=0,
+        help="Log a metrics summary every this many seconds, 0 to disable.")
+    parser.add_argument(
+        '--sites', default=None, metavar='FILE',
+        help="JSON object mapping station ids to sites, for the connector "
+             "counts served on /availability of the metrics port.")
+    parser.add_argument(
+        '--site-capacity', nargs='*', metavar='SITE=WATTS',
+        help="Grid capacity of a site, shared between its occupied EVSEs "
+             "with SetChargingProfile.")
+    parser.add_argument('--evse-max-power', type=float, default=22000,
+                        help="Maximum power of an EVSE in Watt.")
+    parser.add_argument('--min-charging-power', type=float, default=1380,
+                        help="EVSEs that can't get this many Watt are "
+                             "paused.")
+    parser.add_argument(
+        '--rebalance-threshold', type=float, default=500,
+        help="Smallest change of an EVSE limit, in Watt, pushed to the "
+             "station.")
+    parser.add_argument(
+        '--max-heartbeat-interval', type=int, default=600,
+        help="Longest heartbeat interval given to stations. The interval "
+             "grows with the fleet size and the server load.")
+    parser.add_argument(
+        '--heartbeats-per-second', type=float, default=200,
+        help="Heartbeat rate of the whole fleet the interval aims for.")
+    parser.add_argument(
+        '--push-heartbeat-interval', type=float, default=0,
+        metavar='PERIOD',
+        help="Every PERIOD seconds push the current heartbeat interval "
+             "with SetVariables to stations whose interval is off by more "
+             "than 25%%, 0 to disable.")
+    parser.add_argument(
+        '--missed-heartbeats', type=int, default=3,
+        help="Flag a station after this many missed heartbeats.")
+    parser.add_argument(
+        '--boot-rate', type=float, default=200,
+        help="BootNotifications accepted per second, others are answered "
+             "with Pending and a jittered retry interval.")
+    parser.add_argument(
+        '--boot-burst', type=float, default=None,
+        help="BootNotifications accepted at once, defaults to --boot-rate.")
+    parser.add_argument(
+        '--trust-after', type=int, default=None,
+        help="Only sample the validation of payloads from stations which "
+             "sent this many valid messages. By default every payload is "
+             "validated.")
+    parser.add_argument(
+        '--validation-sample-rate', type=float, default=0.01,
+        help="Fraction of payloads of trusted stations still validated.")
+    # Per-connection limits of the WebSocket server, see
+    # bench_idle_connections.py. OCPP frames are small and a station has at
+    # most one CALL in flight per direction.
+    parser.add_argument('--ws-max-size', type=int, default=64 * 1024,
+                        help="Largest frame accepted from a station.")
+    parser.add_argument('--ws-max-queue', type=int, default=4,
+                        help="Frames buffered per station before reading "
+                             "from it pauses.")
+    parser.add_argument('--ws-read-limit', type=int, default=16 * 1024)
+    parser.add_argument('--ws-write-limit', type=int, default=16 * 1024)
+    parser.add_argument(
+        '--ws-ping-interval', type=float, default=0,
+        help="Seconds between WebSocket pings, 0 to leave pinging to the "
+             "stations (WebSocketPingInterval); liveness is tracked from "
+             "OCPP traffic either way.")
+    parser.add_argument(
+        '--ws-compression', action='store_true',
+        help="Negotiate permessage-deflate, at the cost of a compressor per "
+             "station.")
+    parser.add_argument(
+        '--call-timeout', nargs='*', default=[], metavar='ACTION=SECONDS',
+        help="Seconds to wait for the response to a CALL of the action, "
+             "e.g. --call-timeout UpdateFirmware=300. See call_table.py for "
+             "the defaults.")
+    parser.add_argument(
+        '--call-retries', type=int, default=2,
+        help="Times an idempotent CALL that timed out is sent again.")
+    parser.add_argument(
+        '--call-backoff', type=float, default=1.0,
+        help="Seconds before the first retry; doubled for every further "
+             "one and jittered.")
+    parser.add_argument(
+        '--certificate-pool', choices=['thread', 'process'],
+        default='thread',
+        help="Pool processing Get15118EVCertificate requests; use process "
+             "when the EXI and certificate work holds the GIL.")
+    parser.add_argument(
+        '--certificate-concurrency', type=int, default=4,
+        help="Get15118EVCertificate requests processed at once.")
+    parser.add_argument(
+        '--certificate-queue', type=int, default=100,
+        help="Get15118EVCertificate requests that may wait for the pool, "
+             "further ones are answered Failed.")
+    parser.add_argument(
+        '--certificate-cache-ttl', type=float, default=60,
+        help="Seconds a Get15118EVCertificate response is reused for an "
+             "identical request.")
+    parser.add_argument(
+        '--journal-dir', default=None,
+        help="Record every frame sent and received to a binary traffic "
+             "journal in this directory, see replay_journal.py.")
+    parser.add_argument(
+        '--journal-segment-size', type=int, default=64, metavar='MIB',
+        help="Size of the journal segment files.")
+    parser.add_argument(
+        '--log-format', choices=['json', 'text'], default='json',
+        help="Log one JSON object per line, or plain text.")
+    parser.add_argument(
+        '--log-sample', nargs='*', default=[], metavar='ACTION=RATE',
+        help="Fraction of the info records of an action to keep, e.g. "
+             "--log-sample Heartbeat=0.01. Heartbeat and "
+             "StatusNotification are sampled by default.")
+    parser.add_argument(
+        '--log-rate-limit', type=float, default=100,
+        help="Info records per second and action (or logger) at most, 0 "
+             "for no limit.")
+    parser.add_argument(
+        '--workers', type=int, default=1,
+        help="Number of worker processes sharing the port.")
+    parser.add_argument(
+        '--bus-path', default=None,
+        help="Unix socket of the worker bus, defaults to a temporary file.")
+    return parser.parse_args()
+
+
+async def serve(args, worker_id=None, bus_path=None):
+    """ Run the central system. With a worker_id it runs as one of
+    several workers sharing the port, connected to the bus at bus_path.
+    """
+    global artifact_server, firmware_image, bus, journal, load_balancer, \
+        workers, _rollout_request_ids
+    liveness.missed_heartbeats = args.missed_heartbeats
+    # Stations must expire within the span of the liveness wheel.
+    heartbeat_intervals.max_interval = min(
+        args.max_heartbeat_interval,
+        LIVENESS_MAX_TIMEOUT // args.missed_heartbeats)
+    heartbeat_intervals.heartbeats_per_second = args.heartbeats_per_second
+    # Workers share the admission rate.
+    share = 1 if worker_id is None else args.workers
+    admission.bucket = TokenBucket(
+        args.boot_rate / share,
+        args.boot_burst / share if args.boot_burst else None)
+    if args.trust_after is not None:
+        validation_policy.trust_after = args.trust_after
+        validation_policy.sample_rate = args.validation_sample_rate
+        ChargePoint.validation_policy = validation_policy
+    # Each worker writes the profiles and state of the stations it is the
+    # home_worker() of; the files are found again as long as --workers
+    # stays the same.
+    suffix = '' if worker_id is None else f'-{worker_id}'
+    profile_store.path = os.path.join(args.data_dir,
+                                      f'charging_profiles{suffix}.jsonl')
+    profile_store.load()
+    state.directory = os.path.join(args.data_dir, f'state{suffix}')
+    os.makedirs(state.directory, exist_ok=True)
+    if args.sites is not None:
+        connectors.sites = load_sites(args.sites)
+    if args.site_capacity:
+        # With several workers each balances the stations connected to it.
+        load_balancer = SiteLoadBalancer(
+            connectors, push_site_limit,
+            parse_capacities(args.site_capacity),
+            evse_max_power=args.evse_max_power,
+            min_power=args.min_charging_power,
+            threshold=args.rebalance_threshold)
+    calls.timeouts.update(parse_timeouts(args.call_timeout))
+    calls.retries = args.call_retries
+    calls.backoff = args.call_backoff
+    certificates.pool = args.certificate_pool
+    certificates.concurrency = args.certificate_concurrency
+    certificates.max_queue = args.certificate_queue
+    certificates.ttl = args.certificate_cache_ttl
+    restore_state()
+    if args.journal_dir is not None:
+        journal = traffic_journal.TrafficJournal(
+            os.path.join(args.journal_dir, f'journal{suffix}'),
+            args.journal_segment_size * 1024 * 1024)
+        journal.open()
+    if args.artifact_port is not None:
+        artifact_server = ArtifactServer(
+            args.firmware_dir, args.upload_dir, args.host, args.artifact_port,
+            public_url=args.artifact_url)
+        firmware_image = args.firmware_image
+        if worker_id is None:
+            # With several workers the supervisor serves the artifacts.
+            await artifact_server.start()
+    if worker_id is not None:
+        bus = WorkerBus(bus_path, worker_id, _send_local_request,
+                        call_result, on_event=_on_bus_event)
+        await bus.connect()
+        workers = args.workers
+        state.persists = profile_store.persists = is_home
+        state.forward = _forward_state
+        profile_store.forward = _forward_profile
+        _rollout_request_ids = itertools.count(
+            ROLLOUT_REQUEST_ID_BASE + worker_id, workers)
+    # One task per server refreshes the clock and turns the liveness wheel,
+    # instead of one timer per station.
+    background = [asyncio.ensure_future(clock.run()),
+                  asyncio.ensure_future(liveness.run()),
+                  asyncio.ensure_future(profile_store.run()),
+                  asyncio.ensure_future(state.run()),
+                  asyncio.ensure_future(schedule_engine.run()),
+                  asyncio.ensure_future(forecast_sites()),
+                  asyncio.ensure_future(heartbeat_intervals.run())]
+    if args.push_heartbeat_interval:
+        background.append(asyncio.ensure_future(
+            retune_heartbeat_intervals(args.push_heartbeat_interval)))
+    if bus is not None:
+        background.append(asyncio.ensure_future(bus.run()))
+    if load_balancer is not None:
+        background.append(asyncio.ensure_future(load_balancer.run()))
+    if args.metrics_port is not None:
+        await metrics.serve('127.0.0.1',
+                            args.metrics_port + (worker_id or 0),
+                            routes={'/availability': connectors.query,
+                                    '/forecast': forecast_query})
+    if args.metrics_interval:
+        background.append(asyncio.ensure_future(
+            metrics.dump_periodically(args.metrics_interval)))
+    #  deepcode ignore BindToAllNetworkInterfaces: <Example Purposes>
+    server = await websockets.serve(
+        _on_connect_factory(args.on_connect),
+        args.host,
+        args.port,
+        subprotocols=['ocpp2.0.1'],
+        reuse_port=worker_id is not None,
+        max_size=args.ws_max_size,
+        max_queue=args.ws_max_queue,
+        read_limit=args.ws_read_limit,
+        write_limit=args.ws_write_limit,
+        ping_interval=args.ws_ping_interval or None,
+        compression='deflate' if args.ws_compression else None,
+    )
+
+    logging.info("Server Started listening to new connections...")
+    await server.wait_closed()
+    for task in background:
+        task.cancel()
+    certificates.close()
+    await profile_store.flush()
+    await state.flush()
+    if journal is not None:
+        journal.close()
+
+
+def _setup_logging(args):
+    setup_logging(fmt=args.log_format,
+                  sample_rates=parse_sample_rates(args.log_sample),
+                  rate_limit=args.log_rate_limit)
+
+
+def _run_worker(args, worker_id, bus_path):
+    _setup_logging(args)
+    asyncio.run(serve(args, worker_id, bus_path))
+
+
+async def supervise(args):
+    """ Start args.workers worker processes on the same port and run the
+    bus broker relaying outbound operations between them.
+    """
+    bus_path = args.bus_path or os.path.join(
+        tempfile.mkdtemp(prefix='central_system-'), 'bus.sock')
+    broker = Broker(bus_path, call_result)
+    await broker.start()
+    if args.artifact_port is not None:
+        await ArtifactServer(
+            args.firmware_dir, args.upload_dir, args.host, args.artifact_port,
+            public_url=args.artifact_url).start()
+
+    context = multiprocessing.get_context('spawn')
+    workers = [context.Process(target=_run_worker,
+                               args=(args, worker_id, bus_path))
+               for worker_id in range(args.workers)]
+    for worker in workers:
+        worker.start()
+    logging.info("Started %d workers, bus at %s", len(workers), bus_path)
+
+    loop = asyncio.get_running_loop()
+    try:
+        await asyncio.gather(*[loop.run_in_executor(None, worker.join)
+                               for worker in workers])
+    finally:
+        for worker in workers:
+            worker.terminate()
+        await broker.close()
+
+
+async def main():
+    args = parse_args()
+    _setup_logging(args)
+    if args.workers > 1:
+        await supervise(args)
+    else:
+        await serve(args)
+
+
+if __name__ == '__main__':
+    try:
+        # asyncio.run() is used when running this example with Python 3.7 and
+        # higher.
+        asyncio.run(main())
+    except AttributeError:
+        # For Python 3.6 a bit more code is required to run the main() task on
+        # an event loop.
+        loop = asyncio.get_event_loop()
+        loop.run_until_complete(main())
+        loop.close()
@@ -0,0 +1,289 @@
+""" Composite charging schedule engine.
+
+Merges the charging profiles installed on each EVSE (see profile_store.py)
+into the schedule the station will actually apply, evaluated on a fixed time
+grid with NumPy:
+
+* within a purpose the valid profile with the highest stackLevel wins, an
+  EVSE specific profile before an evseId 0 one of the same stackLevel,
+* a TxProfile overrules the TxDefaultProfile,
+* ChargingStationMaxProfile and ChargingStationExternalConstraints cap the
+  result. They are applied per EVSE, which is exact for single EVSE stations
+  and an upper bound otherwise.
+* a profile with several chargingSchedules (ISO 15118 lets the EV pick one)
+  is evaluated with the highest of them, again an upper bound.
+
+All limits are converted to Watt. Composites are cached per EVSE and only
+EVSEs whose profiles changed are recomputed, all of them in one batch.
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime, timezone
+
+try:
+    import numpy as np
+except ModuleNotFoundError:
+    print("This example relies on the 'numpy' package.")
+    print("Please install it by running: ")
+    print()
+    print(" $ pip install numpy")
+    import sys
+    sys.exit(1)
+
+LOGGER = logging.getLogger('central_system.charging_schedule')
+
+RECURRENCY_PERIODS = {'Daily': 24 * 3600, 'Weekly': 7 * 24 * 3600}
+
+MAX_PURPOSES = ('ChargingStationMaxProfile',
+                'ChargingStationExternalConstraints')
+
+
+def parse_timestamp(value):
+    if value is None:
+        return None
+    if value.endswith('Z'):
+        value = value[:-1] + '+00:00'
+    timestamp = datetime.fromisoformat(value)
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return timestamp.timestamp()
+
+
+def evaluate_profiles(profiles, times, voltage=230.0, default_phases=3,
+                      relative_start=None):
+    """ Evaluate charging profiles on a time grid.
+
+    `profiles` is a sequence of chargingProfile dicts as sent in
+    SetChargingProfile, `times` an array of epoch seconds. Returns an array
+    of shape (len(profiles), len(times)) with the limit in Watt, or NaN where
+    a profile isn't active.
+    """
+    times = np.asarray(times, dtype=np.float64)
+    if relative_start is None:
+        relative_start = times[0] if len(times) else 0.0
+
+    # One row per schedule; the rows of a profile are merged at the end.
+    first_rows = []
+    schedules = []
+    owners = []
+    for profile in profiles:
+        first_rows.append(len(schedules))
+        schedules.extend(profile['chargingSchedule'])
+        owners.extend([profile] * len(profile['chargingSchedule']))
+    profiles = owners
+    n_profiles = len(schedules)
+    n_periods = max([len(s['chargingSchedulePeriod']) for s in schedules],
+                    default=1)
+
+    # Periods padded to the same length: unused start periods never match.
+    starts = np.full((n_profiles, n_periods), np.inf)
+    limits = np.full((n_profiles, n_periods), np.nan)
+    origin = np.zeros(n_profiles)
+    cycle = np.zeros(n_profiles)
+    duration = np.full(n_profiles, np.inf)
+    valid_from = np.full(n_profiles, -np.inf)
+    valid_to = np.full(n_profiles, np.inf)
+
+    for i, (profile, schedule) in enumerate(zip(profiles, schedules)):
+        periods = schedule['chargingSchedulePeriod']
+        in_amps = schedule['chargingRateUnit'] == 'A'
+        for k, period in enumerate(periods):
+            starts[i, k] = period['startPeriod']
+            limit = period['limit']
+            if in_amps:
+                limit *= voltage * period.get('numberPhases', default_phases)
+            limits[i, k] = limit
+
+        kind = profile['chargingProfileKind']
+        start_schedule = parse_timestamp(schedule.get('startSchedule'))
+        if kind == 'Relative' or start_schedule is None:
+            origin[i] = relative_start
+        else:
+            origin[i] = start_schedule
+        if kind == 'Recurring':
+            cycle[i] = RECURRENCY_PERIODS[profile.get('recurrencyKind',
+                                                      'Daily')]
+        if 'duration' in schedule:
+            duration[i] = schedule['duration']
+        if 'validFrom' in profile:
+            valid_from[i] = parse_timestamp(profile['validFrom'])
+        if 'validTo' in profile:
+            valid_to[i] = parse_timestamp(profile['validTo'])
+
+    if n_profiles == 0:
+        return np.empty((0, len(times)))
+
+    offset = times[None, :] - origin[:, None]
+    recurring = cycle > 0
+    if recurring.any():
+        # Before startSchedule a recurring profile isn't active yet.
+        repeated = offset[recurring]
+        offset[recurring] = np.where(
+            repeated >= 0, np.mod(repeated, cycle[recurring, None]),
+            repeated)
+
+    # Find the active period of every (profile, time) pair with a single
+    # searchsorted: offsets and start periods are clipped to one span and
+    # every profile is shifted into its own, non-overlapping range.
+    finite = starts[np.isfinite(starts)]
+    low = -1.0
+    high = (finite.max() if finite.size else 0.0) + 1.0
+    span = high - low + 2.0
+    shift = np.arange(n_profiles, dtype=np.float64)[:, None] * span
+    keys = np.where(np.isfinite(starts), starts, high + 0.5) - low + shift
+    needles = np.clip(offset, low, high) - low + shift
+    index = (np.searchsorted(keys.ravel(), needles.ravel(), side='right')
+             .reshape(offset.shape) - 1
+             - np.arange(n_profiles)[:, None] * n_periods)
+
+    values = np.take_along_axis(limits, np.clip(index, 0, n_periods - 1),
+                                axis=1)
+    active = ((index >= 0) & (offset >= 0) &
+              (offset < duration[:, None]) &
+              (times[None, :] >= valid_from[:, None]) &
+              (times[None, :] < valid_to[:, None]))
+    values = np.where(active, values, np.nan)
+    if len(first_rows) == n_profiles:
+        return values
+    return np.fmax.reduceat(values, first_rows, axis=0)
+
+
+def _highest_stack_level(rows):
+    """ First non-NaN value per time step of rows ordered by precedence. """
+    merged = np.full(rows.shape[1], np.nan)
+    for row in rows:
+        merged = np.where(np.isnan(merged), row, merged)
+    return merged
+
+
+class CompositeScheduleEngine:
+
+    def __init__(self, store, step=60, horizon=24 * 3600, voltage=230.0,
+                 evse_max_power=22000.0):
+        self.store = store
+        self.step = step
+        self.horizon = horizon
+        self.voltage = voltage
+        self.evse_max_power = evse_max_power
+
+        self._window_start = None
+        self._times = None
+        # (station id, evse id) -> composite limit in W on self._times
+        self._cache = {}
+        # station id -> evse ids with a cached composite
+        self._evses = {}
+        self._dirty = set()
+
+    def invalidate(self, station_id, evse_id):
+        """ Mark composites as stale after a profile of the EVSE changed. A
+        change on evseId 0 affects all EVSEs of the station.
+        """
+        if evse_id == 0:
+            for evse in self._evses.get(station_id, ()):
+                self._dirty.add((station_id, evse))
+        else:
+            self._dirty.add((station_id, evse_id))
+
+    def _roll_window(self, now):
+        # The window covers twice the horizon, so it only has to be rebuilt
+        # (and everything recomputed) once per horizon.
+        start = now - now % self.step
+        self._window_start = start
+        self._times = np.arange(start, start + 2 * self.horizon, self.step,
+                                dtype=np.float64)
+        self._dirty.update(self._cache)
+
+    def refresh(self, now=None):
+        """ Recompute all stale composites in one batch. """
+        now = time.time() if now is None else now
+        if (self._window_start is None or
+                now + self.horizon > self._window_start + 2 * self.horizon):
+            self._roll_window(now)
+        if not self._dirty:
+            return 0
+
+        dirty = list(self._dirty)
+        self._dirty.clear()
+
+        # Evaluate every profile involved exactly once.
+        rows = {}
+        profiles = []
+        per_evse = {}
+        for station_id, evse_id in dirty:
+            entries = []
+            for profile_evse, profile in self.store.profiles(station_id):
+                if profile_evse not in (0, evse_id):
+                    continue
+                key = (station_id, profile['id'])
+                if key not in rows:
+                    rows[key] = len(profiles)
+                    profiles.append(profile)
+                entries.append((profile_evse, profile, rows[key]))
+            per_evse[(station_id, evse_id)] = entries
+
+        values = evaluate_profiles(profiles, self._times, self.voltage)
+
+        for key, entries in per_evse.items():
+            self._cache[key] = self._combine(entries, values)
+            self._evses.setdefault(key[0], set()).add(key[1])
+        return len(per_evse)
+
+    def _combine(self, entries, values):
+        by_purpose = {}
+        for evse_id, profile, row in entries:
+            by_purpose.setdefault(
+                profile['chargingProfilePurpose'], []).append(
+                    (-profile['stackLevel'], evse_id == 0, row))
+
+        def resolve(purpose):
+            ordered = sorted(by_purpose.get(purpose, ()))
+            if not ordered:
+                return np.full(len(self._times), np.nan)
+            return _highest_stack_level(values[[r for _, _, r in ordered]])
+
+        tx = resolve('TxProfile')
+        tx = np.where(np.isnan(tx), resolve('TxDefaultProfile'), tx)
+        composite = np.fmin(tx, self.evse_max_power)
+        for purpose in MAX_PURPOSES:
+            composite = np.fmin(composite, resolve(purpose))
+        return composite
+
+    def _slice(self, now):
+        first = int((now - self._window_start) // self.step)
+        return slice(first, first + int(self.horizon // self.step))
+
+    def composite(self, station_id, evse_id, now=None):
+        """ Return (times, limits in W) of the EVSE for the next horizon. """
+        now = time.time() if now is None else now
+        key = (station_id, evse_id)
+        if key not in self._cache:
+            self._dirty.add(key)
+        self.refresh(now)
+        window = self._slice(now)
+        return self._times[window], self._cache[key][window]
+
+    def site_forecast(self, evses, now=None):
+        """ Return (times, summed limits in W) of the given (station id,
+        evse id) pairs for the next horizon.
+        """
+        now = time.time() if now is None else now
+        for key in evses:
+            if key not in self._cache:
+                self._dirty.add(key)
+        self.refresh(now)
+        window = self._slice(now)
+        if not evses:
+            return self._times[window], np.zeros(len(self._times[window]))
+        stacked = np.stack([self._cache[key][window] for key in evses])
+        return self._times[window], stacked.sum(axis=0)
+
+    async def run(self):
+        """ Recompute stale composites once per step, off the request path.
+        """
+        while True:
+            await asyncio.sleep(self.step)
+            try:
+                self.refresh()
+            except Exception:
+                LOGGER.exception("Failed to refresh composite schedules")
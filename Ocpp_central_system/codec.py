@@ -0,0 +1,392 @@
+""" Fast OCPP frame codec.
+
+The ocpp library converts every payload with dataclasses.asdict(), a
+recursive remove_nones() and a regex based camelCase/snake_case conversion
+before calling json.dumps(). This module does the same work in one pass:
+
+* keys are translated through tables built once from the OCPP 2.0.1 JSON
+  schemas (with the library's own conversion functions, so the result is
+  identical), unknown keys are converted once and memoized,
+* None values are dropped during the same walk,
+* JSON is encoded and decoded with orjson when it is installed and with
+  the standard library otherwise.
+* an EncodedCall is converted and encoded once and sent to any number of
+  stations with call(), see broadcast.py.
+
+ChargePoint subclasses opt in by mixing in FastCodec before the library
+class:
+
+    class ChargePoint(FastCodec, cp):
+        ...
+"""
+import asyncio
+import glob
+import inspect
+import json
+import logging
+import os
+from dataclasses import fields
+
+import ocpp
+from ocpp.charge_point import camel_to_snake_case, snake_to_camel_case
+from ocpp.exceptions import FormatViolationError, NotSupportedError, \
+    OCPPError, PropertyConstraintViolationError, ProtocolError
+from ocpp.messages import Call, CallError, CallResult, MessageType
+
+from validation import validate
+
+try:
+    import orjson
+except ModuleNotFoundError:
+    orjson = None
+
+LOGGER = logging.getLogger('ocpp')
+
+# Payload keys are bounded by the schemas; the memo for keys outside of them
+# is capped so a misbehaving station can't grow it without limit.
+MAX_MEMOIZED_KEYS = 10000
+
+
+def _std_dumps(data):
+    return json.dumps(data, separators=(',', ':'))
+
+
+def _orjson_dumps(data):
+    return orjson.dumps(data, default=float).decode()
+
+
+BACKENDS = {'json': (json.loads, _std_dumps)}
+if orjson is not None:
+    BACKENDS['orjson'] = (orjson.loads, _orjson_dumps)
+
+loads, dumps = BACKENDS['orjson' if orjson is not None else 'json']
+
+
+def set_backend(name):
+    """ Select the JSON backend, 'orjson' or 'json'. """
+    global loads, dumps
+    loads, dumps = BACKENDS[name]
+
+
+def _schema_keys(ocpp_version='2.0.1'):
+    schemas_dir = os.path.join(os.path.dirname(ocpp.__file__),
+                               'v' + ocpp_version.replace('.', ''), 'schemas')
+    keys = set()
+
+    def collect(node):
+        if isinstance(node, dict):
+            keys.update(node.get('properties', {}))
+            for value in node.values():
+                collect(value)
+        elif isinstance(node, list):
+            for value in node:
+                collect(value)
+
+    for path in glob.glob(os.path.join(schemas_dir, '*.json')):
+        with open(path, encoding='utf-8-sig') as f:
+            collect(json.load(f))
+    return keys
+
+
+def _build_tables():
+    to_snake = {}
+    to_camel = {}
+    for camel in _schema_keys():
+        snake = next(iter(camel_to_snake_case({camel: None})))
+        to_snake[camel] = snake
+        to_camel[snake] = next(iter(snake_to_camel_case({snake: None})))
+        # Payloads built in code sometimes already use camelCase keys.
+        to_camel.setdefault(camel, next(iter(
+            snake_to_camel_case({camel: None}))))
+    return to_snake, to_camel
+
+
+KEYS_TO_SNAKE, KEYS_TO_CAMEL = _build_tables()
+
+
+def _translate(table, convert, key):
+    translated = table.get(key)
+    if translated is None:
+        translated = next(iter(convert({key: None})))
+        if len(table) < MAX_MEMOIZED_KEYS:
+            table[key] = translated
+    return translated
+
+
+def to_snake(data):
+    """ camelCase keys to snake_case, like camel_to_snake_case(). """
+    if isinstance(data, dict):
+        table = KEYS_TO_SNAKE
+        return {(table.get(k) or
+                 _translate(table, camel_to_snake_case, k)): to_snake(v)
+                for k, v in data.items()}
+    if isinstance(data, list):
+        return [to_snake(v) for v in data]
+    return data
+
+
+def to_camel(data):
+    """ snake_case keys to camelCase and without None values, like
+    snake_to_camel_case(remove_nones(data)).
+    """
+    if isinstance(data, dict):
+        table = KEYS_TO_CAMEL
+        return {(table.get(k) or
+                 _translate(table, snake_to_camel_case, k)): to_camel(v)
+                for k, v in data.items() if v is not None}
+    if isinstance(data, list):
+        return [to_camel(v) for v in data if v is not None]
+    return data
+
+
+# Payload class -> [(field name, camelCase key)]
+_FIELDS = {}
+
+
+def payload_to_camel(payload):
+    """ Convert a payload dataclass straight to a camelCase dict without
+    going through dataclasses.asdict().
+    """
+    cls = payload.__class__
+    names = _FIELDS.get(cls)
+    if names is None:
+        names = _FIELDS[cls] = [
+            (f.name, _translate(KEYS_TO_CAMEL, snake_to_camel_case, f.name))
+            for f in fields(cls)]
+    result = {}
+    for name, key in names:
+        value = getattr(payload, name)
+        if value is not None:
+            result[key] = to_camel(value)
+    return result
+
+
+class EncodedCall:
+    """ A CALL whose payload is converted, validated and JSON encoded once,
+    to be sent to any number of stations with FastCodec.call(). Per station
+    only the message id is spliced into the frame.
+    """
+
+    def __init__(self, payload, ocpp_version='2.0.1'):
+        self.action = payload.__class__.__name__[:-7]
+        self.payload_class = payload.__class__.__name__
+        body = payload_to_camel(payload)
+        validate(Call('', self.action, body), ocpp_version)
+        self._suffix = f'","{self.action}",{dumps(body)}]'
+
+    def frame(self, unique_id):
+        return '[2,"' + unique_id + self._suffix
+
+
+def action_of(payload):
+    """ Action of a CALL payload dataclass or EncodedCall. """
+    if isinstance(payload, EncodedCall):
+        return payload.action
+    return payload.__class__.__name__[:-7]
+
+
+def unpack(raw_msg):
+    """ Like ocpp.messages.unpack(), with the selected JSON backend. """
+    try:
+        msg = loads(raw_msg)
+    except ValueError:
+        raise FormatViolationError(
+            details={"cause": "Message is not valid JSON"})
+
+    if not isinstance(msg, list):
+        raise ProtocolError(
+            details={"cause": ("OCPP message hasn't the correct format. It "
+                               f"should be a list, but got '{type(msg)}' "
+                               "instead")})
+    try:
+        message_type_id = msg[0]
+        if message_type_id == MessageType.Call:
+            return Call(*msg[1:])
+        if message_type_id == MessageType.CallResult:
+            return CallResult(*msg[1:])
+        if message_type_id == MessageType.CallError:
+            return CallError(*msg[1:])
+    except IndexError:
+        raise ProtocolError(
+            details={"cause": "Message does not contain MessageTypeId"})
+    except TypeError:
+        raise ProtocolError(
+            details={"cause": "Message is missing elements."})
+
+    raise PropertyConstraintViolationError(
+        details={f"MessageTypeId '{msg[0]}' isn't valid"})
+
+
+def pack(msg):
+    """ Like msg.to_json(), with the selected JSON backend. """
+    if isinstance(msg, Call):
+        return dumps([MessageType.Call, msg.unique_id, msg.action,
+                      msg.payload])
+    if isinstance(msg, CallResult):
+        return dumps([MessageType.CallResult, msg.unique_id, msg.payload])
+    return dumps([MessageType.CallError, msg.unique_id, msg.error_code,
+                  msg.error_description, msg.error_details])
+
+
+def _should_validate(charge_point, action, outbound=False):
+    policy = getattr(charge_point, 'validation_policy', None)
+    if policy is None:
+        return True
+    if outbound:
+        return policy.outbound(action)
+    return policy.inbound(charge_point.id, action)
+
+
+def _validate(charge_point, msg, outbound=False):
+    try:
+        validate(msg, charge_point._ocpp_version)
+    except OCPPError:
+        policy = getattr(charge_point, 'validation_policy', None)
+        if policy is not None:
+            policy.violation(None if outbound else charge_point.id,
+                             msg.action)
+        raise
+
+
+def decode_result(charge_point, response, action, payload_class):
+    """ Validate a CALLRESULT as far as the charge point's validation policy
+    asks for and convert it to the result dataclass.
+    """
+    response.action = action
+    checked = _should_validate(charge_point, action)
+    if checked:
+        _validate(charge_point, response)
+
+    cls = getattr(charge_point._call_result, payload_class)
+    try:
+        return cls(**to_snake(response.payload))
+    except TypeError:
+        if not checked:
+            # Missing or unknown fields: report the schema violation.
+            _validate(charge_point, response)
+        raise
+
+
+class FastCodec:
+    """ Mixin replacing the message conversion of ocpp.ChargePoint with the
+    codec of this module. Routing and hooks behave as in the library;
+    payloads are validated as the validation policy asks for.
+    """
+
+    __slots__ = ()
+
+    # A validation.ValidationPolicy; None validates every payload.
+    validation_policy = None
+
+    def _timeout_of(self, action):
+        """ Seconds to wait for the response to a CALL of the action. """
+        return self._response_timeout
+
+    async def route_message(self, raw_msg):
+        try:
+            msg = unpack(raw_msg)
+        except OCPPError as e:
+            LOGGER.exception("Unable to parse message: '%s', it doesn't seem "
+                             "to be valid OCPP: %s", raw_msg, e)
+            return
+
+        if msg.message_type_id == MessageType.Call:
+            try:
+                await self._handle_call(msg)
+            except OCPPError as error:
+                LOGGER.exception("Error while handling request '%s'", msg)
+                await self._send(pack(msg.create_call_error(error)))
+
+        elif msg.message_type_id in \
+                [MessageType.CallResult, MessageType.CallError]:
+            self._receive_response(msg)
+
+    def _receive_response(self, msg):
+        """ Hand a CALLRESULT or CALLERROR to the waiting call(). """
+        self._response_queue.put_nowait(msg)
+
+    async def _handle_call(self, msg):
+        try:
+            handlers = self.route_map[msg.action]
+            handler = handlers['_on_action']
+        except KeyError:
+            raise NotSupportedError(
+                details={"cause": f"No handler for {msg.action} registered."})
+
+        skip_validation = handlers.get('_skip_schema_validation', False)
+        checked = not skip_validation and _should_validate(self, msg.action)
+        if checked:
+            _validate(self, msg)
+        snake_case_payload = to_snake(msg.payload)
+        # Routes built once per class hold functions rather than methods of
+        # the instance, see station_connection.py.
+        args = (self,) if handlers.get('_unbound') else ()
+
+        try:
+            response = handler(*args, **snake_case_payload)
+            if inspect.isawaitable(response):
+                response = await response
+        except Exception as e:
+            error = e
+            if not skip_validation and not checked:
+                # The handler may have failed on an invalid payload.
+                try:
+                    _validate(self, msg)
+                except OCPPError as violation:
+                    error = violation
+            LOGGER.exception("Error while handling request '%s'", msg)
+            await self._send(pack(msg.create_call_error(error)))
+            return
+
+        response = msg.create_call_result(payload_to_camel(response))
+
+        if not skip_validation and \
+                _should_validate(self, msg.action, outbound=True):
+            _validate(self, response, outbound=True)
+
+        await self._send(pack(response))
+
+        try:
+            handler = handlers['_after_action']
+        except KeyError:
+            return
+        response = handler(*args, **snake_case_payload)
+        if inspect.isawaitable(response):
+            asyncio.ensure_future(response)
+
+    async def call(self, payload, suppress=True):
+        """ Send a CALL payload dataclass, or an EncodedCall, and return the
+        result dataclass.
+        """
+        unique_id = str(self._unique_id_generator())
+        if isinstance(payload, EncodedCall):
+            action = payload.action
+            payload_class = payload.payload_class
+            frame = payload.frame(unique_id)
+        else:
+            action = payload.__class__.__name__[:-7]
+            payload_class = payload.__class__.__name__
+            call = Call(unique_id=unique_id, action=action,
+                        payload=payload_to_camel(payload))
+            if _should_validate(self, action, outbound=True):
+                _validate(self, call, outbound=True)
+            frame = pack(call)
+
+        timeout = self._timeout_of(action)
+        async with self._call_lock:
+            await self._send(frame)
+            try:
+                response = \
+                    await self._get_specific_response(unique_id, timeout)
+            except asyncio.TimeoutError:
+                raise asyncio.TimeoutError(
+                    f"Waited {timeout}s for response on {frame}."
+                )
+
+        if response.message_type_id == MessageType.CallError:
+            LOGGER.warning("Received a CALLError: %s'", response)
+            if suppress:
+                return
+            raise response.to_exception()
+
+        return decode_result(self, response, action, payload_class)
@@ -0,0 +1,318 @@
+""" Fleet-wide connector status table.
+
+Every StatusNotification is folded into a columnar table with one row per
+(station, EVSE, connector): the status as an int8 code, the station's
+timestamp as float64 seconds since the epoch, and the site and station as
+int32 indices. Running counters per site and status are updated with every
+change, so `count(site, 'Available')` is two dictionary lookups and an array
+read, however many connectors the fleet has.
+
+Notifications older than the last one recorded for a connector are
+ignored, since stations may deliver them out of order after a reconnect.
+
+The site of a station comes from a mapping (see --sites); stations that
+aren't in it belong to DEFAULT_SITE.
+
+Connectors of a station that isn't connected are counted as Unavailable,
+whatever they reported last (see set_offline()). Their last status is kept,
+so the counts are right again as soon as the station reconnects.
+"""
+import json
+import logging
+from datetime import datetime, timezone
+
+try:
+    import numpy as np
+except ModuleNotFoundError:
+    print("This example relies on the 'numpy' package.")
+    print("Please install it by running: ")
+    print()
+    print(" $ pip install numpy")
+    import sys
+    sys.exit(1)
+
+LOGGER = logging.getLogger('central_system.connector_status')
+
+# ConnectorStatusEnumType of OCPP 2.0.1, the index is the status code.
+STATUSES = ('Available', 'Occupied', 'Reserved', 'Unavailable', 'Faulted')
+STATUS_CODES = {status: code for code, status in enumerate(STATUSES)}
+UNAVAILABLE = STATUS_CODES['Unavailable']
+
+DEFAULT_SITE = 'default'
+
+
+def parse_timestamp(value):
+    """ Seconds since the epoch of an OCPP dateTime; UTC unless it has an
+    offset.
+    """
+    timestamp = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return timestamp.timestamp()
+
+
+class ConnectorStatusTable:
+
+    def __init__(self, sites=None, capacity=1024):
+        """
+        Args:
+
+            sites (dict): Station id -> site name.
+            capacity (int): Rows allocated up front; the columns double in
+                size when they are full.
+
+        """
+        self.sites = dict(sites or {})
+        self.status = np.full(capacity, -1, dtype=np.int8)
+        self.updated = np.zeros(capacity, dtype=np.float64)
+        self.site = np.zeros(capacity, dtype=np.int32)
+        self.station = np.zeros(capacity, dtype=np.int32)
+        self.evse = np.zeros(capacity, dtype=np.int32)
+        self.connector = np.zeros(capacity, dtype=np.int32)
+        # True for the connectors of stations that aren't connected
+        self.offline = np.zeros(capacity, dtype=np.bool_)
+        self.rows = 0
+        # (station id, evse id, connector id) -> row
+        self._index = {}
+        # station id -> index, and index -> station id / rows of the station
+        self._stations = {}
+        self._station_ids = []
+        self._station_rows = []
+        # site name -> index
+        self._site_index = {}
+        self._site_names = []
+        # Connectors per site and status, and per status for the fleet.
+        self.counts = np.zeros((16, len(STATUSES)), dtype=np.int64)
+        self.totals = np.zeros(len(STATUSES), dtype=np.int64)
+        self._listeners = []
+
+    def __len__(self):
+        return self.rows
+
+    def add_listener(self, listener):
+        """ Call listener(station_id, site) when a connector of the station
+        changes status.
+        """
+        self._listeners.append(listener)
+
+    def _site_of(self, name):
+        index = self._site_index.get(name)
+        if index is None:
+            index = self._site_index[name] = len(self._site_names)
+            self._site_names.append(name)
+            if index == len(self.counts):
+                self.counts = np.concatenate(
+                    [self.counts, np.zeros_like(self.counts)])
+        return index
+
+    def _station_of(self, station_id):
+        index = self._stations.get(station_id)
+        if index is None:
+            index = self._stations[station_id] = len(self._station_rows)
+            self._station_ids.append(station_id)
+            self._station_rows.append([])
+        return index
+
+    def _grow(self):
+        for name in ('status', 'updated', 'site', 'station', 'evse',
+                     'connector', 'offline'):
+            column = getattr(self, name)
+            grown = np.empty(len(column) * 2, dtype=column.dtype)
+            grown[:len(column)] = column
+            setattr(self, name, grown)
+        self.status[self.rows:] = -1
+
+    def _add_row(self, key):
+        if self.rows == len(self.status):
+            self._grow()
+        row = self._index[key] = self.rows
+        self.rows += 1
+        station_id, evse_id, connector_id = key
+        station = self._station_of(station_id)
+        self._station_rows[station].append(row)
+        self.station[row] = station
+        self.site[row] = self._site_of(
+            self.sites.get(station_id, DEFAULT_SITE))
+        self.evse[row] = evse_id
+        self.connector[row] = connector_id
+        self.updated[row] = -np.inf
+        self.offline[row] = False
+        return row
+
+    def _counted(self, row):
+        """ Status code the row is counted under, -1 if none. """
+        code = self.status[row]
+        if code >= 0 and self.offline[row]:
+            return UNAVAILABLE
+        return code
+
+    def _recount(self, row, previous, code):
+        if previous == code:
+            return
+        site = self.site[row]
+        if previous >= 0:
+            self.counts[site, previous] -= 1
+            self.totals[previous] -= 1
+        if code >= 0:
+            self.counts[site, code] += 1
+            self.totals[code] += 1
+
+    def update(self, station_id, evse_id, connector_id, status,
+               timestamp):
+        """ Fold in a StatusNotification. timestamp is in seconds since the
+        epoch. Returns False for a notification older than the one recorded.
+        """
+        key = (station_id, evse_id, connector_id)
+        row = self._index.get(key)
+        if row is None:
+            row = self._add_row(key)
+        elif timestamp < self.updated[row]:
+            return False
+        code = STATUS_CODES[status]
+        previous = self.status[row]
+        self.updated[row] = timestamp
+        if previous != code:
+            counted = self._counted(row)
+            self.status[row] = code
+            self._recount(row, counted, self._counted(row))
+            for listener in self._listeners:
+                listener(station_id, self._site_names[self.site[row]])
+        return True
+
+    def set_offline(self, station_id, offline=True):
+        """ Count the connectors of a station as Unavailable while it isn't
+        connected, or as reported again once it is.
+        """
+        station = self._stations.get(station_id)
+        if station is None:
+            return
+        for row in self._station_rows[station]:
+            if self.offline[row] != offline:
+                counted = self._counted(row)
+                self.offline[row] = offline
+                self._recount(row, counted, self._counted(row))
+
+    def forget(self, station_id):
+        """ Stop counting the connectors of a station, e.g. one now kept by
+        another worker. Its next StatusNotification counts them again.
+        """
+        station = self._stations.get(station_id)
+        if station is None:
+            return
+        for row in self._station_rows[station]:
+            counted = self._counted(row)
+            self.status[row] = -1
+            self.updated[row] = -np.inf
+            self._recount(row, counted, -1)
+            if counted >= 0:
+                for listener in self._listeners:
+                    listener(station_id, self._site_names[self.site[row]])
+
+    def assign_site(self, station_id, site):
+        """ Move a station, and the counts of its connectors, to a site. """
+        self.sites[station_id] = site
+        station = self._stations.get(station_id)
+        if station is None:
+            return
+        index = self._site_of(site)
+        moved = set()
+        for row in self._station_rows[station]:
+            code = self._counted(row)
+            if code >= 0:
+                self.counts[self.site[row], code] -= 1
+                self.counts[index, code] += 1
+            moved.add(self._site_names[self.site[row]])
+            self.site[row] = index
+        for name in moved | {site}:
+            for listener in self._listeners:
+                listener(station_id, name)
+
+    # Queries
+
+    def count(self, site, status):
+        """ Connectors of the site currently in the status. """
+        index = self._site_index.get(site)
+        if index is None:
+            return 0
+        return int(self.counts[index, STATUS_CODES[status]])
+
+    def site_counts(self, site):
+        """ status -> connectors of the site in that status. """
+        index = self._site_index.get(site)
+        if index is None:
+            return dict.fromkeys(STATUSES, 0)
+        return dict(zip(STATUSES, self.counts[index].tolist()))
+
+    def fleet_counts(self):
+        return dict(zip(STATUSES, self.totals.tolist()))
+
+    def evses(self, site, status):
+        """ Return (station ids, EVSE ids, timestamps) of the EVSEs of the
+        site with a connector in the status, the one with the oldest
+        notification first. This is the status stations reported last, also
+        for stations that are offline: they may still be charging.
+        """
+        index = self._site_index.get(site)
+        if index is None:
+            return [], np.zeros(0, dtype=np.int32), np.zeros(0)
+        code = STATUS_CODES[status]
+        rows = np.flatnonzero((self.site[:self.rows] == index) &
+                              (self.status[:self.rows] == code))
+        rows = rows[np.argsort(self.updated[rows], kind='stable')]
+        # One entry per EVSE, at its earliest connector.
+        keys = self.station[rows].astype(np.int64) << 32 | self.evse[rows]
+        _, first = np.unique(keys, return_index=True)
+        rows = rows[np.sort(first)]
+        return ([self._station_ids[i] for i in self.station[rows]],
+                self.evse[rows], self.updated[rows])
+
+    def station_connectors(self, station_id):
+        """ [(evse id, connector id, status, timestamp)] of a station. """
+        station = self._stations.get(station_id)
+        if station is None:
+            return []
+        return [(int(self.evse[row]), int(self.connector[row]),
+                 STATUSES[self.status[row]], float(self.updated[row]))
+                for row in self._station_rows[station]
+                if self.status[row] >= 0]
+
+    def site_evses(self):
+        """ site name -> [(station id, evse id)] of the EVSEs with a known
+        status, once per EVSE.
+        """
+        rows = np.flatnonzero(self.status[:self.rows] >= 0)
+        sites = {}
+        seen = set()
+        for row in rows.tolist():
+            key = (self._station_ids[self.station[row]], int(self.evse[row]))
+            if key not in seen:
+                seen.add(key)
+                sites.setdefault(self._site_names[self.site[row]],
+                                 []).append(key)
+        return sites
+
+    def query(self, params):
+        """ Answer an HTTP query: ?site=X[&status=Available], or the counts
+        of every site without parameters. Returns a JSON body.
+        """
+        site = params.get('site')
+        status = params.get('status')
+        if site is None:
+            result = {name: self.site_counts(name)
+                      for name in self._site_names}
+        elif status is None:
+            result = self.site_counts(site)
+        elif status in STATUS_CODES:
+            result = {'site': site, 'status': status,
+                      'count': self.count(site, status)}
+        else:
+            raise KeyError(status)
+        return json.dumps(result).encode()
+
+
+def load_sites(path):
+    """ Read a JSON object of station id -> site name. """
+    with open(path) as f:
+        sites = json.load(f)
+    LOGGER.info("Loaded the sites of %d stations from %s", len(sites), path)
+    return sites
@@ -0,0 +1,174 @@
+""" Per-station cache of the device model variables set through SetVariables
+or read with GetVariables.
+
+Variables are keyed by component (name, instance, evse, connector), variable
+(name, instance) and attributeType. The key tuples are interned in one table
+shared by all stations, so each station only holds a small {key id: value}
+dict.
+"""
+import json
+
+# Statuses of a set_variable_result after which the station holds the value.
+APPLIED_STATUSES = ('Accepted', 'RebootRequired')
+
+DEFAULT_ITEMS_PER_MESSAGE = 10
+DEFAULT_BYTES_PER_MESSAGE = 64000
+
+# ReadOnly DeviceDataCtrlr variables limiting the Get/SetVariables messages
+# a station accepts. They are read once with GetVariables, see
+# ChargePoint.fetch_message_limits().
+LIMIT_VARIABLES = [
+    {'component': {'name': 'DeviceDataCtrlr'},
+     'variable': {'name': name, 'instance': instance}}
+    for instance in ('SetVariables', 'GetVariables')
+    for name in ('ItemsPerMessage', 'BytesPerMessage')
+]
+
+
+def _limit_keys(action):
+    return (('DeviceDataCtrlr', None, None, None, 'ItemsPerMessage', action,
+             'Actual'),
+            ('DeviceDataCtrlr', None, None, None, 'BytesPerMessage', action,
+             'Actual'))
+
+
+ITEMS_PER_MESSAGE_KEY, BYTES_PER_MESSAGE_KEY = _limit_keys('SetVariables')
+
+
+def variable_key(item):
+    """ Key of a set_variable_data or set_variable_result entry. Accepts
+    both camelCase (as sent) and snake_case (as received) dicts.
+    """
+    component = item['component']
+    variable = item['variable']
+    evse = component.get('evse') or {}
+    return (
+        component['name'],
+        component.get('instance'),
+        evse.get('id'),
+        evse.get('connectorId', evse.get('connector_id')),
+        variable['name'],
+        variable.get('instance'),
+        item.get('attributeType', item.get('attribute_type')) or 'Actual',
+    )
+
+
+class DeviceModelCache:
+
+    def __init__(self):
+        # key tuple -> key id, shared by all stations
+        self._key_ids = {}
+        # station id -> {key id: attribute value}
+        self._stations = {}
+        # Callbacks invoked with (station id, key, value) on every change.
+        self._listeners = []
+        # Stations asked for their message limits since the start.
+        self._limits_requested = set()
+
+    def add_listener(self, callback):
+        self._listeners.append(callback)
+
+    def _key_id(self, key):
+        key_id = self._key_ids.get(key)
+        if key_id is None:
+            key_id = self._key_ids[key] = len(self._key_ids)
+        return key_id
+
+    def get(self, station_id, key):
+        key_id = self._key_ids.get(key)
+        if key_id is None:
+            return None
+        return self._stations.get(station_id, {}).get(key_id)
+
+    def set(self, station_id, key, value):
+        values = self._stations.setdefault(station_id, {})
+        key_id = self._key_id(key)
+        if values.get(key_id) == value:
+            return
+        values[key_id] = value
+        for callback in self._listeners:
+            callback(station_id, key, value)
+
+    def restore(self, station_id, variables):
+        """ Replace the cached variables of a station by (key, value) pairs,
+        without calling the listeners.
+        """
+        self.forget(station_id)
+        values = self._stations[station_id] = {}
+        for key, value in variables:
+            values[self._key_id(key)] = value
+
+    def forget(self, station_id):
+        self._stations.pop(station_id, None)
+        self._limits_requested.discard(station_id)
+
+    def record_set_results(self, station_id, set_variable_data, results):
+        """ Store the values of all variables the station applied. """
+        requested = {variable_key(item): item['attributeValue']
+                     for item in set_variable_data}
+        for result in results:
+            if result['attribute_status'] not in APPLIED_STATUSES:
+                continue
+            key = variable_key(result)
+            if key in requested:
+                self.set(station_id, key, requested[key])
+
+    def record_get_results(self, station_id, results):
+        """ Store the values of a GetVariables response. """
+        for result in results:
+            if result['attribute_status'] == 'Accepted' and \
+                    result.get('attribute_value') is not None:
+                self.set(station_id, variable_key(result),
+                         result['attribute_value'])
+
+    def diff(self, station_id, desired):
+        """ Return the set_variable_data entries of `desired` whose value
+        differs from, or isn't in, the cached device model.
+        """
+        values = self._stations.get(station_id, {})
+        changed = []
+        for item in desired:
+            key_id = self._key_ids.get(variable_key(item))
+            if key_id is None or values.get(key_id) != item['attributeValue']:
+                changed.append(item)
+        return changed
+
+    def needs_limits(self, station_id):
+        """ True once per station whose message limits aren't known, also
+        when they were restored from the state store.
+        """
+        if self.get(station_id, ITEMS_PER_MESSAGE_KEY) is not None or \
+                station_id in self._limits_requested:
+            return False
+        self._limits_requested.add(station_id)
+        return True
+
+    def limits(self, station_id, action='SetVariables'):
+        """ Return (items, bytes) per message of the action the station
+        accepts, from its DeviceDataCtrlr variables when known.
+        """
+        items_key, bytes_key = _limit_keys(action)
+        items = self.get(station_id, items_key)
+        size = self.get(station_id, bytes_key)
+        return (int(items) if items else DEFAULT_ITEMS_PER_MESSAGE,
+                int(size) if size else DEFAULT_BYTES_PER_MESSAGE)
+
+
+def batches(items, items_per_message, bytes_per_message,
+            overhead=64):
+    """ Split set_variable_data entries into as few SetVariables messages as
+    the item and byte limits allow.
+    """
+    batch = []
+    size = overhead
+    for item in items:
+        item_size = len(json.dumps(item, separators=(',', ':'))) + 1
+        if batch and (len(batch) == items_per_message or
+                      size + item_size > bytes_per_message):
+            yield batch
+            batch = []
+            size = overhead
+        batch.append(item)
+        size += item_size
+    if batch:
+        yield batch
@@ -0,0 +1,187 @@
+""" Offloaded and cached Get15118EVCertificate processing.
+
+Decoding the EXI stream of a CertificateInstallationReq and producing the
+CertificateInstallationRes is CPU bound; done in the handler it stalls the
+event loop and with it every other station. CertificateService runs it on a
+bounded thread or process pool instead:
+
+* at most `concurrency` requests are processed at once, at most `max_queue`
+  more wait for a worker; beyond that the station is answered Failed right
+  away, and the EV asks again,
+* responses are cached for `ttl` seconds, keyed by the SHA-256 of the
+  schema version, the action and the EXI request. A plug-and-charge EV that
+  retries within seconds is answered from the cache, and a retry that comes
+  in while the first request is still processed waits for its result.
+
+The queue depth, the requests in progress and the cache hits are exported
+through Metrics.register().
+
+The work itself is done by a module-level function, so it can be pickled
+for a process pool. The EXI codec and the contract certificate backend
+aren't part of this repository; process_request() answers with the response
+the M01 example always gave, pass another function to plug them in.
+"""
+import asyncio
+import concurrent.futures
+import hashlib
+import logging
+import multiprocessing
+import time
+from collections import OrderedDict
+
+LOGGER = logging.getLogger('central_system.ev_certificate')
+
+PLACEHOLDER_RESPONSE = 'Required. Raw CertificateInstallationRes response ' \
+                       'for the EV, Base64 encoded.'
+
+
+def process_request(iso15118_schema_version, action, exi_request):
+    """ Return (status, exi_response) for a Get15118EVCertificate request.
+    Runs on a worker thread or process.
+    """
+    return 'Accepted', PLACEHOLDER_RESPONSE
+
+
+def cache_key(iso15118_schema_version, action, exi_request):
+    digest = hashlib.sha256(iso15118_schema_version.encode())
+    digest.update(b'\0' + action.encode() + b'\0')
+    digest.update(exi_request.encode())
+    return digest.digest()
+
+
+class CertificateService:
+
+    def __init__(self, process=process_request, pool='thread',
+                 concurrency=4, max_queue=100, ttl=60, max_entries=10000):
+        """
+        Args:
+
+            process: Function process(iso15118_schema_version, action,
+                exi_request) returning (status, exi_response).
+            pool (str): 'thread', or 'process' for work that holds the GIL.
+            concurrency (int): Workers of the pool.
+            max_queue (int): Requests that may wait for a worker.
+            ttl (float): Seconds a response is answered from the cache.
+            max_entries (int): Responses cached at most.
+
+        """
+        self.process = process
+        self.pool = pool
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # key -> (expiry, (status, exi_response)). Every entry lives for
+        # the same ttl, so insertion order is expiry order.
+        self._cache = OrderedDict()
+        # key -> task processing it, shared by identical requests
+        self._processing = {}
+        self._executor = None
+        self._semaphore = None
+        self.queued = 0
+        self.in_progress = 0
+        self.hits = 0
+        self.rejected = 0
+
+    def register_metrics(self, metrics):
+        metrics.register(
+            'ocpp_certificate_queue_depth', 'gauge',
+            "Get15118EVCertificate requests waiting for a worker.",
+            lambda: self.queued)
+        metrics.register(
+            'ocpp_certificate_in_progress', 'gauge',
+            "Get15118EVCertificate requests being processed.",
+            lambda: self.in_progress)
+        metrics.register(
+            'ocpp_certificate_cache_hits_total', 'counter',
+            "Get15118EVCertificate requests answered from the cache.",
+            lambda: self.hits)
+        metrics.register(
+            'ocpp_certificate_rejected_total', 'counter',
+            "Get15118EVCertificate requests answered Failed because the "
+            "queue was full.",
+            lambda: self.rejected)
+
+    def _start(self):
+        if self.pool == 'process':
+            # Not forked: the server has threads, e.g. the log writer.
+            self._executor = concurrent.futures.ProcessPoolExecutor(
+                self.concurrency,
+                mp_context=multiprocessing.get_context('spawn'))
+        else:
+            self._executor = concurrent.futures.ThreadPoolExecutor(
+                self.concurrency, thread_name_prefix='ev-certificate')
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def _cached(self, key, now):
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        if entry[0] < now:
+            del self._cache[key]
+            return None
+        return entry[1]
+
+    def _store(self, key, result, now):
+        # Drop expired entries from the front, and the oldest beyond the
+        # size limit.
+        while self._cache:
+            expiry, _ = next(iter(self._cache.values()))
+            if expiry >= now and len(self._cache) < self.max_entries:
+                break
+            self._cache.popitem(last=False)
+        self._cache[key] = (now + self.ttl, result)
+
+    async def get(self, iso15118_schema_version, action, exi_request):
+        """ Return (status, exi_response) for a request. """
+        now = time.monotonic()
+        key = cache_key(iso15118_schema_version, action, exi_request)
+        result = self._cached(key, now)
+        if result is not None:
+            self.hits += 1
+            return result
+        task = self._processing.get(key)
+        if task is None:
+            if self.queued >= self.max_queue:
+                self.rejected += 1
+                LOGGER.warning("%d certificate requests queued, answering "
+                               "Failed", self.queued)
+                return 'Failed', ''
+            self.queued += 1
+            task = self._processing[key] = asyncio.ensure_future(
+                self._run(key, iso15118_schema_version, action, exi_request))
+        else:
+            self.hits += 1
+        # The station may disconnect; identical requests still get the
+        # result.
+        return await asyncio.shield(task)
+
+    async def _run(self, key, *request):
+        if self._executor is None:
+            self._start()
+        try:
+            try:
+                await self._semaphore.acquire()
+            finally:
+                self.queued -= 1
+            self.in_progress += 1
+            try:
+                result = await asyncio.get_running_loop().run_in_executor(
+                    self._executor, self.process, *request)
+            except Exception:
+                LOGGER.exception("Processing a %s certificate request failed",
+                                 request[1])
+                return 'Failed', ''
+            finally:
+                self.in_progress -= 1
+                self._semaphore.release()
+        finally:
+            del self._processing[key]
+        if result[0] == 'Accepted':
+            self._store(key, tuple(result), time.monotonic())
+        return result
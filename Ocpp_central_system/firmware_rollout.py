@@ -0,0 +1,198 @@
+""" Staged fleet firmware rollout driven by FirmwareStatusNotifications.
+
+Stations are updated in waves. Within a wave at most `window` stations are
+in progress at a time; every notification that finishes a station starts
+the next one, and the next wave starts when the current one is done. No
+polling is involved. A wave whose failure rate rises above
+`max_failure_rate` pauses the rollout until resume() is called.
+
+Per-station progress is kept in a compact array of state codes.
+"""
+import asyncio
+import logging
+from array import array
+from collections import Counter
+
+LOGGER = logging.getLogger('central_system.firmware_rollout')
+
+PENDING = 0
+REQUESTED = 1
+DOWNLOADING = 2
+DOWNLOADED = 3
+INSTALLING = 4
+INSTALLED = 5
+FAILED = 6
+
+STATE_NAMES = ('Pending', 'Requested', 'Downloading', 'Downloaded',
+               'Installing', 'Installed', 'Failed')
+
+# FirmwareStatusEnumType -> rollout state. Statuses not listed here (e.g.
+# SignatureVerified, DownloadScheduled) don't change the state.
+FIRMWARE_STATUSES = {
+    'Downloading': DOWNLOADING,
+    'DownloadPaused': DOWNLOADING,
+    'Downloaded': DOWNLOADED,
+    'InstallScheduled': DOWNLOADED,
+    'Installing': INSTALLING,
+    'InstallRebooting': INSTALLING,
+    'Installed': INSTALLED,
+    'DownloadFailed': FAILED,
+    'InstallationFailed': FAILED,
+    'InstallVerificationFailed': FAILED,
+    'InvalidSignature': FAILED,
+}
+
+
+class FirmwareRollout:
+
+    def __init__(self, station_ids, send, request_id, wave_size=500,
+                 window=100, max_failure_rate=0.05, min_samples=20,
+                 stall_timeout=3600):
+        """
+        Args:
+
+            station_ids: Stations to update, in rollout order.
+            send: Coroutine function called with a station id and the
+                request id. Must return True if the station accepted the
+                UpdateFirmware request.
+            request_id (int): requestId used in UpdateFirmware, used to
+                match FirmwareStatusNotifications to this rollout.
+            wave_size (int): Number of stations per wave.
+            window (int): Maximum number of stations in progress.
+            max_failure_rate (float): Failure rate of a wave above which the
+                rollout is paused.
+            min_samples (int): Finished stations in a wave before the failure
+                rate is evaluated.
+            stall_timeout (float): Seconds without a notification after
+                which a station counts as failed.
+
+        """
+        self.station_ids = list(station_ids)
+        self.request_id = request_id
+        self.wave_size = wave_size
+        self.window = window
+        self.max_failure_rate = max_failure_rate
+        self.min_samples = min_samples
+        self.stall_timeout = stall_timeout
+        self.paused = False
+
+        self._send = send
+        self._index = {station_id: i
+                       for i, station_id in enumerate(self.station_ids)}
+        self._states = array('b', [PENDING]) * len(self.station_ids)
+        self._wave = 0
+        self._next = 0
+        self._in_progress = 0
+        self._wave_finished = 0
+        self._wave_failed = 0
+        self._stall_timers = {}
+        self.done = None
+
+    @property
+    def wave_range(self):
+        start = self._wave * self.wave_size
+        return start, min(start + self.wave_size, len(self.station_ids))
+
+    def state(self, station_id):
+        return STATE_NAMES[self._states[self._index[station_id]]]
+
+    def summary(self):
+        counts = Counter(self._states)
+        return {STATE_NAMES[state]: counts.get(state, 0)
+                for state in range(len(STATE_NAMES))}
+
+    def start(self):
+        self.done = asyncio.get_event_loop().create_future()
+        self._advance()
+        return self.done
+
+    def pause(self):
+        self.paused = True
+
+    def resume(self):
+        # The failure rate of the current wave starts over, otherwise the
+        # rollout would pause again on the next finished station.
+        self.paused = False
+        self._wave_finished = self._wave_failed = 0
+        self._advance()
+
+    def on_status(self, station_id, status):
+        """ Handle a FirmwareStatusNotification of this rollout. """
+        index = self._index.get(station_id)
+        new_state = FIRMWARE_STATUSES.get(status)
+        if index is None or new_state is None:
+            return
+        current = self._states[index]
+        if current in (PENDING, INSTALLED, FAILED):
+            return
+        if new_state in (INSTALLED, FAILED):
+            self._finish(index, new_state)
+        else:
+            self._states[index] = new_state
+            self._arm_stall_timer(index)
+
+    def _advance(self):
+        if self.done is None or self.done.done():
+            return
+        while not self.paused and self._in_progress < self.window:
+            start, end = self.wave_range
+            if self._next >= end:
+                if self._in_progress:
+                    # Wait for the wave to complete before starting the next.
+                    return
+                if end >= len(self.station_ids):
+                    LOGGER.info("Firmware rollout %d finished: %s",
+                                self.request_id, self.summary())
+                    self.done.set_result(self.summary())
+                    return
+                self._wave += 1
+                self._wave_finished = self._wave_failed = 0
+                LOGGER.info("Firmware rollout %d: starting wave %d",
+                            self.request_id, self._wave)
+                continue
+            index = self._next
+            self._next += 1
+            self._states[index] = REQUESTED
+            self._in_progress += 1
+            self._arm_stall_timer(index)
+            asyncio.ensure_future(self._request(index))
+
+    async def _request(self, index):
+        station_id = self.station_ids[index]
+        try:
+            accepted = await self._send(station_id, self.request_id)
+        except Exception as e:
+            LOGGER.warning("UpdateFirmware to %s failed: %r", station_id, e)
+            accepted = False
+        if not accepted and self._states[index] == REQUESTED:
+            self._finish(index, FAILED)
+
+    def _arm_stall_timer(self, index):
+        timer = self._stall_timers.pop(index, None)
+        if timer is not None:
+            timer.cancel()
+        self._stall_timers[index] = asyncio.get_event_loop().call_later(
+            self.stall_timeout, self._finish, index, FAILED)
+
+    def _finish(self, index, state):
+        timer = self._stall_timers.pop(index, None)
+        if timer is not None:
+            timer.cancel()
+        if self._states[index] in (INSTALLED, FAILED):
+            return
+        self._states[index] = state
+        self._in_progress -= 1
+
+        start, end = self.wave_range
+        if start <= index < end:
+            self._wave_finished += 1
+            self._wave_failed += state == FAILED
+            if (self._wave_finished >= self.min_samples and
+                    self._wave_failed / self._wave_finished >
+                    self.max_failure_rate and not self.paused):
+                LOGGER.warning(
+                    "Firmware rollout %d paused: %d of %d stations failed in "
+                    "wave %d", self.request_id, self._wave_failed,
+                    self._wave_finished, self._wave)
+                self.paused = True
+        self._advance()
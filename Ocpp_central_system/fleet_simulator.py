@@ -0,0 +1,391 @@
+""" Fleet simulator and load generator.
+
+Runs thousands of virtual charging stations against a central system and
+reports messages/sec, connect rate and p50/p99 call latency. Every station
+replays the behaviour of the charge_point_* scripts:
+
+* B01: BootNotification, StatusNotification and Heartbeats,
+* L02: FirmwareStatusNotification sequence after an UpdateFirmware,
+* N01: LogStatusNotification sequence after a GetLog.
+
+Stations are spread over one event loop per process, e.g.:
+
+    $ python fleet_simulator.py --stations 5000 --processes 4 --duration 60
+
+Stations answered with Pending retry their BootNotification after the
+given interval. The report includes how long the fleet took to be fully
+Accepted; with --reconnect-at every station drops its connection at the
+same moment and boots again, as after a restart of the central system.
+
+Large fleets need a raised open file limit (ulimit -n).
+"""
+import argparse
+import asyncio
+import logging
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+try:
+    import websockets
+except ModuleNotFoundError:
+    print("This example relies on the 'websockets' package.")
+    print("Please install it by running: ")
+    print()
+    print(" $ pip install websockets")
+    import sys
+    sys.exit(1)
+
+from ocpp.routing import on
+from ocpp.v201 import ChargePoint as cp
+from ocpp.v201 import call
+from ocpp.v201 import call_result
+
+logging.basicConfig(level=logging.WARNING)
+
+
+class FleetStats:
+    """ Counters shared by all simulated stations of one process. """
+
+    def __init__(self):
+        self.connects = 0
+        self.connect_failures = 0
+        self.messages_sent = 0
+        self.messages_received = 0
+        self.call_errors = 0
+        self.pending_answers = 0
+        self.latencies = []
+        # boot round -> [first boot, last Accepted, booted, accepted]
+        self.rounds = {}
+        self.first_connect = None
+        self.last_connect = None
+
+    def connected(self):
+        now = time.monotonic()
+        if self.first_connect is None:
+            self.first_connect = now
+        self.last_connect = now
+        self.connects += 1
+
+    def booting(self, boot_round):
+        now = time.monotonic()
+        self.rounds.setdefault(boot_round, [now, None, 0, 0])[2] += 1
+
+    def accepted(self, boot_round):
+        self.rounds[boot_round][1] = time.monotonic()
+        self.rounds[boot_round][3] += 1
+
+    def as_dict(self):
+        return {
+            'connects': self.connects,
+            'connect_failures': self.connect_failures,
+            'messages_sent': self.messages_sent,
+            'messages_received': self.messages_received,
+            'call_errors': self.call_errors,
+            'pending_answers': self.pending_answers,
+            'rounds': self.rounds,
+            'latencies': self.latencies,
+            'connect_window': (self.last_connect - self.first_connect
+                               if self.connects else 0.0),
+        }
+
+
+class SimulatedChargePoint(cp):
+
+    def __init__(self, id, connection, stats, firmware_step=5.0,
+                 log_step=3.0, **kwargs):
+        super().__init__(id, connection, **kwargs)
+        self._stats = stats
+        self._firmware_step = firmware_step
+        self._log_step = log_step
+        self._background = set()
+        self._heartbeat_interval = None
+        self._last_call = 0.0
+
+    async def call(self, payload, suppress=True):
+        self._stats.messages_sent += 1
+        self._last_call = time.monotonic()
+        start = time.perf_counter()
+        try:
+            response = await super().call(payload, suppress)
+        except asyncio.TimeoutError:
+            self._stats.call_errors += 1
+            raise
+        self._stats.latencies.append(time.perf_counter() - start)
+        if response is None:
+            self._stats.call_errors += 1
+        return response
+
+    async def route_message(self, raw_msg):
+        self._stats.messages_received += 1
+        await super().route_message(raw_msg)
+
+    def _spawn(self, coro):
+        task = asyncio.ensure_future(coro)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    # B01
+    async def send_boot_notification(self, heartbeat_interval=None,
+                                     boot_round=0):
+        request = call.BootNotificationPayload(
+            charging_station={
+                'model': 'EVAcharge nG',
+                'vendor_name': 'AKKA Germany GmbH',
+                'firmware_version': 'SE-1.2.6',
+                'serialNumber': '1234567890'
+            },
+            reason="PowerUp"
+        )
+        while True:
+            response = await self.call(request)
+            if response is None:
+                return
+            if response.status == 'Accepted':
+                break
+            # Pending or Rejected: retry after the interval given.
+            self._stats.pending_answers += 1
+            await asyncio.sleep(response.interval)
+
+        self._stats.accepted(boot_round)
+        await self.send_status_notification(
+            heartbeat_interval or response.interval)
+
+    async def send_status_notification(self, interval):
+        request = call.StatusNotificationPayload(
+            timestamp=datetime.utcnow().isoformat(),
+            connector_status='Available',
+            evse_id=1,
+            connector_id=1
+        )
+        await self.call(request)
+        await self.send_heartbeat(interval)
+
+    async def send_heartbeat(self, interval):
+        self._heartbeat_interval = interval
+        request = call.HeartbeatPayload()
+        while True:
+            # Any other message counts as a heartbeat, so one is only sent
+            # after a quiet interval.
+            idle = time.monotonic() - self._last_call
+            if idle >= self._heartbeat_interval:
+                await self.call(request)
+                idle = 0
+            await asyncio.sleep(self._heartbeat_interval - idle)
+
+    # B05 / K01
+    @on('SetVariables')
+    def on_set_variables(self, set_variable_data, **kwargs):
+        for data in set_variable_data:
+            if data['component']['name'] == 'OCPPCommCtrlr' and \
+                    data['variable']['name'] == 'HeartbeatInterval':
+                self._heartbeat_interval = int(data['attribute_value'])
+        return call_result.SetVariablesPayload(
+            set_variable_result=[
+                {
+                    'attributeType': data.get('attribute_type', 'Actual'),
+                    'attributeStatus': 'Accepted',
+                    'component': data['component'],
+                    'variable': data['variable']
+                }
+                for data in set_variable_data
+            ]
+        )
+
+    @on('SetChargingProfile')
+    def on_set_charging_profile(self, **kwargs):
+        return call_result.SetChargingProfilePayload(
+            status='Accepted'
+        )
+
+    # L02
+    @on('UpdateFirmware')
+    def on_update_firmware(self, request_id, **kwargs):
+        self._spawn(self.send_firmware_status_notification(request_id))
+        return call_result.UpdateFirmwarePayload(
+            status='Accepted'
+        )
+
+    async def send_firmware_status_notification(self, request_id):
+        for status in ['Downloading', 'Downloaded', 'Installing',
+                       'Installed']:
+            await asyncio.sleep(self._firmware_step)
+            request = call.FirmwareStatusNotificationPayload(
+                request_id=request_id,
+                status=status)
+            await self.call(request)
+
+    # N01
+    @on('GetLog')
+    def on_get_log(self, request_id, **kwargs):
+        self._spawn(self.log_status_notification(request_id))
+        return call_result.GetLogPayload(
+            status='Accepted'
+        )
+
+    async def log_status_notification(self, request_id):
+        for status in ['Uploading', 'Uploaded']:
+            await asyncio.sleep(self._log_step)
+            request = call.LogStatusNotificationPayload(
+                status=status,
+                request_id=request_id
+            )
+            await self.call(request)
+
+
+async def run_station(url, station_id, stats, args, storm=None):
+    """ Run one station. When the storm event is set the station drops its
+    connection, then reconnects and boots once more.
+    """
+    for boot_round in range(1 if storm is None else 2):
+        stats.booting(boot_round)
+        try:
+            async with websockets.connect(
+                    f'{url}/{station_id}',
+                    subprotocols=['ocpp2.0.1'],
+                    open_timeout=args.connect_timeout
+            ) as ws:
+                stats.connected()
+                charge_point = SimulatedChargePoint(
+                    station_id, ws, stats,
+                    firmware_step=args.firmware_step,
+                    log_step=args.log_step,
+                    response_timeout=args.response_timeout)
+                session = asyncio.gather(
+                    charge_point.start(),
+                    charge_point.send_boot_notification(
+                        args.heartbeat_interval, boot_round))
+                if storm is None or boot_round:
+                    await session
+                    return
+                reconnect = asyncio.ensure_future(storm.wait())
+                try:
+                    await asyncio.wait([session, reconnect],
+                                       return_when=asyncio.FIRST_COMPLETED)
+                    if not reconnect.done():
+                        # Raises what ended the session.
+                        await session
+                        return
+                finally:
+                    reconnect.cancel()
+                    session.cancel()
+                await asyncio.gather(session, return_exceptions=True)
+        except (OSError, asyncio.TimeoutError,
+                websockets.exceptions.InvalidHandshake):
+            stats.connect_failures += 1
+            return
+        except websockets.exceptions.ConnectionClosed:
+            return
+
+
+async def run_fleet(station_ids, args):
+    """ Run the given stations in the current event loop for
+    args.duration seconds and return the collected statistics.
+    """
+    stats = FleetStats()
+    storm = None
+    if args.reconnect_at is not None:
+        storm = asyncio.Event()
+        asyncio.get_event_loop().call_later(args.reconnect_at, storm.set)
+    tasks = []
+    for i, station_id in enumerate(station_ids):
+        tasks.append(asyncio.ensure_future(
+            run_station(args.url, station_id, stats, args, storm)))
+        if args.ramp and i % 100 == 99:
+            # Pace connection attempts to args.ramp per second.
+            await asyncio.sleep(100 / args.ramp)
+
+    await asyncio.sleep(args.duration)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return stats.as_dict()
+
+
+def _run_fleet_in_process(station_ids, args):
+    return asyncio.run(run_fleet(station_ids, args))
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(fraction * len(sorted_values)))
+    return sorted_values[index]
+
+
+def report(results, elapsed):
+    connects = sum(r['connects'] for r in results)
+    messages = sum(r['messages_sent'] + r['messages_received']
+                   for r in results)
+    latencies = sorted(l for r in results for l in r['latencies'])
+    connect_window = max(r['connect_window'] for r in results) or elapsed
+
+    print(f"stations connected : {connects}")
+    print(f"connect failures   : "
+          f"{sum(r['connect_failures'] for r in results)}")
+    print(f"call errors        : {sum(r['call_errors'] for r in results)}")
+    print(f"connect rate       : {connects / connect_window:.1f}/s")
+    print(f"messages/sec       : {messages / elapsed:.1f}")
+    print(f"call latency p50   : {percentile(latencies, 0.50) * 1000:.2f} ms")
+    print(f"call latency p99   : {percentile(latencies, 0.99) * 1000:.2f} ms")
+    print(f"boot Pending       : "
+          f"{sum(r['pending_answers'] for r in results)}")
+
+    labels = {0: 'fleet accepted in  ', 1: 'after reconnect    '}
+    for boot_round, label in labels.items():
+        rounds = [r['rounds'][boot_round] for r in results
+                  if boot_round in r['rounds']]
+        if not rounds:
+            continue
+        booted = sum(r[2] for r in rounds)
+        accepted = sum(r[3] for r in rounds)
+        last = [r[1] for r in rounds if r[1] is not None]
+        took = (f"{max(last) - min(r[0] for r in rounds):.2f} s"
+                if last else '-')
+        print(f"{label}: {took} ({accepted} of {booted} stations Accepted)")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Simulate a fleet of OCPP 2.0.1 charging stations.")
+    parser.add_argument('--url', default='ws://localhost:9000')
+    parser.add_argument('--stations', type=int, default=1000)
+    parser.add_argument('--processes', type=int, default=1)
+    parser.add_argument('--prefix', default='SIM_')
+    parser.add_argument('--duration', type=float, default=60,
+                        help="Seconds to keep the fleet connected.")
+    parser.add_argument('--ramp', type=float, default=0,
+                        help="Connection attempts per second and process, "
+                             "0 for no limit.")
+    parser.add_argument('--heartbeat-interval', type=float, default=None,
+                        help="Override the interval from BootNotification.")
+    parser.add_argument('--firmware-step', type=float, default=5.0)
+    parser.add_argument('--log-step', type=float, default=3.0)
+    parser.add_argument(
+        '--reconnect-at', type=float, default=None,
+        help="Seconds after which every station drops its connection and "
+             "reconnects at once.")
+    parser.add_argument('--connect-timeout', type=float, default=30)
+    parser.add_argument('--response-timeout', type=float, default=30)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    station_ids = [f'{args.prefix}{i}' for i in range(args.stations)]
+
+    start = time.monotonic()
+    if args.processes > 1:
+        shards = [station_ids[i::args.processes]
+                  for i in range(args.processes)]
+        with ProcessPoolExecutor(max_workers=args.processes) as pool:
+            results = list(pool.map(_run_fleet_in_process, shards,
+                                    [args] * len(shards)))
+    else:
+        results = [asyncio.run(run_fleet(station_ids, args))]
+
+    report(results, time.monotonic() - start)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+""" Heartbeat fast path: a cached clock, an adaptive heartbeat interval and a
+timer wheel that tracks station liveness without a timer per station.
+"""
+import asyncio
+import logging
+import math
+from datetime import datetime
+
+LOGGER = logging.getLogger('central_system.heartbeat')
+
+
+class CachedClock:
+    """ Keeps a pre-formatted UTC timestamp that is refreshed once per tick,
+    so Heartbeat handlers don't format a datetime for every station.
+    """
+
+    def __init__(self, tick=1.0):
+        self.tick = tick
+        self.now = None
+        self.refresh()
+
+    def refresh(self):
+        self.now = datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S') + "Z"
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.tick)
+            self.refresh()
+
+
+class AdaptiveInterval:
+    """ Chooses the heartbeat interval of stations from the fleet size and
+    the load of the event loop.
+
+    The interval spreads the fleet's heartbeats to about
+    `heartbeats_per_second`. While the event loop lags behind by more than
+    `lag_target` seconds the interval is stretched in proportion.
+    """
+
+    def __init__(self, min_interval=10, max_interval=600,
+                 heartbeats_per_second=200, lag_target=0.05, tick=1.0):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.heartbeats_per_second = heartbeats_per_second
+        self.lag_target = lag_target
+        self.tick = tick
+        # >= 1, how much the loop lags behind relative to lag_target
+        self.load = 1.0
+        self._lag = 0.0
+
+    def interval(self, fleet_size):
+        interval = fleet_size / self.heartbeats_per_second * self.load
+        return int(min(max(interval, self.min_interval), self.max_interval))
+
+    async def run(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.tick)
+            lag = max(loop.time() - start - self.tick, 0.0)
+            self._lag = 0.8 * self._lag + 0.2 * lag
+            self.load = max(1.0, self._lag / self.lag_target)
+
+
+class LivenessTracker:
+    """ Timer wheel flagging stations that missed `missed_heartbeats`
+    heartbeats in a row.
+
+    Every station lives in exactly one slot of the wheel: the slot of the
+    tick at which it expires. A heartbeat moves the station to a new slot
+    and every tick only looks at the slot under the cursor, so both are
+    O(1) regardless of fleet size.
+    """
+
+    def __init__(self, interval=10, missed_heartbeats=3, tick=1.0,
+                 on_expired=None, max_timeout=None):
+        self.tick = tick
+        self.interval = interval
+        self.missed_heartbeats = missed_heartbeats
+        self.on_expired = on_expired or self._log_expired
+        max_timeout = max_timeout or interval * missed_heartbeats
+        # Slots are created lazily, so a wheel spanning hours stays small.
+        self._slots = [None] * (math.ceil(max_timeout / tick) + 1)
+        self._cursor = 0
+        # station id -> index of the slot it is currently stored in
+        self._slot_of = {}
+
+    def __len__(self):
+        return len(self._slot_of)
+
+    def touch(self, station_id, interval=None):
+        """ Record a sign of life for the station. It expires after
+        `missed_heartbeats` times its heartbeat interval.
+        """
+        timeout = (interval or self.interval) * self.missed_heartbeats
+        ticks = min(max(1, math.ceil(timeout / self.tick)),
+                    len(self._slots) - 1)
+        slot = (self._cursor + ticks) % len(self._slots)
+
+        previous = self._slot_of.get(station_id)
+        if previous == slot:
+            return
+        if previous is not None:
+            self._slots[previous].discard(station_id)
+        if self._slots[slot] is None:
+            self._slots[slot] = set()
+        self._slots[slot].add(station_id)
+        self._slot_of[station_id] = slot
+
+    def forget(self, station_id):
+        slot = self._slot_of.pop(station_id, None)
+        if slot is not None:
+            self._slots[slot].discard(station_id)
+
+    def advance(self):
+        """ Move the wheel one tick and return the stations that expired. """
+        self._cursor = (self._cursor + 1) % len(self._slots)
+        expired = self._slots[self._cursor]
+        if expired is None:
+            return ()
+        self._slots[self._cursor] = None
+        for station_id in expired:
+            del self._slot_of[station_id]
+        return expired
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.tick)
+            for station_id in self.advance():
+                self.on_expired(station_id)
+
+    def _log_expired(self, station_id):
+        LOGGER.warning("Station %s missed %d heartbeats", station_id,
+                       self.missed_heartbeats)
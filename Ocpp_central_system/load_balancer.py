@@ -0,0 +1,248 @@
+""" Site-level dynamic load balancing.
+
+Every site with a grid capacity shares it between its EVSEs that have an
+Occupied connector. allocate() is a vectorized water-filling: every EVSE
+gets an equal share, capped at its maximum power, and what capped EVSEs
+don't use is shared by the others. When the capacity can't give every EVSE
+the minimum power, the EVSEs that have been waiting longest get a share and
+the others are paused at 0 W.
+
+Status changes (see ConnectorStatusTable.add_listener) mark their site for
+a rebalance; the balancer waits `settle` seconds so a burst of changes is
+handled once, then recomputes only the marked sites. A limit is pushed with
+SetChargingProfile only when it differs from the one last pushed to the EVSE
+by more than `threshold` Watt, or when it is lower and the limits left as
+they are would add up to more than the capacity.
+
+Lower limits are pushed first and the higher ones only once the stations
+accepted them, so the site never exceeds its capacity in between. A push
+that fails marks the site for another rebalance after a jittered,
+exponentially growing delay.
+"""
+import asyncio
+import logging
+import random
+
+try:
+    import numpy as np
+except ModuleNotFoundError:
+    print("This example relies on the 'numpy' package.")
+    print("Please install it by running: ")
+    print()
+    print(" $ pip install numpy")
+    import sys
+    sys.exit(1)
+
+LOGGER = logging.getLogger('central_system.load_balancer')
+
+# Id of the TxDefaultProfile the balancer installs on every EVSE. Sending it
+# again replaces the previous limit on the station, and a queued update of
+# the same EVSE is superseded by a newer one, see outbound_queue.py.
+PROFILE_ID = 9000
+STACK_LEVEL = 0
+
+ACTIVE_STATUS = 'Occupied'
+
+
+def site_limit_profile(limit):
+    """ A TxDefaultProfile limiting an EVSE to `limit` Watt. """
+    return {
+        'id': PROFILE_ID,
+        'stackLevel': STACK_LEVEL,
+        'chargingProfilePurpose': 'TxDefaultProfile',
+        'chargingProfileKind': 'Relative',
+        'chargingSchedule': [{
+            'id': PROFILE_ID,
+            'chargingRateUnit': 'W',
+            'chargingSchedulePeriod': [{'startPeriod': 0,
+                                        'limit': float(limit)}],
+        }],
+    }
+
+
+def allocate(capacity, max_power, min_power=0.0):
+    """ Split capacity between EVSEs with the given maximum power, in order
+    of priority. Returns the limit of every EVSE.
+    """
+    max_power = np.asarray(max_power, dtype=np.float64)
+    n = len(max_power)
+    if n == 0 or max_power.sum() <= capacity:
+        return max_power.copy()
+    if min_power and capacity < n * min_power:
+        # Only the first EVSEs can get the minimum; pause the others.
+        limits = np.zeros(n)
+        served = int(capacity // min_power)
+        if served:
+            limits[:served] = allocate(capacity, max_power[:served])
+        return limits
+    # Find the level L with sum(min(max_power, L)) == capacity: with the k
+    # smallest maxima below it, L = (capacity - their sum) / (n - k).
+    order = np.argsort(max_power, kind='stable')
+    ascending = max_power[order]
+    below = np.concatenate(([0.0], np.cumsum(ascending)[:-1]))
+    levels = (capacity - below) / (n - np.arange(n))
+    level = levels[np.argmax(levels <= ascending)]
+    return np.minimum(max_power, level)
+
+
+class SiteLoadBalancer:
+
+    def __init__(self, connectors, push, capacities=None,
+                 evse_max_power=22000, min_power=1380, threshold=500,
+                 settle=0.5, retry_backoff=5.0, max_retry_backoff=300.0):
+        """
+        Args:
+
+            connectors (ConnectorStatusTable): Status of all connectors.
+            push: Coroutine function push(station_id, evse_id, limit)
+                returning True when the station accepted the limit.
+            capacities (dict): Site -> grid capacity in Watt. Sites without
+                one aren't balanced.
+            evse_max_power (float): Maximum power of an EVSE in Watt.
+            min_power (float): Least power worth charging with, in Watt.
+            threshold (float): Smallest change of a limit, in Watt, that is
+                pushed to the station.
+            settle (float): Seconds to collect status changes before
+                rebalancing.
+            retry_backoff (float): Seconds before a site whose push failed
+                is rebalanced again; doubled for every further failure, up
+                to max_retry_backoff.
+
+        """
+        self.connectors = connectors
+        self.push = push
+        self.capacities = dict(capacities or {})
+        self.evse_max_power = evse_max_power
+        self.min_power = min_power
+        self.threshold = threshold
+        self.settle = settle
+        self.retry_backoff = retry_backoff
+        self.max_retry_backoff = max_retry_backoff
+        # site -> {(station id, evse id): limit last pushed}
+        self.limits = {}
+        self.pushes = 0
+        self._dirty = set()
+        self._wakeup = None
+        # site -> task pushing its limits
+        self._applying = {}
+        # site -> failed rounds of pushes in a row
+        self._failures = {}
+        connectors.add_listener(self.on_status_change)
+
+    def on_status_change(self, station_id, site):
+        if site in self.capacities:
+            self._dirty.add(site)
+            if self._wakeup is not None:
+                self._wakeup.set()
+
+    def set_capacity(self, site, capacity):
+        self.capacities[site] = capacity
+        self.on_status_change(None, site)
+
+    def rebalance(self, site):
+        """ Recompute the limits of a site. Returns [(station id, evse id,
+        limit, previous limit)] of the EVSEs whose limit changed by more than
+        the threshold, and records them as pushed. The previous limit is NaN
+        for EVSEs that had none.
+        """
+        station_ids, evse_ids, _ = self.connectors.evses(site, ACTIVE_STATUS)
+        keys = list(zip(station_ids, evse_ids.tolist()))
+        new = allocate(self.capacities[site],
+                       np.full(len(keys), self.evse_max_power, dtype=float),
+                       self.min_power)
+        previous = self.limits.get(site, {})
+        old = np.array([previous.get(key, np.nan) for key in keys],
+                       dtype=np.float64)
+        changed = np.isnan(old) | (np.abs(new - old) > self.threshold)
+        if np.where(changed, new, old).sum() > self.capacities[site]:
+            # Small decreases add up; never exceed the grid capacity.
+            changed |= new < old
+        # EVSEs that are no longer active are forgotten; their profile is
+        # replaced when they become active again.
+        limits = dict(zip(keys, np.where(changed, new, old).tolist()))
+        self.limits[site] = limits
+        return [(keys[i][0], keys[i][1], limits[keys[i]], float(old[i]))
+                for i in np.flatnonzero(changed)]
+
+    async def _push(self, site, station_id, evse_id, limit):
+        try:
+            accepted = await self.push(station_id, evse_id, limit)
+        except Exception as e:
+            LOGGER.warning("Pushing a %g W limit to %s EVSE %d failed: %r",
+                           limit, station_id, evse_id, e)
+            accepted = False
+        if not accepted:
+            self._forget(site, station_id, evse_id, limit)
+        return accepted
+
+    def _forget(self, site, station_id, evse_id, limit):
+        # Pushed again with the next rebalance of the site.
+        limits = self.limits.get(site, {})
+        if limits.get((station_id, evse_id)) == limit:
+            del limits[(station_id, evse_id)]
+
+    async def _apply(self, site, changes):
+        """ Push the lower limits, then, if all were accepted, the higher
+        ones. Schedules another rebalance when a push failed.
+        """
+        # An EVSE without a known limit (NaN) may draw its maximum power, so
+        # its limit goes out with the decreases.
+        increases = [c for c in changes if c[2] > c[3]]
+        decreases = [c for c in changes if not c[2] > c[3]]
+        try:
+            accepted = all(await asyncio.gather(
+                *[self._push(site, *change[:3]) for change in decreases]))
+            if accepted:
+                accepted = all(await asyncio.gather(
+                    *[self._push(site, *change[:3]) for change in increases]))
+            else:
+                for station_id, evse_id, limit, _ in increases:
+                    self._forget(site, station_id, evse_id, limit)
+        finally:
+            del self._applying[site]
+        if accepted:
+            self._failures.pop(site, None)
+            if site in self._dirty:
+                # Changed while the pushes were in flight.
+                self._wakeup.set()
+            return
+        failures = self._failures[site] = self._failures.get(site, 0) + 1
+        delay = min(self.retry_backoff * 2 ** (failures - 1),
+                    self.max_retry_backoff) * random.uniform(0.5, 1.5)
+        LOGGER.info("Site %s: rebalancing again in %.1f s after a failed "
+                    "push", site, delay)
+        asyncio.get_running_loop().call_later(
+            delay, self.on_status_change, None, site)
+
+    async def run(self):
+        self._wakeup = asyncio.Event()
+        if self._dirty:
+            self._wakeup.set()
+        while True:
+            await self._wakeup.wait()
+            await asyncio.sleep(self.settle)
+            self._wakeup.clear()
+            sites, self._dirty = self._dirty, set()
+            for site in sites:
+                if site in self._applying:
+                    # Rebalanced when the pushes in flight are done.
+                    self._dirty.add(site)
+                    continue
+                changes = self.rebalance(site)
+                if not changes:
+                    continue
+                LOGGER.info("Site %s: pushing new limits to %d of %d active "
+                            "EVSEs", site, len(changes),
+                            len(self.limits[site]))
+                self.pushes += len(changes)
+                self._applying[site] = asyncio.ensure_future(
+                    self._apply(site, changes))
+
+
+def parse_capacities(values):
+    """ Parse SITE=WATTS arguments, e.g. ['depot-1=150000']. """
+    capacities = {}
+    for value in values or []:
+        site, _, capacity = value.rpartition('=')
+        capacities[site] = float(capacity)
+    return capacities
@@ -0,0 +1,153 @@
+""" Per-station queue of outbound CALLs.
+
+OCPP allows a single outstanding CALL per direction, so outbound requests of
+a station wait for each other anyway. The queue decides the order instead of
+the event loop: requests are sent by priority, then in submission order.
+
+* A request with a deadline that passes while it is queued is dropped
+  instead of sent, its caller gets Expired.
+* A request with a coalescing key replaces a queued request with the same
+  key, whose caller gets Superseded. SetChargingProfile is keyed by EVSE
+  and profile id, so only the newest of several queued profiles goes out.
+"""
+import asyncio
+import heapq
+import itertools
+
+from call_table import DeadlineScheduler
+from codec import action_of
+
+# Action -> priority, lower is sent first.
+PRIORITIES = {
+    'SetChargingProfile': 0,
+    'ClearChargingProfile': 0,
+    'SetVariables': 1,
+    'GetVariables': 1,
+    'UpdateFirmware': 2,
+    'GetLog': 3,
+}
+DEFAULT_PRIORITY = 2
+
+
+class Dropped(Exception):
+    """ A queued request was not sent. """
+
+
+class Expired(Dropped):
+    """ The deadline of a queued request passed. """
+
+
+class Superseded(Dropped):
+    """ A newer request with the same coalescing key was queued. """
+
+
+def coalescing_key(payload):
+    """ Key of requests made obsolete by a newer one, or None. """
+    if payload.__class__.__name__ == 'SetChargingProfilePayload':
+        return ('SetChargingProfile', payload.evse_id,
+                payload.charging_profile.get('id'))
+    return None
+
+
+class OutboundQueue:
+
+    def __init__(self, call, priorities=PRIORITIES, scheduler=None):
+        """
+        Args:
+
+            call: Coroutine function sending a payload, with the signature
+                of ChargePoint.call(payload, suppress).
+            priorities: Action -> priority, lower is sent first.
+            scheduler (DeadlineScheduler): Drops requests whose deadline
+                passed; shared by the queues of all stations.
+
+        """
+        self.priorities = priorities
+        self.scheduler = scheduler or DeadlineScheduler()
+        self._call = call
+        # [priority, sequence, payload, suppress, future, key, timer]
+        self._heap = []
+        self._sequence = itertools.count()
+        # coalescing key -> queued entry
+        self._keyed = {}
+        self._current = None
+        self._task = None
+
+    def __len__(self):
+        return sum(not entry[4].done() for entry in self._heap)
+
+    def submit(self, payload, suppress=True, priority=None, deadline=None):
+        """ Queue a payload and return a future of the response.
+
+        The priority defaults to the one of the action. deadline is a
+        time.monotonic() value after which the request is dropped if it
+        hasn't been sent yet.
+        """
+        loop = asyncio.get_event_loop()
+        action = action_of(payload)
+        if priority is None:
+            priority = self.priorities.get(action, DEFAULT_PRIORITY)
+        future = loop.create_future()
+        key = coalescing_key(payload)
+        entry = [priority, next(self._sequence), payload, suppress, future,
+                 key, None]
+
+        if key is not None:
+            previous = self._keyed.get(key)
+            if previous is not None:
+                self._drop(previous, Superseded(
+                    f"{action} superseded by a newer request"))
+            self._keyed[key] = entry
+        if deadline is not None:
+            entry[6] = self.scheduler.call_at(
+                deadline, self._drop, entry,
+                Expired(f"Deadline of {action} passed before it was sent"))
+
+        heapq.heappush(self._heap, entry)
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._drain())
+        return future
+
+    def _drop(self, entry, error):
+        if entry[6] is not None:
+            entry[6].cancel()
+        if self._keyed.get(entry[5]) is entry:
+            del self._keyed[entry[5]]
+        if not entry[4].done():
+            entry[4].set_exception(error)
+
+    async def _drain(self):
+        while self._heap:
+            entry = heapq.heappop(self._heap)
+            _, _, payload, suppress, future, key, timer = entry
+            if timer is not None:
+                timer.cancel()
+            if self._keyed.get(key) is entry:
+                del self._keyed[key]
+            # Superseded, expired or cancelled by the caller.
+            if future.done():
+                continue
+
+            self._current = entry
+            try:
+                response = await self._call(payload, suppress)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                if not future.done():
+                    future.set_result(response)
+            finally:
+                self._current = None
+
+    def close(self, error=None):
+        """ Fail the request in flight and all queued ones, e.g. when the
+        station disconnected.
+        """
+        error = error or ConnectionError("Station disconnected")
+        if self._task is not None:
+            self._task.cancel()
+        if self._current is not None:
+            self._drop(self._current, error)
+        while self._heap:
+            self._drop(heapq.heappop(self._heap), error)
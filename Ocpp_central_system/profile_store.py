@@ -0,0 +1,275 @@
+""" Append-only store of the charging profiles installed on each station.
+
+Every accepted SetChargingProfile is appended as one JSON line to the store
+file. Writes are batched and done on a worker thread so the event loop never
+blocks on disk. On startup the file is read back into in-memory indexes by
+station, evse_id, profile id and stackLevel, and compacted when it holds
+many superseded records.
+
+Profiles are stored with the camelCase keys of the wire format, whether the
+caller passed them that way or in the library's snake_case.
+
+With several workers only the stations the store `persists` are written to
+its file; the records of other stations are passed to `forward`, and
+adopt() loads their profiles as export() returns them.
+"""
+import asyncio
+import json
+import logging
+import os
+
+from ocpp.charge_point import snake_to_camel_case
+
+LOGGER = logging.getLogger('central_system.profile_store')
+
+
+class ChargingProfileStore:
+
+    def __init__(self, path, flush_interval=0.05, compact_ratio=2,
+                 compact_min_records=10000):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.compact_ratio = compact_ratio
+        self.compact_min_records = compact_min_records
+
+        # (station id, profile id) -> (evse id, charging profile)
+        self._profiles = {}
+        # station id -> {evse id -> {profile id}}
+        self._by_station = {}
+        # (station id, evse id, purpose, stackLevel) -> profile id
+        self._by_stack_level = {}
+
+        # Callbacks invoked with (station id, evse id) whenever the profiles
+        # installed on an EVSE change.
+        self._listeners = []
+        # station id -> whether its records are written to the file; all
+        # stations when None. forward(record) is called with the others.
+        self.persists = None
+        self.forward = None
+
+        self._pending = []
+        self._wakeup = None
+        self._write_lock = None
+        self._records_in_file = 0
+
+    def __len__(self):
+        return len(self._profiles)
+
+    # Queries
+
+    def get(self, station_id, profile_id):
+        entry = self._profiles.get((station_id, profile_id))
+        return entry[1] if entry else None
+
+    def profiles(self, station_id, evse_id=None):
+        """ Return the installed profiles of a station, optionally limited to
+        one EVSE, as a list of (evse_id, charging profile) tuples.
+        """
+        evses = self._by_station.get(station_id, {})
+        if evse_id is not None:
+            evses = {evse_id: evses.get(evse_id, ())}
+        return [self._profiles[(station_id, profile_id)]
+                for ids in evses.values() for profile_id in ids]
+
+    def by_stack_level(self, station_id, evse_id, purpose, stack_level):
+        profile_id = self._by_stack_level.get(
+            (station_id, evse_id, purpose, stack_level))
+        if profile_id is None:
+            return None
+        return self.get(station_id, profile_id)
+
+    def stations(self):
+        return self._by_station.keys()
+
+    def add_listener(self, callback):
+        self._listeners.append(callback)
+
+    def export(self, station_id):
+        """ [(evse id, charging profile)] of a station, for adopt(). """
+        return self.profiles(station_id)
+
+    # Updates
+
+    def adopt(self, station_id, profiles):
+        """ Replace the profiles of a station by the ones another store
+        exported, without writing them.
+        """
+        self.drop(station_id)
+        for evse_id, profile in profiles:
+            self._apply_install(station_id, evse_id, profile)
+
+    def drop(self, station_id):
+        """ Forget the profiles of a station without writing it. """
+        for _, profile in self.profiles(station_id):
+            self._apply_remove(station_id, profile['id'])
+
+    def apply_remote(self, record):
+        """ Write a record forwarded by the worker holding the station. """
+        self._apply(record)
+        self._append(record)
+
+    def install(self, station_id, evse_id, charging_profile):
+        """ Record a profile the station accepted. A profile with the same id,
+        or with the same purpose and stackLevel on the same EVSE, is replaced
+        just like the station replaces it.
+        """
+        charging_profile = snake_to_camel_case(charging_profile)
+        self._apply_install(station_id, evse_id, charging_profile)
+        self._append({'op': 'install', 'station': station_id,
+                      'evse_id': evse_id, 'profile': charging_profile})
+
+    def remove(self, station_id, profile_id):
+        if self._apply_remove(station_id, profile_id):
+            self._append({'op': 'remove', 'station': station_id,
+                          'profile_id': profile_id})
+
+    def remove_matching(self, station_id, evse_id=None, purpose=None,
+                        stack_level=None, transaction_id=None):
+        """ Remove the profiles of a station matching all given criteria,
+        as ClearChargingProfile does; transaction_id also matches profiles
+        without one. Returns the ids of the removed profiles.
+        """
+        removed = []
+        for profile_evse, profile in self.profiles(station_id, evse_id):
+            if purpose is not None and \
+                    profile['chargingProfilePurpose'] != purpose:
+                continue
+            if stack_level is not None and \
+                    profile['stackLevel'] != stack_level:
+                continue
+            if transaction_id is not None and \
+                    profile.get('transactionId', transaction_id) != \
+                    transaction_id:
+                continue
+            removed.append(profile['id'])
+        for profile_id in removed:
+            self.remove(station_id, profile_id)
+        return removed
+
+    def _apply_install(self, station_id, evse_id, profile):
+        profile_id = profile['id']
+        self._apply_remove(station_id, profile_id)
+        stack_key = (station_id, evse_id, profile['chargingProfilePurpose'],
+                     profile['stackLevel'])
+        superseded = self._by_stack_level.get(stack_key)
+        if superseded is not None:
+            self._apply_remove(station_id, superseded)
+
+        self._profiles[(station_id, profile_id)] = (evse_id, profile)
+        self._by_station.setdefault(station_id, {}).setdefault(
+            evse_id, set()).add(profile_id)
+        self._by_stack_level[stack_key] = profile_id
+        for callback in self._listeners:
+            callback(station_id, evse_id)
+
+    def _apply_remove(self, station_id, profile_id):
+        entry = self._profiles.pop((station_id, profile_id), None)
+        if entry is None:
+            return False
+        evse_id, profile = entry
+        evses = self._by_station[station_id]
+        evses[evse_id].discard(profile_id)
+        if not evses[evse_id]:
+            del evses[evse_id]
+        if not evses:
+            del self._by_station[station_id]
+        del self._by_stack_level[(station_id, evse_id,
+                                  profile['chargingProfilePurpose'],
+                                  profile['stackLevel'])]
+        for callback in self._listeners:
+            callback(station_id, evse_id)
+        return True
+
+    # Persistence
+
+    def load(self):
+        """ Rebuild the indexes from the store file. Meant to be called once
+        at startup, before the server accepts connections.
+        """
+        self._records_in_file = 0
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # A torn last line after a crash.
+                    LOGGER.warning("Skipping corrupt record in %s", self.path)
+                    continue
+                self._records_in_file += 1
+                self._apply(record)
+        LOGGER.info("Recovered %d charging profiles from %s",
+                    len(self._profiles), self.path)
+
+    def _apply(self, record):
+        if record['op'] == 'install':
+            self._apply_install(record['station'], record['evse_id'],
+                                record['profile'])
+        else:
+            self._apply_remove(record['station'], record['profile_id'])
+
+    def _append(self, record):
+        if self.persists is not None and \
+                not self.persists(record['station']):
+            self.forward(record)
+            return
+        self._pending.append(record)
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def run(self):
+        """ Writer task: flushes pending records in batches. """
+        self._wakeup = asyncio.Event()
+        if self._pending:
+            self._wakeup.set()
+        while True:
+            await self._wakeup.wait()
+            # Give concurrent installs a moment to join the batch.
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def flush(self):
+        if self._write_lock is None:
+            self._write_lock = asyncio.Lock()
+        async with self._write_lock:
+            if self._wakeup is not None:
+                self._wakeup.clear()
+            batch, self._pending = self._pending, []
+            if not batch:
+                return
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self._write, batch)
+            self._records_in_file += len(batch)
+
+            if (self._records_in_file > self.compact_min_records and
+                    self._records_in_file >
+                    self.compact_ratio * len(self._profiles)):
+                records = self._snapshot()
+                await loop.run_in_executor(None, self._rewrite, records)
+                self._records_in_file = len(records)
+
+    def _snapshot(self):
+        return [{'op': 'install', 'station': station_id,
+                 'evse_id': evse_id, 'profile': profile}
+                for (station_id, _), (evse_id, profile)
+                in self._profiles.items()
+                if self.persists is None or self.persists(station_id)]
+
+    def _write(self, batch):
+        data = ''.join(json.dumps(r, separators=(',', ':')) + '\n'
+                       for r in batch)
+        with open(self.path, 'a') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _rewrite(self, records):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            for record in records:
+                f.write(json.dumps(record, separators=(',', ':')) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        LOGGER.info("Compacted %s to %d records", self.path, len(records))
@@ -0,0 +1,212 @@
+""" Replay a traffic journal against a central system.
+
+Every station of the journal connects to the central system and sends the
+CALLs it sent when the journal was recorded (BootNotification,
+StatusNotification, Heartbeat, FirmwareStatusNotification,
+LogStatusNotification, ...) with the recorded timing, scaled by --speed.
+CALLs of the central system are answered with the station's recorded
+response to the same action. Like a real station, a replayed station waits
+for the answer to one CALL before it sends the next.
+
+    $ python replay_journal.py journal/ --speed 10
+    $ python replay_journal.py journal/ --speed 0    # as fast as possible
+
+The report shows the CALL latency and how long the replay took compared to
+the recorded traffic.
+"""
+import argparse
+import asyncio
+import json
+import time
+from collections import defaultdict, deque
+
+try:
+    import websockets
+except ModuleNotFoundError:
+    print("This example relies on the 'websockets' package.")
+    print("Please install it by running: ")
+    print()
+    print(" $ pip install websockets")
+    import sys
+    sys.exit(1)
+
+from fleet_simulator import percentile
+from traffic_journal import IN, read_journal
+
+
+class ReplayStats:
+
+    def __init__(self):
+        self.stations = 0
+        self.connect_failures = 0
+        self.calls = 0
+        self.call_errors = 0
+        self.timeouts = 0
+        self.answered = 0
+        self.unanswerable = 0
+        self.latencies = []
+
+
+class StationTraffic:
+    """ Recorded traffic of one station. """
+
+    def __init__(self):
+        # (timestamp, unique id, frame) of the CALLs the station sent
+        self.calls = []
+        # action -> CALLRESULT / CALLERROR frames the station answered with
+        self.responses = defaultdict(deque)
+
+
+def load(directory):
+    """ Return ({station id: StationTraffic}, first timestamp, last
+    timestamp) of the journal.
+    """
+    stations = defaultdict(StationTraffic)
+    first = last = None
+    for timestamp, direction, station_id, action, frame in \
+            read_journal(directory):
+        if first is None:
+            first = timestamp
+        last = timestamp
+        if direction != IN:
+            continue
+        traffic = stations[station_id]
+        if frame.lstrip('[ \r\n\t')[:1] == '2':
+            traffic.calls.append((timestamp, frame.split('"', 2)[1], frame))
+        else:
+            traffic.responses[action].append(frame)
+    return stations, first, last
+
+
+def _answer(traffic, message, stats):
+    """ The recorded response of the station to a CALL of the central
+    system, with the unique id of the CALL.
+    """
+    unique_id, action = message[1], message[2]
+    recorded = traffic.responses.get(action)
+    if not recorded:
+        stats.unanswerable += 1
+        return json.dumps([4, unique_id, 'NotImplemented',
+                           f'No recorded {action} response', {}])
+    response = json.loads(recorded[0])
+    # Reuse the last recorded response once all have been replayed.
+    if len(recorded) > 1:
+        recorded.popleft()
+    response[1] = unique_id
+    stats.answered += 1
+    return json.dumps(response, separators=(',', ':'))
+
+
+async def replay_station(url, station_id, traffic, start, first, args, stats):
+    loop = asyncio.get_running_loop()
+
+    def due(timestamp):
+        if not args.speed:
+            return 0
+        return start + (timestamp - first) / args.speed - loop.time()
+
+    if traffic.calls and due(traffic.calls[0][0]) > 0:
+        await asyncio.sleep(due(traffic.calls[0][0]))
+    try:
+        ws = await websockets.connect(
+            f'{url}/{args.prefix}{station_id}',
+            subprotocols=['ocpp2.0.1'], open_timeout=args.connect_timeout)
+    except (OSError, asyncio.TimeoutError,
+            websockets.exceptions.InvalidHandshake):
+        stats.connect_failures += 1
+        return
+    stats.stations += 1
+    # unique id -> future of the central system's answer
+    waiting = {}
+
+    async def receive():
+        async for raw in ws:
+            message = json.loads(raw)
+            if message[0] == 2:
+                await ws.send(_answer(traffic, message, stats))
+            else:
+                future = waiting.pop(message[1], None)
+                if future is not None and not future.done():
+                    future.set_result(message[0])
+
+    receiver = asyncio.ensure_future(receive())
+    try:
+        for timestamp, unique_id, frame in traffic.calls:
+            delay = due(timestamp)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            future = waiting[unique_id] = loop.create_future()
+            sent = time.perf_counter()
+            await ws.send(frame)
+            stats.calls += 1
+            try:
+                message_type = await asyncio.wait_for(
+                    future, args.response_timeout)
+            except asyncio.TimeoutError:
+                waiting.pop(unique_id, None)
+                stats.timeouts += 1
+                continue
+            stats.latencies.append(time.perf_counter() - sent)
+            if message_type == 4:
+                stats.call_errors += 1
+        if args.linger:
+            await asyncio.sleep(args.linger)
+    except websockets.exceptions.ConnectionClosed:
+        pass
+    finally:
+        receiver.cancel()
+        await ws.close()
+
+
+async def replay(args):
+    stations, first, last = load(args.journal)
+    if not stations:
+        print("The journal holds no traffic.")
+        return
+    stats = ReplayStats()
+    start = asyncio.get_running_loop().time()
+    began = time.monotonic()
+    await asyncio.gather(*[
+        replay_station(args.url, station_id, traffic, start, first, args,
+                       stats)
+        for station_id, traffic in stations.items()])
+    report(stats, last - first, time.monotonic() - began)
+
+
+def report(stats, recorded, elapsed):
+    latencies = sorted(stats.latencies)
+    print(f"stations           : {stats.stations}")
+    print(f"connect failures   : {stats.connect_failures}")
+    print(f"calls sent         : {stats.calls}")
+    print(f"call errors        : {stats.call_errors}")
+    print(f"timeouts           : {stats.timeouts}")
+    print(f"calls answered     : {stats.answered} "
+          f"({stats.unanswerable} without a recorded response)")
+    print(f"recorded / replay  : {recorded:.2f} s / {elapsed:.2f} s")
+    print(f"calls/sec          : {stats.calls / elapsed:.1f}")
+    print(f"call latency p50   : {percentile(latencies, 0.50) * 1000:.2f} ms")
+    print(f"call latency p99   : {percentile(latencies, 0.99) * 1000:.2f} ms")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Replay a traffic journal against a central system.")
+    parser.add_argument('journal', help="Journal directory.")
+    parser.add_argument('--url', default='ws://localhost:9000')
+    parser.add_argument(
+        '--speed', type=float, default=1,
+        help="Replay speed relative to the recording, e.g. 1 or 10; 0 "
+             "sends every CALL as soon as the previous one is answered.")
+    parser.add_argument('--prefix', default='',
+                        help="Prepended to the recorded station ids.")
+    parser.add_argument(
+        '--linger', type=float, default=0,
+        help="Seconds to stay connected after the last CALL, to answer "
+             "requests of the central system.")
+    parser.add_argument('--connect-timeout', type=float, default=30)
+    parser.add_argument('--response-timeout', type=float, default=30)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    asyncio.run(replay(parse_args()))
@@ -0,0 +1,308 @@
+""" IPC bus for running the central system as several worker processes.
+
+All workers accept connections on the same port (SO_REUSEPORT), so the
+kernel spreads stations over them. The supervisor process runs a Broker on a
+Unix socket which holds the station directory (station id -> worker) and
+relays outbound operations to the worker holding the station's socket:
+
+    worker A --req--> broker --req--> worker B --> ChargePoint.<operation>()
+    worker A <--rep-- broker <--rep-- worker B
+
+Workers can also notify another worker by id, without a reply, or ask it a
+query:
+
+    worker A --evt--> broker --evt--> worker B --> on_event(<name>, ...)
+    worker A --req--> broker --req--> worker B --> on_event(<name>, ...)
+    worker A <--rep-- broker <--rep-- worker B
+
+When a station registers with another worker than the one it was last
+registered with, the broker sends that worker a 'station_moved' event.
+
+The persisted state of a station is kept by one worker, its home_worker();
+the others fetch it from there and send their updates there.
+
+Messages are newline delimited JSON objects.
+"""
+import asyncio
+import itertools
+import json
+import logging
+import zlib
+from dataclasses import asdict, is_dataclass
+
+LOGGER = logging.getLogger('central_system.sharding')
+
+# Worker id used by the broker when it originates a request itself.
+SUPERVISOR = -1
+
+# StreamReader line limit; large enough for any OCPP payload.
+LINE_LIMIT = 16 * 1024 * 1024
+
+
+def home_worker(station_id, workers):
+    """ Id of the worker keeping the persisted state of a station. The same
+    in every process, unlike hash().
+    """
+    return zlib.crc32(station_id.encode()) % workers
+
+
+class RemoteError(Exception):
+    """ An operation failed on the worker holding the station. """
+
+
+def encode_result(result):
+    if is_dataclass(result):
+        return {'cls': result.__class__.__name__, 'res': asdict(result)}
+    return {'cls': None, 'res': result}
+
+
+def decode_result(message, result_module):
+    if message['cls'] is None:
+        return message['res']
+    return getattr(result_module, message['cls'])(**message['res'])
+
+
+async def _write(writer, message):
+    writer.write(json.dumps(message, separators=(',', ':')).encode() + b'\n')
+    await writer.drain()
+
+
+class _Requests:
+    """ Futures of requests waiting for their reply, by request id. """
+
+    def __init__(self):
+        self._ids = itertools.count()
+        self._futures = {}
+
+    def create(self):
+        request_id = next(self._ids)
+        future = asyncio.get_event_loop().create_future()
+        self._futures[request_id] = future
+        return request_id, future
+
+    def discard(self, request_id):
+        self._futures.pop(request_id, None)
+
+    def resolve(self, message):
+        future = self._futures.pop(message['id'], None)
+        if future is None or future.done():
+            return
+        if message['ok']:
+            future.set_result(message)
+        else:
+            future.set_exception(RemoteError(message['err']))
+
+
+class Broker:
+    """ Station directory and request relay, run by the supervisor. """
+
+    def __init__(self, path, result_module=None, timeout=60):
+        self.path = path
+        self.result_module = result_module
+        self.timeout = timeout
+        # station id -> worker id
+        self.directory = {}
+        # station id -> worker id it was last registered with, for stations
+        # that aren't connected
+        self._previous = {}
+        # worker id -> StreamWriter
+        self._workers = {}
+        self._requests = _Requests()
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_unix_server(
+            self._handle_worker, self.path, limit=LINE_LIMIT)
+
+    async def close(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _handle_worker(self, reader, writer):
+        worker_id = None
+        try:
+            async for line in reader:
+                message = json.loads(line)
+                kind = message['t']
+                if kind == 'reg':
+                    await self._register(message['s'], worker_id)
+                elif kind == 'unreg':
+                    if self.directory.get(message['s']) == worker_id:
+                        del self.directory[message['s']]
+                        self._previous[message['s']] = worker_id
+                elif kind == 'req':
+                    await self._relay_request(worker_id, message)
+                elif kind == 'rep':
+                    if message['to'] == SUPERVISOR:
+                        self._requests.resolve(message)
+                    elif message['to'] in self._workers:
+                        await _write(self._workers[message['to']], message)
+                elif kind == 'evt':
+                    if message['to'] in self._workers:
+                        await _write(self._workers[message['to']], message)
+                elif kind == 'hello':
+                    worker_id = message['worker']
+                    self._workers[worker_id] = writer
+                    LOGGER.info("Worker %d joined the bus", worker_id)
+        finally:
+            LOGGER.warning("Worker %s left the bus", worker_id)
+            self._workers.pop(worker_id, None)
+            self.directory = {s: w for s, w in self.directory.items()
+                              if w != worker_id}
+
+    async def _register(self, station_id, worker_id):
+        previous = self.directory.get(station_id,
+                                      self._previous.pop(station_id, None))
+        self.directory[station_id] = worker_id
+        if previous != worker_id and previous in self._workers:
+            await _write(self._workers[previous], {
+                't': 'evt', 'to': previous, 'op': 'station_moved',
+                'kw': {'station_id': station_id}})
+
+    async def _relay_request(self, origin, message):
+        message['from'] = origin
+        if 'w' in message:
+            owner = message['w']
+            error = f"Worker {owner} is not on the bus"
+        else:
+            owner = self.directory.get(message['s'])
+            error = f"Station {message['s']} is not connected"
+        if owner is None or owner not in self._workers:
+            reply = {'t': 'rep', 'id': message['id'], 'to': origin,
+                     'ok': False, 'err': error}
+            if origin == SUPERVISOR:
+                self._requests.resolve(reply)
+            else:
+                await _write(self._workers[origin], reply)
+            return
+        await _write(self._workers[owner], message)
+
+    async def route(self, station_id, operation, kwargs=None, timeout=None):
+        """ Run an operation on the station from the supervisor, waiting
+        timeout seconds, or self.timeout, for the reply.
+        """
+        request_id, future = self._requests.create()
+        await self._relay_request(SUPERVISOR, {
+            't': 'req', 'id': request_id, 's': station_id, 'op': operation,
+            'kw': kwargs or {}})
+        try:
+            reply = await asyncio.wait_for(future, timeout or self.timeout)
+        finally:
+            self._requests.discard(request_id)
+        return decode_result(reply, self.result_module)
+
+
+class WorkerBus:
+    """ A worker's connection to the broker. """
+
+    def __init__(self, path, worker_id, execute, result_module, timeout=60,
+                 on_event=None):
+        """
+        Args:
+
+            path (str): Unix socket of the broker.
+            worker_id (int): Id of this worker.
+            execute: Coroutine function called with a station id, operation
+                name and keyword arguments for requests routed to this
+                worker.
+            result_module: Module holding the result dataclasses, e.g.
+                ocpp.v201.call_result.
+            timeout (float): Seconds to wait for a routed request that
+                doesn't give its own timeout.
+            on_event: Function called with an event name and keyword
+                arguments for events and queries other workers sent to
+                this one; its return value answers a query.
+
+        """
+        self.path = path
+        self.worker_id = worker_id
+        self.timeout = timeout
+        self._execute = execute
+        self._on_event = on_event
+        self._result_module = result_module
+        self._requests = _Requests()
+        self._reader = None
+        self._writer = None
+
+    async def connect(self, retries=50, delay=0.1):
+        for _ in range(retries):
+            try:
+                self._reader, self._writer = \
+                    await asyncio.open_unix_connection(self.path,
+                                                       limit=LINE_LIMIT)
+                break
+            except (FileNotFoundError, ConnectionRefusedError):
+                await asyncio.sleep(delay)
+        else:
+            raise ConnectionError(f"Broker at {self.path} is not reachable")
+        await _write(self._writer, {'t': 'hello', 'worker': self.worker_id})
+
+    async def register(self, station_id):
+        await _write(self._writer, {'t': 'reg', 's': station_id})
+
+    async def unregister(self, station_id):
+        await _write(self._writer, {'t': 'unreg', 's': station_id})
+
+    def notify(self, worker_id, event, kwargs=None):
+        """ Send an event to another worker; it is dropped if the worker
+        isn't on the bus. Doesn't wait for the bus to drain, so it can be
+        called from synchronous code.
+        """
+        self._writer.write(json.dumps(
+            {'t': 'evt', 'to': worker_id, 'op': event, 'kw': kwargs or {}},
+            separators=(',', ':')).encode() + b'\n')
+
+    async def ask(self, worker_id, query, kwargs=None, timeout=None):
+        """ Return the answer of another worker's on_event() to a query. """
+        request_id, future = self._requests.create()
+        await _write(self._writer, {
+            't': 'req', 'id': request_id, 'w': worker_id, 'op': query,
+            'kw': kwargs or {}})
+        try:
+            reply = await asyncio.wait_for(future, timeout or self.timeout)
+        finally:
+            self._requests.discard(request_id)
+        return reply['res']
+
+    async def route(self, station_id, operation, kwargs=None, timeout=None):
+        """ Run an operation on a station held by another worker, waiting
+        timeout seconds, or self.timeout, for the reply.
+        """
+        request_id, future = self._requests.create()
+        await _write(self._writer, {
+            't': 'req', 'id': request_id, 's': station_id, 'op': operation,
+            'kw': kwargs or {}})
+        try:
+            reply = await asyncio.wait_for(future, timeout or self.timeout)
+        finally:
+            self._requests.discard(request_id)
+        return decode_result(reply, self._result_module)
+
+    async def run(self):
+        """ Dispatch messages from the broker until the bus closes. """
+        async for line in self._reader:
+            message = json.loads(line)
+            if message['t'] == 'rep':
+                self._requests.resolve(message)
+            elif message['t'] == 'req':
+                asyncio.ensure_future(self._serve_request(message))
+            elif message['t'] == 'evt' and self._on_event is not None:
+                try:
+                    self._on_event(message['op'], **message['kw'])
+                except Exception:
+                    LOGGER.exception("Handling event %s failed",
+                                     message['op'])
+        LOGGER.error("Lost connection to the broker")
+
+    async def _serve_request(self, message):
+        reply = {'t': 'rep', 'id': message['id'], 'to': message['from']}
+        try:
+            if 'w' in message:
+                result = self._on_event(message['op'], **message['kw'])
+            else:
+                result = await self._execute(message['s'], message['op'],
+                                             **message['kw'])
+            reply.update(ok=True, **encode_result(result))
+        except Exception as e:
+            reply.update(ok=False, err=repr(e))
+        await _write(self._writer, reply)
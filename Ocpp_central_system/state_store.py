@@ -0,0 +1,269 @@
+""" Crash-recoverable station state: a compact snapshot plus a write-ahead
+log.
+
+Every change is applied in memory and appended to the write-ahead log, which
+is written and fsync'd in batches on a worker thread. Once the log holds
+enough records a snapshot of the whole state is written next to it and the
+log starts over. On startup the snapshot is loaded and the log replayed;
+records are idempotent, so replaying a record that is already part of the
+snapshot is harmless.
+
+Kept per station:
+
+* the last accepted BootNotification and the heartbeat interval given,
+* the last status of every connector,
+* outbound requests still in progress (UpdateFirmware, GetLog) by request
+  id, with the last status reported,
+* on-connect operations already done, so they aren't repeated on reconnect,
+* device model variables the station accepted.
+
+With several workers a store only logs the stations it `persists`; the
+records of other stations are passed to `forward`, which sends them to the
+worker keeping them. adopt() loads the state of such a station fetched from
+there, as export() returns it.
+"""
+import asyncio
+import json
+import logging
+import os
+
+import codec
+
+LOGGER = logging.getLogger('central_system.state_store')
+
+
+def _new_station():
+    return {'boot': None, 'interval': None, 'connectors': {}, 'pending': {},
+            'done': [], 'variables': {}}
+
+
+class StateStore:
+
+    def __init__(self, directory, flush_interval=0.05,
+                 snapshot_min_records=10000):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.snapshot_min_records = snapshot_min_records
+        # station id -> state, see _new_station()
+        self.stations = {}
+        # station id -> whether this store logs its records; all stations
+        # when None. forward(record) is called with the records of others.
+        self.persists = None
+        self.forward = None
+
+        self._pending = []
+        self._wakeup = None
+        self._write_lock = None
+        self._records_in_log = 0
+
+    @property
+    def snapshot_path(self):
+        return os.path.join(self.directory, 'state.snapshot')
+
+    @property
+    def log_path(self):
+        return os.path.join(self.directory, 'state.wal')
+
+    def __len__(self):
+        return len(self.stations)
+
+    def __contains__(self, station_id):
+        return station_id in self.stations
+
+    # Queries
+
+    def get(self, station_id):
+        return self.stations.get(station_id)
+
+    def heartbeat_interval(self, station_id):
+        station = self.stations.get(station_id)
+        return station['interval'] if station else None
+
+    def pending(self, station_id):
+        """ request id -> {'op': action, 'status': last status} """
+        station = self.stations.get(station_id)
+        return station['pending'] if station else {}
+
+    def done(self, station_id, operation):
+        station = self.stations.get(station_id)
+        return station is not None and operation in station['done']
+
+    def export(self, station_id):
+        return self.stations.get(station_id)
+
+    # Updates
+
+    def adopt(self, station_id, station):
+        """ Take the state of a station that another store logs. """
+        if station is None:
+            self.stations.pop(station_id, None)
+        else:
+            self.stations[station_id] = station
+
+    def drop(self, station_id):
+        self.stations.pop(station_id, None)
+
+    def boot(self, station_id, charging_station, reason, interval):
+        self._record({'k': 'boot', 's': station_id,
+                      'station': charging_station, 'reason': reason,
+                      'interval': interval})
+
+    def status(self, station_id, evse_id, connector_id, status):
+        self._record({'k': 'status', 's': station_id,
+                      'c': f'{evse_id}/{connector_id}', 'status': status})
+
+    def start_request(self, station_id, request_id, action):
+        self._record({'k': 'req', 's': station_id, 'id': str(request_id),
+                      'op': action, 'status': None})
+
+    def request_status(self, station_id, request_id, status, finished):
+        """ Record the status of a request in progress; a finished request
+        is forgotten.
+        """
+        if str(request_id) not in self.pending(station_id):
+            return
+        if finished:
+            self._record({'k': 'req_end', 's': station_id,
+                          'id': str(request_id)})
+        else:
+            self._record({'k': 'req', 's': station_id, 'id': str(request_id),
+                          'status': status})
+
+    def operation_done(self, station_id, operation):
+        if not self.done(station_id, operation):
+            self._record({'k': 'done', 's': station_id, 'op': operation})
+
+    def variable(self, station_id, key, value):
+        """ Device model listener: a variable the station accepted. """
+        self._record({'k': 'var', 's': station_id, 'key': list(key),
+                      'value': value})
+
+    def apply_remote(self, record):
+        """ Log a record forwarded by the worker holding the station. """
+        self._record(record)
+
+    def _record(self, record):
+        self._apply(record)
+        if self.persists is not None and not self.persists(record['s']):
+            self.forward(record)
+            return
+        self._pending.append(record)
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _apply(self, record):
+        station = self.stations.get(record['s'])
+        if station is None:
+            station = self.stations[record['s']] = _new_station()
+        kind = record['k']
+        if kind == 'boot':
+            station['boot'] = {'station': record['station'],
+                               'reason': record['reason']}
+            station['interval'] = record['interval']
+        elif kind == 'status':
+            station['connectors'][record['c']] = record['status']
+        elif kind == 'req':
+            request = station['pending'].setdefault(
+                record['id'], {'op': None, 'status': None})
+            if 'op' in record:
+                request['op'] = record['op']
+            request['status'] = record['status']
+        elif kind == 'req_end':
+            station['pending'].pop(record['id'], None)
+        elif kind == 'done':
+            if record['op'] not in station['done']:
+                station['done'].append(record['op'])
+        elif kind == 'var':
+            station['variables'][json.dumps(record['key'])] = record['value']
+
+    def variables(self, station_id):
+        """ Yield (device model key, value) of the station's variables. """
+        station = self.stations.get(station_id)
+        for key, value in (station['variables'] if station else {}).items():
+            yield tuple(json.loads(key)), value
+
+    # Persistence
+
+    def load(self):
+        """ Load the snapshot and replay the log. Meant to be called once at
+        startup, before the server accepts connections.
+        """
+        self.stations = {}
+        self._records_in_log = 0
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, 'rb') as f:
+                self.stations = codec.loads(f.read())
+        if os.path.exists(self.log_path):
+            with open(self.log_path, 'r') as f:
+                for line in f:
+                    try:
+                        record = codec.loads(line)
+                    except ValueError:
+                        # A torn last line after a crash.
+                        LOGGER.warning("Skipping corrupt record in %s",
+                                       self.log_path)
+                        continue
+                    self._records_in_log += 1
+                    self._apply(record)
+        LOGGER.info("Recovered the state of %d stations from %s",
+                    len(self.stations), self.directory)
+
+    async def run(self):
+        """ Writer task: flushes pending records in batches. """
+        self._wakeup = asyncio.Event()
+        if self._pending:
+            self._wakeup.set()
+        while True:
+            await self._wakeup.wait()
+            # Give concurrent updates a moment to join the batch.
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def flush(self):
+        if self._write_lock is None:
+            self._write_lock = asyncio.Lock()
+        async with self._write_lock:
+            if self._wakeup is not None:
+                self._wakeup.clear()
+            batch, self._pending = self._pending, []
+            if not batch:
+                return
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self._write, batch)
+            self._records_in_log += len(batch)
+
+            if self._records_in_log > max(self.snapshot_min_records,
+                                          len(self.stations)):
+                # Serialized on the loop so the snapshot is consistent;
+                # records queued meanwhile go to the new log.
+                stations = self.stations
+                if self.persists is not None:
+                    stations = {station_id: station
+                                for station_id, station in stations.items()
+                                if self.persists(station_id)}
+                snapshot = codec.dumps(stations)
+                await loop.run_in_executor(None, self._write_snapshot,
+                                           snapshot)
+                self._records_in_log = 0
+
+    def _write(self, batch):
+        data = ''.join(codec.dumps(r) + '\n' for r in batch)
+        with open(self.log_path, 'a') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _write_snapshot(self, snapshot):
+        tmp_path = self.snapshot_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(snapshot)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+        # Only after the snapshot is durable; replaying a log that wasn't
+        # truncated after a crash is harmless.
+        with open(self.log_path, 'w') as f:
+            f.flush()
+            os.fsync(f.fileno())
+        LOGGER.info("Wrote a snapshot of %d stations to %s",
+                    len(self.stations), self.snapshot_path)
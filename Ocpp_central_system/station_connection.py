@@ -0,0 +1,128 @@
+""" Lean OCPP 2.0.1 connection for the central system side.
+
+ocpp.ChargePoint gives every connection an instance __dict__, a route map
+built by introspecting the instance (a dict and a bound method per action),
+an asyncio.Queue for responses with its own Event and deques, and a Lock.
+With tens of thousands of mostly idle stations this dominates the memory of
+the server. StationConnection keeps the behaviour and drops the overhead:
+
+* the route table is built once per class when the class is defined;
+  handlers are stored as functions and called with the instance,
+  wrap_handler() lets a subclass decorate every handler once,
+* state lives in __slots__; subclasses declare theirs the same way,
+* OCPP allows one outstanding CALL per direction, so the response slot is a
+  single future created by call() instead of a queue,
+* the call lock is only created for a station that is sent a CALL,
+* with a call_table.CallTable the response is awaited in the shared table
+  (per-action timeouts, one timer for all stations) instead of with
+  asyncio.wait_for().
+
+Frames are converted by codec.FastCodec, so everything else behaves like a
+FastCodec ChargePoint.
+"""
+import asyncio
+import logging
+import uuid
+
+from ocpp.routing import create_route_map
+from ocpp.v201 import call, call_result
+
+from codec import FastCodec
+
+LOGGER = logging.getLogger('ocpp')
+
+
+class StationConnection(FastCodec):
+
+    __slots__ = ('id', '_connection', '_response_timeout', '_lock',
+                 '_waiting')
+
+    _call = call
+    _call_result = call_result
+    _ocpp_version = '2.0.1'
+    _unique_id_generator = staticmethod(uuid.uuid4)
+
+    route_map = {}
+
+    # A call_table.CallTable shared by all connections, or None.
+    call_table = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        routes = create_route_map(cls)
+        for action, handlers in routes.items():
+            handlers['_unbound'] = True
+            if '_on_action' in handlers:
+                handlers['_on_action'] = cls.wrap_handler(
+                    action, handlers['_on_action'])
+        cls.route_map = routes
+
+    @classmethod
+    def wrap_handler(cls, action, handler):
+        """ Called once per class and action with the @on handler; returns
+        the function to route the action to.
+        """
+        return handler
+
+    def __init__(self, id, connection, response_timeout=30):
+        self.id = id
+        self._connection = connection
+        self._response_timeout = response_timeout
+        self._lock = None
+        # (unique id, future) of the CALL waiting for its response
+        self._waiting = None
+
+    def _timeout_of(self, action):
+        if self.call_table is None:
+            return self._response_timeout
+        return self.call_table.timeout(action)
+
+    @property
+    def _call_lock(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    async def start(self):
+        while True:
+            message = await self._connection.recv()
+            LOGGER.info('%s: receive message %s', self.id, message)
+
+            await self.route_message(message)
+
+    async def _send(self, message):
+        LOGGER.info('%s: send %s', self.id, message)
+        await self._connection.send(message)
+
+    def _receive_response(self, msg):
+        waiting = self._waiting
+        if waiting is not None and waiting[0] == msg.unique_id and \
+                not waiting[1].done():
+            waiting[1].set_result(msg)
+        elif waiting is None and self._lock is not None and \
+                self._lock.locked():
+            # The response overtook call(), which is still sending.
+            future = asyncio.get_running_loop().create_future()
+            future.set_result(msg)
+            self._waiting = (msg.unique_id, future)
+        else:
+            LOGGER.error('Ignoring response with unknown unique id: %s', msg)
+
+    async def _get_specific_response(self, unique_id, timeout):
+        """ Return the response with the given unique id or raise an
+        asyncio.TimeoutError. Called with the call lock held, after the CALL
+        was sent.
+        """
+        waiting = self._waiting
+        if waiting is not None and waiting[0] == unique_id:
+            future = waiting[1]
+        else:
+            future = asyncio.get_running_loop().create_future()
+            self._waiting = (unique_id, future)
+        try:
+            if self.call_table is None:
+                return await asyncio.wait_for(future, timeout)
+            return await self.call_table.wait(self, unique_id, future,
+                                              timeout)
+        finally:
+            self._waiting = None
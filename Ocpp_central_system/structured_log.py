@@ -0,0 +1,170 @@
+""" Non-blocking structured logging.
+
+setup_logging() replaces logging.basicConfig(). Records are put on a bounded
+queue by the event loop thread and formatted and written by a background
+thread, so a slow stdout never stalls frame processing. If the queue is full
+the record is dropped rather than waiting.
+
+Before a record is queued it passes a sampling filter keyed by the record's
+`action`, or by its logger name for records without one (such as the
+ocpp library's per-frame logs):
+
+* `sample_rates` keeps a fraction of the records of an action, e.g. one
+  Heartbeat in a thousand,
+* `rate_limit` caps the records per second of every key. The next record
+  let through carries the number dropped in between as `dropped`.
+
+Records are emitted as one JSON object per line with the station id, the
+action and any other extra fields, or as text.
+"""
+import atexit
+import json
+import logging
+import queue
+import random
+import sys
+from datetime import datetime, timezone
+from logging.handlers import QueueListener
+
+from admission import TokenBucket
+
+DEFAULT_SAMPLE_RATES = {'Heartbeat': 0.001, 'StatusNotification': 0.01}
+
+QUEUE_SIZE = 10000
+
+# Attributes of every LogRecord; everything else was passed as extra.
+_STANDARD_ATTRIBUTES = set(vars(logging.LogRecord(
+    '', logging.INFO, '', 0, '', None, None))) | {'message', 'asctime'}
+
+
+class StationLogger(logging.LoggerAdapter):
+    """ Adds the station id, and the action if given as keyword argument, to
+    every record:
+
+        self.log.info("GetLog accepted", action='GetLog')
+    """
+
+    def __init__(self, logger, station_id):
+        super().__init__(logger, {'station': station_id})
+
+    def process(self, msg, kwargs):
+        extra = dict(self.extra, **kwargs.pop('extra', {}))
+        if 'action' in kwargs:
+            extra['action'] = kwargs.pop('action')
+        kwargs['extra'] = extra
+        return msg, kwargs
+
+
+class SamplingFilter(logging.Filter):
+
+    def __init__(self, sample_rates=None, rate_limit=None):
+        super().__init__()
+        self.sample_rates = dict(sample_rates or {})
+        self.rate_limit = rate_limit
+        # key -> TokenBucket
+        self._buckets = {}
+        # key -> records dropped since the last one let through
+        self._dropped = {}
+
+    def filter(self, record):
+        # Warnings and errors are never sampled.
+        if record.levelno >= logging.WARNING:
+            return True
+        key = getattr(record, 'action', None) or record.name
+        rate = self.sample_rates.get(key)
+        if rate is not None and random.random() >= rate:
+            return False
+        if self.rate_limit:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket(self.rate_limit)
+            if not bucket.take():
+                self._dropped[key] = self._dropped.get(key, 0) + 1
+                return False
+            dropped = self._dropped.pop(key, 0)
+            if dropped:
+                record.dropped = dropped
+        return True
+
+
+class NonBlockingQueueHandler(logging.Handler):
+    """ Puts records on a queue without formatting them. Unlike
+    logging.handlers.QueueHandler the message isn't rendered on the calling
+    thread, and a full queue drops the record.
+    """
+
+    def __init__(self, records):
+        super().__init__()
+        self.queue = records
+        self.dropped = 0
+
+    def emit(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class JSONFormatter(logging.Formatter):
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc)
+            .isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for name, value in vars(record).items():
+            if name not in _STANDARD_ATTRIBUTES:
+                entry[name] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+
+    def __init__(self):
+        super().__init__('%(levelname)s:%(name)s:%(message)s')
+
+    def format(self, record):
+        text = super().format(record)
+        fields = ' '.join(f'{name}={value}'
+                          for name, value in vars(record).items()
+                          if name not in _STANDARD_ATTRIBUTES)
+        return f'{text} [{fields}]' if fields else text
+
+
+def setup_logging(level=logging.INFO, fmt='json', sample_rates=None,
+                  rate_limit=100, stream=None):
+    """ Route all logging through the background thread. Returns the
+    QueueListener, which is stopped at exit.
+    """
+    if sample_rates is None:
+        sample_rates = DEFAULT_SAMPLE_RATES
+    records = queue.Queue(QUEUE_SIZE)
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(JSONFormatter() if fmt == 'json' else TextFormatter())
+    listener = QueueListener(records, output)
+
+    handler = NonBlockingQueueHandler(records)
+    handler.addFilter(SamplingFilter(sample_rates, rate_limit))
+    root = logging.getLogger()
+    for previous in root.handlers[:]:
+        root.removeHandler(previous)
+    root.addHandler(handler)
+    root.setLevel(level)
+
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+
+def parse_sample_rates(values):
+    """ Parse ACTION=RATE arguments, e.g. ['Heartbeat=0.001']. """
+    rates = dict(DEFAULT_SAMPLE_RATES)
+    for value in values or []:
+        action, _, rate = value.partition('=')
+        rates[action] = float(rate)
+    return rates
@@ -0,0 +1,7 @@
+""" The central system's modules import each other as top-level modules, as
+when run from Ocpp_central_system/.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,73 @@
+from admission import BootAdmission, TokenBucket
+
+
+class Clock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_bucket_refills_at_rate():
+    clock = Clock()
+    bucket = TokenBucket(10, burst=5, clock=clock)
+    assert sum(bucket.take() for _ in range(10)) == 5
+    clock.now += 0.3
+    assert sum(bucket.take() for _ in range(10)) == 3
+    clock.now += 60
+    assert sum(bucket.take() for _ in range(10)) == 5
+
+
+def test_boots_beyond_the_rate_are_pending():
+    clock = Clock()
+    admission = BootAdmission(rate=2, burst=2, min_interval=1,
+                              max_interval=300, clock=clock)
+    assert admission.admit('CP1') == ('Accepted', None)
+    assert admission.admit('CP2') == ('Accepted', None)
+    status, interval = admission.admit('CP3')
+    assert status == 'Pending'
+    assert 1 <= interval <= 300
+
+
+def test_retry_interval_grows_with_the_backlog():
+    clock = Clock()
+    admission = BootAdmission(rate=10, burst=1, clock=clock)
+    admission.admit('first')
+    intervals = [admission.admit(f'CP{i}')[1] for i in range(1000)]
+    # 1000 waiting stations at 10/s: 100 s, jittered by +-50%.
+    assert 50 <= intervals[-1] <= 150
+    assert intervals[0] == 1
+
+
+def test_storm_ends_when_every_waiting_station_is_accepted():
+    clock = Clock()
+    admission = BootAdmission(rate=1, burst=1, clock=clock)
+    admission.admit('CP1')
+    assert admission.admit('CP2')[0] == 'Pending'
+    assert admission.admit('CP3')[0] == 'Pending'
+    assert admission.admit('CP3')[0] == 'Pending'
+    clock.now = 1
+    assert admission.admit('CP2') == ('Accepted', None)
+    assert admission.last_storm is None
+    clock.now = 3
+    assert admission.admit('CP3') == ('Accepted', None)
+    storm = admission.last_storm
+    assert storm['duration'] == 3
+    assert storm['stations'] == 2
+    assert storm['pending_answers'] == 3
+    assert storm['max_wait'] == 3
+
+
+def test_disconnected_station_ends_the_storm():
+    clock = Clock()
+    admission = BootAdmission(rate=1, burst=1, clock=clock)
+    admission.admit('CP1')
+    admission.admit('CP2')
+    admission.forget('CP1')
+    assert admission.last_storm is None
+    clock.now = 5
+    admission.forget('CP2')
+    assert admission.last_storm['duration'] == 5
+    assert admission.last_storm['stations'] == 0
@@ -0,0 +1,157 @@
+import asyncio
+import os
+import socket
+
+import pytest
+
+from artifact_server import ArtifactServer
+
+FIRMWARE = bytes(range(256)) * 400
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class Client:
+    """ HTTP/1.1 requests over one keep-alive connection. """
+
+    async def connect(self, port):
+        self.port = port
+        self.reader, self.writer = await asyncio.open_connection(
+            '127.0.0.1', port)
+
+    async def reconnect(self):
+        self.close()
+        await self.connect(self.port)
+
+    async def request(self, method, path, headers=None, body=b''):
+        lines = [f'{method} {path} HTTP/1.1', 'Host: test',
+                 f'Content-Length: {len(body)}']
+        lines += [f'{name}: {value}'
+                  for name, value in (headers or {}).items()]
+        self.writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode() + body)
+        head = await self.reader.readuntil(b'\r\n\r\n')
+        status_line, *header_lines = head.decode().split('\r\n')
+        response_headers = dict(line.split(': ', 1)
+                                for line in header_lines if line)
+        length = int(response_headers.get('Content-Length', 0))
+        body = b''
+        if method != 'HEAD' and length:
+            body = await self.reader.readexactly(length)
+        return int(status_line.split()[1]), response_headers, body
+
+    def close(self):
+        self.writer.close()
+
+
+@pytest.fixture
+def serve(tmp_path):
+    (tmp_path / 'firmware').mkdir()
+    (tmp_path / 'firmware' / 'fw.bin').write_bytes(FIRMWARE)
+
+    def serve(requests):
+        async def run():
+            port = free_port()
+            server = ArtifactServer(str(tmp_path / 'firmware'),
+                                    str(tmp_path / 'logs'),
+                                    host='127.0.0.1', port=port)
+            await server.start()
+            client = Client()
+            await client.connect(port)
+            try:
+                return await requests(client)
+            finally:
+                client.close()
+                await server.close()
+        return asyncio.run(run())
+    return serve
+
+
+def test_firmware_ranges(serve):
+    async def requests(client):
+        status, headers, body = await client.request('GET', '/firmware/fw.bin')
+        assert (status, body) == (200, FIRMWARE)
+        assert headers['Accept-Ranges'] == 'bytes'
+
+        status, headers, body = await client.request(
+            'GET', '/firmware/fw.bin', {'Range': 'bytes=1000-1999'})
+        assert (status, body) == (206, FIRMWARE[1000:2000])
+        assert headers['Content-Range'] == f'bytes 1000-1999/{len(FIRMWARE)}'
+
+        # Resuming a broken download, and the last bytes.
+        status, _, body = await client.request(
+            'GET', '/firmware/fw.bin', {'Range': 'bytes=100000-'})
+        assert (status, body) == (206, FIRMWARE[100000:])
+        status, _, body = await client.request(
+            'GET', '/firmware/fw.bin', {'Range': 'bytes=-10'})
+        assert (status, body) == (206, FIRMWARE[-10:])
+
+        status, headers, _ = await client.request(
+            'GET', '/firmware/fw.bin', {'Range': f'bytes={len(FIRMWARE)}-'})
+        assert status == 416
+        assert headers['Content-Range'] == f'bytes */{len(FIRMWARE)}'
+
+        status, headers, body = await client.request('HEAD',
+                                                     '/firmware/fw.bin')
+        assert (status, body) == (200, b'')
+        assert headers['Content-Length'] == str(len(FIRMWARE))
+        assert (await client.request('GET', '/firmware/none'))[0] == 404
+        assert (await client.request('GET', '/firmware/../fw.bin'))[0] == 404
+
+    serve(requests)
+
+
+def test_resumed_upload(serve, tmp_path):
+    path = '/logs/CP1/diagnostics.log.gz'
+    target = tmp_path / 'logs' / 'CP1' / 'diagnostics.log.gz'
+
+    async def requests(client):
+        assert (await client.request('HEAD', path))[1]['Upload-Offset'] == \
+            '0'
+        status, headers, _ = await client.request(
+            'PUT', path, {'Content-Range': 'bytes 0-9/*'}, b'0123456789')
+        assert (status, headers['Upload-Offset']) == (200, '10')
+        assert (await client.request('HEAD', path))[1]['Upload-Offset'] == \
+            '10'
+
+        # A gap is refused with the offset to continue at.
+        status, headers, _ = await client.request(
+            'PUT', path, {'Content-Range': 'bytes 20-29/*'}, b'x' * 10)
+        assert (status, headers['Upload-Offset']) == (409, '10')
+        # The unread body leaves the connection unusable; it is closed.
+        await client.reconnect()
+
+        # Sent again from an earlier offset, e.g. after a lost response.
+        status, headers, _ = await client.request(
+            'PUT', path, {'Content-Range': 'bytes 5-14/*'}, b'56789abcde')
+        assert (status, headers['Upload-Offset']) == (200, '15')
+        assert not target.exists()
+
+        status, headers, _ = await client.request(
+            'PUT', path, {'Content-Range': 'bytes 15-19/20'}, b'fghij')
+        assert (status, headers['Upload-Offset']) == (201, '20')
+
+    serve(requests)
+    assert target.read_bytes() == b'0123456789abcdefghij'
+    assert not os.path.exists(str(target) + '.part')
+
+
+def test_whole_and_chunked_uploads(serve, tmp_path):
+    async def requests(client):
+        status, _, _ = await client.request('POST', '/logs/CP1/a.log',
+                                            body=b'whole file')
+        assert status == 201
+        status, _, _ = await client.request(
+            'PUT', '/logs/CP1/b.log', {'Transfer-Encoding': 'chunked'},
+            b'5\r\nhello\r\n6\r\n world\r\n0\r\n\r\n')
+        assert status == 201
+        assert (await client.request('DELETE', '/logs/CP1/a.log'))[0] == 405
+
+    serve(requests)
+    assert (tmp_path / 'logs' / 'CP1' / 'a.log').read_bytes() == \
+        b'whole file'
+    assert (tmp_path / 'logs' / 'CP1' / 'b.log').read_bytes() == \
+        b'hello world'
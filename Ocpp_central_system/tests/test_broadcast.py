@@ -0,0 +1,143 @@
+import asyncio
+import itertools
+import json
+
+import pytest
+from ocpp.v201 import call
+
+import central_system
+import codec
+from broadcast import broadcast
+from codec import EncodedCall, action_of
+
+SET_VARIABLES = call.SetVariablesPayload(set_variable_data=[{
+    'attribute_value': '60',
+    'component': {'name': 'OCPPCommCtrlr'},
+    'variable': {'name': 'HeartbeatInterval'}}])
+ACCEPTED = {'setVariableResult': [{
+    'attributeStatus': 'Accepted',
+    'component': {'name': 'OCPPCommCtrlr'},
+    'variable': {'name': 'HeartbeatInterval'}}]}
+
+
+class Connection:
+    """ A station answering CALLs of the actions in results. """
+
+    def __init__(self, results):
+        self.results = results
+        self.frames = []
+        self.charge_point = None
+
+    async def send(self, message):
+        self.frames.append(message)
+        _, unique_id, action, _ = json.loads(message)
+        if action in self.results:
+            asyncio.get_running_loop().call_soon(
+                asyncio.ensure_future, self.charge_point.route_message(
+                    json.dumps([3, unique_id, self.results[action]])))
+
+
+def stations(count, results):
+    charge_points = []
+    for i in range(count):
+        connection = Connection(results)
+        connection.charge_point = central_system.ChargePoint(f'CP{i}',
+                                                             connection)
+        charge_points.append(connection.charge_point)
+    return charge_points
+
+
+@pytest.fixture
+def unique_ids(monkeypatch):
+    """ Restart the message ids at 0 when called. """
+    def reset():
+        ids = itertools.count()
+        monkeypatch.setattr(central_system.ChargePoint,
+                            '_unique_id_generator',
+                            staticmethod(lambda: f'id-{next(ids)}'))
+    return reset
+
+
+@pytest.mark.parametrize('backend', sorted(codec.BACKENDS))
+def test_same_frames_as_call(backend, unique_ids, monkeypatch):
+    monkeypatch.setattr(codec, 'loads', codec.BACKENDS[backend][0])
+    monkeypatch.setattr(codec, 'dumps', codec.BACKENDS[backend][1])
+
+    async def one_by_one():
+        unique_ids()
+        charge_points = stations(3, {'SetVariables': ACCEPTED})
+        responses = [await charge_point.call(SET_VARIABLES)
+                     for charge_point in charge_points]
+        return charge_points, responses
+
+    async def broadcasted():
+        unique_ids()
+        charge_points = stations(3, {'SetVariables': ACCEPTED})
+        responses = []
+        report = await broadcast(
+            charge_points, SET_VARIABLES, concurrency=1,
+            on_response=lambda charge_point, response:
+                responses.append(response))
+        return charge_points, responses, report
+
+    expected, expected_responses = asyncio.run(one_by_one())
+    charge_points, responses, report = asyncio.run(broadcasted())
+    assert [c._connection.frames for c in charge_points] == \
+        [c._connection.frames for c in expected]
+    assert responses == expected_responses
+    assert report.responses == 3
+    assert report.statuses == {'Accepted': 3}
+
+
+def test_encoded_call():
+    encoded = EncodedCall(SET_VARIABLES)
+    assert action_of(encoded) == action_of(SET_VARIABLES) == 'SetVariables'
+    assert json.loads(encoded.frame('abc')) == [
+        2, 'abc', 'SetVariables',
+        codec.payload_to_camel(SET_VARIABLES)]
+
+
+def test_broadcast_is_retried_and_timed(unique_ids, monkeypatch):
+    calls = central_system.calls
+    monkeypatch.setitem(calls.timeouts, 'SetVariables', 0.05)
+    monkeypatch.setattr(calls, 'retries', 1)
+    monkeypatch.setattr(calls, 'backoff', 0.01)
+    histogram = central_system.metrics.histogram('ocpp_call_seconds',
+                                                 'SetVariables')
+    observed = histogram.count
+
+    async def run():
+        unique_ids()
+        charge_points = stations(2, {})
+        report = await broadcast(charge_points, SET_VARIABLES)
+        return charge_points, report
+
+    charge_points, report = asyncio.run(run())
+    assert report.timeouts == 2
+    # Sent again after the timeout, with a new message id.
+    for charge_point in charge_points:
+        frames = [json.loads(f) for f in charge_point._connection.frames]
+        assert [frame[2] for frame in frames] == ['SetVariables'] * 2
+        assert frames[0][1] != frames[1][1]
+    assert histogram.count == observed + 4
+
+
+def test_broadcast_is_queued_by_priority(unique_ids):
+    async def run():
+        unique_ids()
+        charge_point, = stations(1, {'SetVariables': ACCEPTED,
+                                     'GetLog': {'status': 'Accepted'},
+                                     'TriggerMessage': {'status': 'Accepted'}})
+        # Keeps the station busy while the other two are queued.
+        trigger = charge_point.call(call.TriggerMessagePayload(
+            requested_message='StatusNotification'))
+        get_log = charge_point.call(call.GetLogPayload(
+            log={'remote_location': 'http://example.com/'},
+            log_type='DiagnosticsLog', request_id=1))
+        await asyncio.gather(trigger, get_log,
+                             broadcast([charge_point], SET_VARIABLES))
+        return charge_point
+
+    charge_point = asyncio.run(run())
+    assert [json.loads(f)[2] for f in charge_point._connection.frames] == \
+        ['TriggerMessage', 'SetVariables', 'GetLog']
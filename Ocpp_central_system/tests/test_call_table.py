@@ -0,0 +1,132 @@
+import asyncio
+import time
+
+import pytest
+
+from call_table import CallTable, DeadlineScheduler, parse_timeouts
+
+
+def test_deadlines_run_in_order():
+    async def main():
+        scheduler = DeadlineScheduler()
+        calls = []
+        scheduler.call_later(0.03, calls.append, 'late')
+        scheduler.call_later(0.01, calls.append, 'early')
+        cancelled = scheduler.call_later(0.02, calls.append, 'cancelled')
+        cancelled.cancel()
+        cancelled.cancel()
+        assert len(scheduler) == 2
+        await asyncio.sleep(0.05)
+        assert len(scheduler) == 0
+        return calls
+
+    assert asyncio.run(main()) == ['early', 'late']
+
+
+def test_cancelled_deadlines_are_compacted():
+    async def main():
+        scheduler = DeadlineScheduler()
+        deadlines = [scheduler.call_later(60, print) for _ in range(200)]
+        for deadline in deadlines:
+            deadline.cancel()
+        scheduler.call_later(60, print)
+        return len(scheduler._heap), len(scheduler)
+
+    assert asyncio.run(main()) == (1, 1)
+
+
+def test_sleep():
+    async def main():
+        scheduler = DeadlineScheduler()
+        start = time.monotonic()
+        await scheduler.sleep(0.02)
+        return time.monotonic() - start
+
+    assert asyncio.run(main()) >= 0.02
+
+
+def test_timeouts_by_action():
+    table = CallTable(timeouts={'GetLog': 5}, default_timeout=7)
+    assert table.timeout('GetLog') == 5
+    assert table.timeout('UpdateFirmware') == 120
+    assert table.timeout('DataTransfer') == 7
+
+
+def test_wait_times_out():
+    async def main():
+        table = CallTable()
+        future = asyncio.get_running_loop().create_future()
+        with pytest.raises(asyncio.TimeoutError):
+            await table.wait('conn', 'id-1', future, 0.01)
+        assert len(table) == 0
+        return table.timed_out
+
+    assert asyncio.run(main()) == 1
+
+
+def test_wait_returns_the_response():
+    async def main():
+        table = CallTable()
+        future = asyncio.get_running_loop().create_future()
+        asyncio.get_running_loop().call_later(0.01, future.set_result, 'ok')
+        result = await table.wait('conn', 'id-1', future, 1)
+        assert len(table) == 0
+        assert len(table.scheduler) == 0
+        return result
+
+    assert asyncio.run(main()) == 'ok'
+
+
+def test_cancel_fails_the_calls_of_a_connection():
+    async def main():
+        table = CallTable()
+        loop = asyncio.get_running_loop()
+        waits = [asyncio.ensure_future(table.wait(
+            conn, 'id', loop.create_future(), 60)) for conn in ('a', 'b')]
+        await asyncio.sleep(0)
+        assert len(table) == 2
+        assert table.cancel('a') == 1
+        assert table.cancel('a') == 0
+        with pytest.raises(ConnectionError):
+            await waits[0]
+        assert len(table) == 1
+        waits[1].cancel()
+        return table.cancelled
+
+    assert asyncio.run(main()) == 1
+
+
+def test_retry_delay():
+    table = CallTable(retries=2, backoff=1.0, max_backoff=1.5)
+    assert table.retry_delay('UpdateFirmware', 0) is None
+    assert 0.5 <= table.retry_delay('SetVariables', 0) <= 1.5
+    # Capped at max_backoff before the jitter.
+    assert 0.75 <= table.retry_delay('SetVariables', 1) <= 2.25
+    assert table.retry_delay('SetVariables', 2) is None
+    assert table.retried == 2
+
+
+def test_budget_covers_retries():
+    table = CallTable(retries=2, backoff=1.0, max_backoff=30.0)
+    assert table.budget('UpdateFirmware') == 120
+    # Three attempts of 10 s, and up to 1.5 times 1 + 2 s of backoff.
+    assert table.budget('SetVariables') == 34.5
+
+
+def test_parse_timeouts():
+    assert parse_timeouts(['UpdateFirmware=300', 'GetLog=7.5']) == {
+        'UpdateFirmware': 300, 'GetLog': 7.5}
+    assert parse_timeouts(None) == {}
+
+
+def test_routed_operations_wait_for_their_calls():
+    import central_system
+
+    calls = central_system.calls
+    assert central_system.route_timeout('send_update_firmware_request') == \
+        central_system.ROUTE_QUEUE_MARGIN + calls.budget('UpdateFirmware')
+    assert central_system.route_timeout('set_desired_variables') == \
+        central_system.ROUTE_QUEUE_MARGIN + calls.budget('GetVariables') + \
+        calls.budget('SetVariables')
+    assert central_system.route_timeout('unknown') == \
+        central_system.ROUTE_QUEUE_MARGIN + calls.default_timeout
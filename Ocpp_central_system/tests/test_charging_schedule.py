@@ -0,0 +1,176 @@
+import json
+import math
+import random
+
+import numpy as np
+import pytest
+
+from charging_schedule import RECURRENCY_PERIODS, CompositeScheduleEngine, \
+    evaluate_profiles, parse_timestamp
+from profile_store import ChargingProfileStore
+
+DAY = 24 * 3600
+# 2024-01-01T00:00:00Z
+T0 = 1704067200.0
+
+
+def reference(profile, t, relative_start, voltage=230.0, phases=3):
+    """ Limit of one profile at one time, the straightforward way. """
+    limits = []
+    for schedule in profile['chargingSchedule']:
+        kind = profile['chargingProfileKind']
+        start = parse_timestamp(schedule.get('startSchedule'))
+        origin = relative_start if kind == 'Relative' or start is None \
+            else start
+        offset = t - origin
+        if kind == 'Recurring' and offset >= 0:
+            offset %= RECURRENCY_PERIODS[profile.get('recurrencyKind',
+                                                     'Daily')]
+        if offset < 0 or offset >= schedule.get('duration', math.inf):
+            continue
+        if 'validFrom' in profile and t < parse_timestamp(
+                profile['validFrom']):
+            continue
+        if 'validTo' in profile and t >= parse_timestamp(profile['validTo']):
+            continue
+        limit = None
+        for period in schedule['chargingSchedulePeriod']:
+            if period['startPeriod'] <= offset:
+                limit = period['limit']
+                if schedule['chargingRateUnit'] == 'A':
+                    limit *= voltage * period.get('numberPhases', phases)
+        if limit is not None:
+            limits.append(limit)
+    return max(limits) if limits else math.nan
+
+
+def iso(t):
+    return np.datetime_as_string(np.datetime64(int(t), 's')) + 'Z'
+
+
+def random_profile(rng, profile_id):
+    kind = rng.choice(['Absolute', 'Relative', 'Recurring'])
+    schedules = []
+    for i in range(rng.choice([1, 1, 2, 3])):
+        periods = sorted(rng.sample(range(0, 6 * 3600, 600),
+                                    rng.randint(1, 5)))
+        if rng.random() < 0.7:
+            periods[0] = 0
+        schedule = {
+            'id': i, 'chargingRateUnit': rng.choice(['A', 'W']),
+            'chargingSchedulePeriod': [
+                dict({'startPeriod': start,
+                      'limit': rng.uniform(6, 32)},
+                     **({'numberPhases': 1} if rng.random() < 0.3 else {}))
+                for start in periods]}
+        if rng.random() < 0.7:
+            schedule['startSchedule'] = iso(T0 + rng.randint(-DAY, DAY))
+        if rng.random() < 0.5:
+            schedule['duration'] = rng.randint(600, 8 * 3600)
+        schedules.append(schedule)
+    profile = {'id': profile_id, 'stackLevel': 0,
+               'chargingProfilePurpose': 'TxDefaultProfile',
+               'chargingProfileKind': kind, 'chargingSchedule': schedules}
+    if kind == 'Recurring':
+        profile['recurrencyKind'] = rng.choice(['Daily', 'Weekly'])
+    if rng.random() < 0.3:
+        profile['validFrom'] = iso(T0 + rng.randint(-DAY, DAY))
+    if rng.random() < 0.3:
+        profile['validTo'] = iso(T0 + rng.randint(0, 2 * DAY))
+    return profile
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_matches_reference(seed):
+    rng = random.Random(seed)
+    profiles = [random_profile(rng, i) for i in range(20)]
+    times = T0 + np.arange(-DAY, 3 * DAY, 300, dtype=np.float64)
+    values = evaluate_profiles(profiles, times)
+    assert values.shape == (20, len(times))
+    expected = np.array([[reference(p, t, times[0]) for t in times]
+                         for p in profiles])
+    np.testing.assert_allclose(values, expected, equal_nan=True)
+
+
+def test_recurring_profile_waits_for_its_start():
+    profile = {'id': 1, 'stackLevel': 0,
+               'chargingProfilePurpose': 'TxDefaultProfile',
+               'chargingProfileKind': 'Recurring', 'recurrencyKind': 'Daily',
+               'chargingSchedule': [{
+                   'id': 1, 'chargingRateUnit': 'W',
+                   'startSchedule': iso(T0),
+                   'chargingSchedulePeriod': [
+                       {'startPeriod': 0, 'limit': 1000},
+                       {'startPeriod': 3600, 'limit': 2000}]}]}
+    times = T0 + np.array([-DAY - 1, -1, 0, 3600, DAY + 1, 2 * DAY + 3600])
+    values = evaluate_profiles([profile], times)[0]
+    assert np.isnan(values[:2]).all()
+    assert values[2:].tolist() == [1000, 2000, 1000, 2000]
+
+
+def test_amps_are_converted_to_watt():
+    profile = {'id': 1, 'stackLevel': 0,
+               'chargingProfilePurpose': 'TxProfile',
+               'chargingProfileKind': 'Relative',
+               'chargingSchedule': [{
+                   'id': 1, 'chargingRateUnit': 'A',
+                   'chargingSchedulePeriod': [
+                       {'startPeriod': 0, 'limit': 16},
+                       {'startPeriod': 60, 'limit': 16, 'numberPhases': 1}
+                   ]}]}
+    assert evaluate_profiles([profile], [0, 60]).tolist() == \
+        [[16 * 230 * 3, 16 * 230]]
+    assert evaluate_profiles([], [0, 60]).shape == (0, 2)
+
+
+def limit_profile(profile_id, purpose, stack_level, limit, **extra):
+    return dict({'id': profile_id, 'stackLevel': stack_level,
+                 'chargingProfilePurpose': purpose,
+                 'chargingProfileKind': 'Absolute',
+                 'chargingSchedule': [{
+                     'id': profile_id, 'chargingRateUnit': 'W',
+                     'startSchedule': iso(T0),
+                     'chargingSchedulePeriod': [
+                         {'startPeriod': 0, 'limit': limit}]}]}, **extra)
+
+
+def test_composite_precedence(tmp_path):
+    store = ChargingProfileStore(str(tmp_path / 'profiles.jsonl'))
+    engine = CompositeScheduleEngine(store, step=60, horizon=3600)
+    store.add_listener(engine.invalidate)
+
+    _, limits = engine.composite('CP1', 1, now=T0)
+    assert (limits == 22000).all()
+
+    store.install('CP1', 0, limit_profile(1, 'TxDefaultProfile', 0, 8000))
+    store.install('CP1', 1, limit_profile(2, 'TxDefaultProfile', 1, 9000))
+    assert (engine.composite('CP1', 1, now=T0)[1] == 9000).all()
+    assert (engine.composite('CP1', 2, now=T0)[1] == 8000).all()
+
+    store.install('CP1', 1, limit_profile(3, 'TxProfile', 0, 11000))
+    assert (engine.composite('CP1', 1, now=T0)[1] == 11000).all()
+    store.install('CP1', 0, limit_profile(
+        4, 'ChargingStationMaxProfile', 0, 10000))
+    assert (engine.composite('CP1', 1, now=T0)[1] == 10000).all()
+    assert (engine.composite('CP1', 2, now=T0)[1] == 8000).all()
+
+    times, total = engine.site_forecast([('CP1', 1), ('CP1', 2)], now=T0)
+    assert len(times) == 60
+    assert (total == 18000).all()
+    assert (engine.site_forecast([], now=T0)[1] == 0).all()
+
+
+def test_forecast_query(monkeypatch):
+    import central_system
+
+    times = np.arange(T0, T0 + 180, 60)
+    monkeypatch.setitem(central_system.site_forecasts, 'north',
+                        (times, np.array([1000.0, 2000.0, 3000.0])))
+    body = json.loads(central_system.forecast_query({'site': 'north'}))
+    assert body == {'site': 'north', 'start': T0,
+                    'step': central_system.schedule_engine.step,
+                    'limits': [1000.0, 2000.0, 3000.0]}
+    with pytest.raises(KeyError):
+        central_system.forecast_query({'site': 'south'})
+    with pytest.raises(KeyError):
+        central_system.forecast_query({})
@@ -0,0 +1,107 @@
+import dataclasses
+import json
+
+import pytest
+from ocpp.charge_point import camel_to_snake_case, remove_nones, \
+    snake_to_camel_case
+from ocpp.exceptions import OCPPError
+from ocpp.messages import Call, CallError, CallResult
+from ocpp.messages import unpack as library_unpack
+from ocpp.v201 import call
+
+import codec
+
+NESTED = {
+    'chargingProfile': {
+        'id': 1, 'stackLevel': 0,
+        'chargingProfilePurpose': 'TxDefaultProfile',
+        'chargingSchedule': [{
+            'id': 1, 'chargingRateUnit': 'A',
+            'chargingSchedulePeriod': [
+                {'startPeriod': 0, 'limit': 16.0, 'numberPhases': 3},
+                {'startPeriod': 600, 'limit': 8.5}],
+            'salesTariff': {'id': 2, 'salesTariffEntry': [
+                {'relativeTimeInterval': {'start': 0}, 'ePriceLevel': 1}]},
+        }],
+    },
+    'evseId': 1,
+    'customData': {'vendorId': 'acme', 'vendorSpecificThing': [1, [2, 3]],
+                   'HTTPProxyURL': None, 'alreadySnake_key': 'x'},
+    'empty': [], 'nothing': None,
+}
+
+PAYLOADS = [
+    call.SetChargingProfilePayload(evse_id=1,
+                                   charging_profile=NESTED['chargingProfile']),
+    call.SetVariablesPayload(set_variable_data=[{
+        'attribute_value': '60', 'attribute_type': None,
+        'component': {'name': 'OCPPCommCtrlr', 'evse': {'id': 1}},
+        'variable': {'name': 'HeartbeatInterval', 'instance': None}}]),
+    call.GetLogPayload(log={'remote_location': 'http://example.com/',
+                            'oldest_timestamp': None},
+                       log_type='DiagnosticsLog', request_id=1),
+    call.TriggerMessagePayload(requested_message='BootNotification'),
+]
+
+
+def test_to_snake_matches_library():
+    assert codec.to_snake(NESTED) == camel_to_snake_case(NESTED)
+
+
+def test_to_camel_matches_library():
+    snake = camel_to_snake_case(NESTED)
+    assert codec.to_camel(snake) == snake_to_camel_case(remove_nones(snake))
+    # None values go at every level, also inside lists.
+    assert codec.to_camel({'a_b': [None, {'c_d': None}], 'e': None}) == \
+        {'aB': [{}]}
+
+
+@pytest.mark.parametrize('payload', PAYLOADS,
+                         ids=lambda p: p.__class__.__name__)
+def test_payload_to_camel_matches_library(payload):
+    assert codec.payload_to_camel(payload) == \
+        snake_to_camel_case(remove_nones(dataclasses.asdict(payload)))
+    assert codec.to_snake(codec.payload_to_camel(payload)) == \
+        camel_to_snake_case(snake_to_camel_case(
+            remove_nones(dataclasses.asdict(payload))))
+
+
+def test_unknown_keys_are_memoized_up_to_a_limit(monkeypatch):
+    monkeypatch.setattr(codec, 'KEYS_TO_SNAKE', dict(codec.KEYS_TO_SNAKE))
+    monkeypatch.setattr(codec, 'MAX_MEMOIZED_KEYS',
+                        len(codec.KEYS_TO_SNAKE) + 1)
+    assert codec.to_snake({'firstUnknownKey': 1, 'secondUnknownKey': 2}) == \
+        {'first_unknown_key': 1, 'second_unknown_key': 2}
+    assert 'firstUnknownKey' in codec.KEYS_TO_SNAKE
+    assert 'secondUnknownKey' not in codec.KEYS_TO_SNAKE
+
+
+MESSAGES = [
+    Call('id-1', 'SetChargingProfile', NESTED),
+    CallResult('id-2', {'status': 'Accepted', 'statusInfo': {
+        'reasonCode': 'ok', 'additionalInfo': 'ü'}}),
+    CallError('id-3', 'FormationViolation', 'bad', {'cause': [1, 2.5]}),
+]
+
+
+@pytest.mark.parametrize('backend', sorted(codec.BACKENDS))
+@pytest.mark.parametrize('msg', MESSAGES, ids=lambda m: m.__class__.__name__)
+def test_pack_unpack_round_trip(backend, msg, monkeypatch):
+    monkeypatch.setattr(codec, 'loads', codec.BACKENDS[backend][0])
+    monkeypatch.setattr(codec, 'dumps', codec.BACKENDS[backend][1])
+    frame = codec.pack(msg)
+    assert json.loads(frame) == json.loads(msg.to_json())
+    if backend == 'json':
+        assert frame == msg.to_json()
+    unpacked = codec.unpack(frame)
+    assert type(unpacked) is type(msg)
+    assert vars(unpacked) == vars(library_unpack(msg.to_json()))
+
+
+@pytest.mark.parametrize('raw', ['not json', '{}', '[]', '[2]', '[7,"a"]'])
+def test_unpack_errors_match_library(raw):
+    with pytest.raises(OCPPError) as expected:
+        library_unpack(raw)
+    with pytest.raises(OCPPError) as error:
+        codec.unpack(raw)
+    assert type(error.value) is type(expected.value)
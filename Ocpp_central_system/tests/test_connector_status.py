@@ -0,0 +1,113 @@
+import json
+
+from connector_status import DEFAULT_SITE, ConnectorStatusTable, \
+    parse_timestamp
+
+
+def test_parse_timestamp():
+    assert parse_timestamp('1970-01-01T00:01:00Z') == 60
+    assert parse_timestamp('1970-01-01T00:01:00') == 60
+    assert parse_timestamp('1970-01-01T01:01:00+01:00') == 60
+
+
+def test_counts_follow_notifications():
+    table = ConnectorStatusTable({'CP1': 'north'})
+    table.update('CP1', 1, 1, 'Available', 1)
+    table.update('CP1', 1, 2, 'Available', 1)
+    table.update('CP2', 1, 1, 'Occupied', 1)
+    table.update('CP1', 1, 2, 'Occupied', 2)
+    assert table.count('north', 'Available') == 1
+    assert table.count('north', 'Occupied') == 1
+    assert table.count(DEFAULT_SITE, 'Occupied') == 1
+    assert table.count('south', 'Occupied') == 0
+    assert table.fleet_counts()['Occupied'] == 2
+    assert len(table) == 3
+
+
+def test_older_notifications_are_ignored():
+    table = ConnectorStatusTable()
+    assert table.update('CP1', 1, 1, 'Occupied', 10)
+    assert not table.update('CP1', 1, 1, 'Available', 5)
+    assert table.station_connectors('CP1') == [(1, 1, 'Occupied', 10.0)]
+
+
+def test_offline_stations_count_as_unavailable():
+    table = ConnectorStatusTable()
+    table.update('CP1', 1, 1, 'Occupied', 1)
+    table.update('CP1', 2, 1, 'Unavailable', 1)
+    table.set_offline('CP1')
+    assert table.site_counts(DEFAULT_SITE) == {
+        'Available': 0, 'Occupied': 0, 'Reserved': 0, 'Unavailable': 2,
+        'Faulted': 0}
+    # The last reported status is kept.
+    assert table.evses(DEFAULT_SITE, 'Occupied')[0] == ['CP1']
+    table.update('CP1', 1, 1, 'Available', 2)
+    assert table.count(DEFAULT_SITE, 'Unavailable') == 2
+    table.set_offline('CP1', False)
+    assert table.count(DEFAULT_SITE, 'Available') == 1
+    assert table.count(DEFAULT_SITE, 'Unavailable') == 1
+    table.set_offline('unknown')
+
+
+def test_forgotten_stations_are_not_counted():
+    table = ConnectorStatusTable()
+    table.update('CP1', 1, 1, 'Occupied', 10)
+    table.forget('CP1')
+    assert table.fleet_counts()['Occupied'] == 0
+    assert table.station_connectors('CP1') == []
+    assert table.evses(DEFAULT_SITE, 'Occupied')[0] == []
+    # Counted again from its next notification, however old.
+    assert table.update('CP1', 1, 1, 'Available', 1)
+    assert table.count(DEFAULT_SITE, 'Available') == 1
+
+
+def test_assign_site_moves_counts():
+    table = ConnectorStatusTable()
+    changes = []
+    table.add_listener(lambda station_id, site:
+                       changes.append((station_id, site)))
+    table.update('CP1', 1, 1, 'Occupied', 1)
+    table.assign_site('CP1', 'north')
+    assert table.count(DEFAULT_SITE, 'Occupied') == 0
+    assert table.count('north', 'Occupied') == 1
+    assert ('CP1', 'north') in changes and ('CP1', DEFAULT_SITE) in changes
+
+
+def test_evses_oldest_first_one_per_evse():
+    table = ConnectorStatusTable()
+    table.update('CP1', 1, 1, 'Occupied', 30)
+    table.update('CP1', 1, 2, 'Occupied', 20)
+    table.update('CP2', 1, 1, 'Occupied', 10)
+    table.update('CP2', 2, 1, 'Available', 5)
+    stations, evses, timestamps = table.evses(DEFAULT_SITE, 'Occupied')
+    assert stations == ['CP2', 'CP1']
+    assert evses.tolist() == [1, 1]
+    assert timestamps.tolist() == [10, 20]
+
+
+def test_site_evses():
+    table = ConnectorStatusTable({'CP1': 'north'})
+    table.update('CP1', 1, 1, 'Occupied', 1)
+    table.update('CP1', 1, 2, 'Available', 1)
+    table.update('CP1', 2, 1, 'Available', 1)
+    table.update('CP2', 1, 1, 'Faulted', 1)
+    table.update('CP3', 1, 1, 'Available', 1)
+    table.forget('CP3')
+    assert table.site_evses() == {'north': [('CP1', 1), ('CP1', 2)],
+                                  DEFAULT_SITE: [('CP2', 1)]}
+
+
+def test_columns_grow():
+    table = ConnectorStatusTable(capacity=2)
+    for i in range(100):
+        table.update(f'CP{i}', 1, 1, 'Available', i)
+    assert table.count(DEFAULT_SITE, 'Available') == 100
+    assert table.station_connectors('CP99') == [(1, 1, 'Available', 99.0)]
+
+
+def test_query():
+    table = ConnectorStatusTable({'CP1': 'north'})
+    table.update('CP1', 1, 1, 'Available', 1)
+    assert json.loads(table.query({'site': 'north', 'status': 'Available'}))[
+        'count'] == 1
+    assert json.loads(table.query({}))['north']['Available'] == 1
@@ -0,0 +1,90 @@
+import json
+
+from device_model import DEFAULT_ITEMS_PER_MESSAGE, DeviceModelCache, \
+    batches, variable_key
+
+
+def item(name, value, instance=None):
+    variable = {'name': name}
+    if instance is not None:
+        variable['instance'] = instance
+    return {'component': {'name': 'OCPPCommCtrlr'}, 'variable': variable,
+            'attributeValue': value}
+
+
+def result(name, status='Accepted', **extra):
+    return dict({'component': {'name': 'OCPPCommCtrlr'},
+                 'variable': {'name': name}, 'attribute_status': status},
+                **extra)
+
+
+def test_variable_key_accepts_both_cases():
+    camel = {'component': {'name': 'EVSE', 'evse': {'id': 1,
+                                                    'connectorId': 2}},
+             'variable': {'name': 'Power'}, 'attributeType': 'Target'}
+    snake = {'component': {'name': 'EVSE', 'evse': {'id': 1,
+                                                    'connector_id': 2}},
+             'variable': {'name': 'Power'}, 'attribute_type': 'Target'}
+    assert variable_key(camel) == variable_key(snake) == \
+        ('EVSE', None, 1, 2, 'Power', None, 'Target')
+
+
+def test_only_applied_values_are_cached():
+    cache = DeviceModelCache()
+    sent = [item('HeartbeatInterval', '60'), item('OfflineThreshold', '5')]
+    cache.record_set_results('CP1', sent, [
+        result('HeartbeatInterval', 'Accepted'),
+        result('OfflineThreshold', 'Rejected')])
+    assert cache.get('CP1', variable_key(sent[0])) == '60'
+    assert cache.get('CP1', variable_key(sent[1])) is None
+    assert cache.diff('CP1', sent) == [sent[1]]
+    assert cache.diff('CP1', [item('HeartbeatInterval', '30')]) == \
+        [item('HeartbeatInterval', '30')]
+
+
+def test_listeners_only_see_changes():
+    cache = DeviceModelCache()
+    changes = []
+    cache.add_listener(lambda *change: changes.append(change))
+    key = variable_key(item('HeartbeatInterval', '60'))
+    cache.set('CP1', key, '60')
+    cache.set('CP1', key, '60')
+    assert changes == [('CP1', key, '60')]
+    cache.restore('CP1', [(key, '30')])
+    assert changes == [('CP1', key, '60')]
+    assert cache.get('CP1', key) == '30'
+
+
+def test_message_limits():
+    cache = DeviceModelCache()
+    assert cache.limits('CP1')[0] == DEFAULT_ITEMS_PER_MESSAGE
+    assert cache.needs_limits('CP1')
+    assert not cache.needs_limits('CP1')
+    cache.record_get_results('CP1', [
+        {'component': {'name': 'DeviceDataCtrlr'},
+         'variable': {'name': 'ItemsPerMessage', 'instance': 'SetVariables'},
+         'attribute_status': 'Accepted', 'attribute_value': '2'},
+        {'component': {'name': 'DeviceDataCtrlr'},
+         'variable': {'name': 'BytesPerMessage', 'instance': 'SetVariables'},
+         'attribute_status': 'Accepted', 'attribute_value': '4000'},
+        {'component': {'name': 'DeviceDataCtrlr'},
+         'variable': {'name': 'ItemsPerMessage', 'instance': 'GetVariables'},
+         'attribute_status': 'UnknownVariable'}])
+    assert cache.limits('CP1') == (2, 4000)
+    assert cache.limits('CP1', 'GetVariables')[0] == \
+        DEFAULT_ITEMS_PER_MESSAGE
+    cache.forget('CP2')
+    assert cache.needs_limits('CP2')
+
+
+def test_batches_respect_item_limit():
+    items = [item('V', str(i), instance=str(i)) for i in range(5)]
+    assert [len(b) for b in batches(items, 2, 64000)] == [2, 2, 1]
+    assert [i for b in batches(items, 2, 64000) for i in b] == items
+
+
+def test_batches_respect_byte_limit():
+    items = [item('V', 'x' * 100, instance=str(i)) for i in range(5)]
+    size = len(json.dumps(items[0], separators=(',', ':'))) + 1
+    assert [len(b) for b in batches(items, 10, 64 + 2 * size)] == [2, 2, 1]
+    assert list(batches([], 10, 1000)) == []
@@ -0,0 +1,132 @@
+import asyncio
+import threading
+
+import ev_certificate
+from ev_certificate import CertificateService
+
+
+class Clock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class Backend:
+    """ Counts processed requests; blocks while `gate` is cleared. """
+
+    def __init__(self, results=()):
+        self.requests = []
+        self.results = list(results)
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def __call__(self, version, action, exi_request):
+        self.gate.wait(5)
+        self.requests.append(exi_request)
+        if self.results:
+            result = self.results.pop(0)
+            if isinstance(result, Exception):
+                raise result
+            return result
+        return 'Accepted', 'response-' + exi_request
+
+
+async def settle(condition):
+    for _ in range(500):
+        if condition():
+            return
+        await asyncio.sleep(0.001)
+    raise AssertionError("Condition not reached")
+
+
+def test_cache_hit_and_expiry(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(ev_certificate.time, 'monotonic', clock)
+    backend = Backend()
+    service = CertificateService(backend, ttl=60)
+
+    async def run():
+        assert await service.get('urn:iso:15118:2:2013:MsgDef', 'Install',
+                                 'exi') == ('Accepted', 'response-exi')
+        clock.now += 59
+        await service.get('urn:iso:15118:2:2013:MsgDef', 'Install', 'exi')
+        assert service.hits == 1
+        # Another action is another request.
+        await service.get('urn:iso:15118:2:2013:MsgDef', 'Update', 'exi')
+        clock.now += 2
+        await service.get('urn:iso:15118:2:2013:MsgDef', 'Install', 'exi')
+
+    asyncio.run(run())
+    service.close()
+    assert backend.requests == ['exi'] * 3
+    assert service.hits == 1
+
+
+def test_identical_requests_in_progress_share_the_result():
+    backend = Backend()
+    backend.gate.clear()
+    service = CertificateService(backend)
+
+    async def run():
+        requests = [asyncio.ensure_future(service.get('v', 'Install', 'exi'))
+                    for _ in range(3)]
+        await settle(lambda: service.in_progress == 1)
+        backend.gate.set()
+        return await asyncio.gather(*requests)
+
+    assert asyncio.run(run()) == [('Accepted', 'response-exi')] * 3
+    service.close()
+    assert backend.requests == ['exi']
+    assert service.hits == 2
+
+
+def test_full_queue_is_answered_failed():
+    backend = Backend()
+    backend.gate.clear()
+    service = CertificateService(backend, concurrency=1, max_queue=2)
+
+    async def run():
+        requests = [asyncio.ensure_future(service.get('v', 'Install', 'a'))]
+        await settle(lambda: service.in_progress == 1)
+        requests += [asyncio.ensure_future(service.get('v', 'Install', exi))
+                     for exi in ('b', 'c')]
+        await settle(lambda: service.queued == 2)
+        assert await service.get('v', 'Install', 'd') == ('Failed', '')
+        backend.gate.set()
+        return await asyncio.gather(*requests)
+
+    assert [status for status, _ in asyncio.run(run())] == ['Accepted'] * 3
+    service.close()
+    assert service.rejected == 1
+    assert service.queued == service.in_progress == 0
+    assert sorted(backend.requests) == ['a', 'b', 'c']
+
+
+def test_failures_are_not_cached():
+    backend = Backend([('Failed', ''), ValueError('broken EXI')])
+    service = CertificateService(backend)
+
+    async def run():
+        return [await service.get('v', 'Install', 'exi') for _ in range(4)]
+
+    assert asyncio.run(run()) == [('Failed', ''), ('Failed', ''),
+                                  ('Accepted', 'response-exi'),
+                                  ('Accepted', 'response-exi')]
+    service.close()
+    assert len(backend.requests) == 3
+
+
+def test_oldest_entries_are_dropped_beyond_max_entries():
+    backend = Backend()
+    service = CertificateService(backend, max_entries=2)
+
+    async def run():
+        for exi in ('a', 'b', 'c', 'b', 'a'):
+            await service.get('v', 'Install', exi)
+
+    asyncio.run(run())
+    service.close()
+    assert backend.requests == ['a', 'b', 'c', 'a']
@@ -0,0 +1,145 @@
+import asyncio
+
+from firmware_rollout import FirmwareRollout
+
+
+class Fleet:
+    """ Records UpdateFirmware requests; stations in `rejecting` don't
+    accept them.
+    """
+
+    def __init__(self, rejecting=()):
+        self.sent = []
+        self.rejecting = set(rejecting)
+
+    async def send(self, station_id, request_id):
+        self.sent.append(station_id)
+        return station_id not in self.rejecting
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def stations(count):
+    return [f'CP{i}' for i in range(count)]
+
+
+def test_waves_and_window():
+    async def run():
+        fleet = Fleet()
+        rollout = FirmwareRollout(stations(5), fleet.send, 7, wave_size=3,
+                                  window=2)
+        done = rollout.start()
+        await settle()
+        assert fleet.sent == ['CP0', 'CP1']
+        rollout.on_status('CP0', 'Downloading')
+        assert rollout.state('CP0') == 'Downloading'
+        rollout.on_status('CP0', 'Installed')
+        await settle()
+        assert fleet.sent == ['CP0', 'CP1', 'CP2']
+        rollout.on_status('CP1', 'Installed')
+        await settle()
+        # The next wave waits for CP2.
+        assert fleet.sent == ['CP0', 'CP1', 'CP2']
+        rollout.on_status('CP2', 'Installed')
+        await settle()
+        assert fleet.sent == stations(5)
+        rollout.on_status('CP3', 'Installed')
+        rollout.on_status('CP4', 'Installed')
+        return await asyncio.wait_for(done, 1)
+
+    summary = asyncio.run(run())
+    assert summary['Installed'] == 5
+    assert summary['Failed'] == 0
+
+
+def test_unrelated_notifications_are_ignored():
+    async def run():
+        fleet = Fleet()
+        rollout = FirmwareRollout(stations(3), fleet.send, 7, window=1)
+        rollout.start()
+        await settle()
+        rollout.on_status('CP1', 'Installed')
+        rollout.on_status('other', 'Installed')
+        rollout.on_status('CP0', 'SignatureVerified')
+        assert rollout.state('CP0') == 'Requested'
+        assert rollout.state('CP1') == 'Pending'
+        rollout.on_status('CP0', 'InstallationFailed')
+        rollout.on_status('CP0', 'Installed')
+        assert rollout.state('CP0') == 'Failed'
+
+    asyncio.run(run())
+
+
+def test_failure_rate_pauses_until_resumed():
+    async def run():
+        fleet = Fleet(rejecting={'CP1'})
+        rollout = FirmwareRollout(stations(6), fleet.send, 7, window=2,
+                                  max_failure_rate=0.5, min_samples=2)
+        done = rollout.start()
+        await settle()
+        # CP1 rejected the request, CP2 took its place.
+        assert fleet.sent == ['CP0', 'CP1', 'CP2']
+        assert rollout.state('CP1') == 'Failed'
+        rollout.on_status('CP0', 'DownloadFailed')
+        await settle()
+        assert rollout.paused
+        assert fleet.sent == ['CP0', 'CP1', 'CP2']
+        # Stations in progress still finish while paused.
+        rollout.on_status('CP2', 'Installed')
+        await settle()
+        assert fleet.sent == ['CP0', 'CP1', 'CP2']
+
+        rollout.resume()
+        await settle()
+        assert not rollout.paused
+        assert fleet.sent == stations(5)
+        # The failure rate starts over: one failure doesn't pause again.
+        rollout.on_status('CP3', 'InvalidSignature')
+        rollout.on_status('CP4', 'Installed')
+        await settle()
+        assert not rollout.paused
+        rollout.on_status('CP5', 'Installed')
+        return await asyncio.wait_for(done, 1)
+
+    summary = asyncio.run(run())
+    assert summary['Failed'] == 3
+    assert summary['Installed'] == 3
+
+
+def test_pause_and_resume():
+    async def run():
+        fleet = Fleet()
+        rollout = FirmwareRollout(stations(3), fleet.send, 7, window=1)
+        rollout.start()
+        await settle()
+        rollout.pause()
+        rollout.on_status('CP0', 'Installed')
+        await settle()
+        assert fleet.sent == ['CP0']
+        rollout.resume()
+        await settle()
+        assert fleet.sent == ['CP0', 'CP1']
+
+    asyncio.run(run())
+
+
+def test_stalled_stations_fail():
+    async def run():
+        fleet = Fleet()
+        rollout = FirmwareRollout(stations(2), fleet.send, 7, window=1,
+                                  stall_timeout=0.05)
+        done = rollout.start()
+        await asyncio.sleep(0.03)
+        # Every notification restarts the stall timer.
+        rollout.on_status('CP0', 'Downloading')
+        await asyncio.sleep(0.03)
+        assert rollout.state('CP0') == 'Downloading'
+        await asyncio.sleep(0.05)
+        assert rollout.state('CP0') == 'Failed'
+        assert fleet.sent == ['CP0', 'CP1']
+        return await asyncio.wait_for(done, 1)
+
+    assert asyncio.run(run())['Failed'] == 2
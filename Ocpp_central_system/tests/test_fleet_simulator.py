@@ -0,0 +1,52 @@
+import asyncio
+from argparse import Namespace
+
+import websockets
+
+import central_system
+import fleet_simulator
+
+
+def fleet_args(url, **kwargs):
+    args = Namespace(url=url, duration=2, ramp=0, heartbeat_interval=0.5,
+                     firmware_step=5.0, log_step=3.0, reconnect_at=None,
+                     connect_timeout=5, response_timeout=5)
+    vars(args).update(kwargs)
+    return args
+
+
+async def run_against_server(station_ids, use_cases, **kwargs):
+    server = await websockets.serve(
+        central_system._on_connect_factory(use_cases), '127.0.0.1', 0,
+        subprotocols=['ocpp2.0.1'])
+    port = server.sockets[0].getsockname()[1]
+    try:
+        return await fleet_simulator.run_fleet(
+            station_ids, fleet_args(f'ws://127.0.0.1:{port}', **kwargs))
+    finally:
+        server.close()
+        await server.wait_closed()
+
+
+def test_fleet_boots_and_accepts_on_connect_requests():
+    station_ids = [f'TEST_FLEET_{i}' for i in range(20)]
+    stats = asyncio.run(run_against_server(station_ids, ['L02']))
+
+    assert stats['connects'] == 20
+    assert stats['connect_failures'] == 0
+    assert stats['call_errors'] == 0
+    _, _, booted, accepted = stats['rounds'][0]
+    assert booted == accepted == 20
+    assert stats['latencies']
+    for station_id in station_ids:
+        assert central_system.state.pending(station_id)['123']['op'] == \
+            'UpdateFirmware'
+
+
+def test_fleet_reconnects_and_boots_again():
+    station_ids = [f'TEST_RECONNECT_{i}' for i in range(10)]
+    stats = asyncio.run(run_against_server(
+        station_ids, [], duration=2, reconnect_at=0.5))
+
+    assert stats['connects'] == 20
+    assert stats['rounds'][1][3] == 10
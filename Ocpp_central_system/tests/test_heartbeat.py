@@ -0,0 +1,110 @@
+import asyncio
+import math
+import time
+
+from heartbeat import AdaptiveInterval, LivenessTracker
+
+
+def advance(tracker, ticks):
+    expired = []
+    for _ in range(ticks):
+        expired.extend(tracker.advance())
+    return expired
+
+
+def test_station_expires_after_missed_heartbeats():
+    tracker = LivenessTracker(interval=10, missed_heartbeats=3)
+    tracker.touch('CP1')
+    assert advance(tracker, 29) == []
+    assert advance(tracker, 1) == ['CP1']
+    assert len(tracker) == 0
+
+
+def test_touch_moves_the_deadline():
+    tracker = LivenessTracker(interval=10, missed_heartbeats=3)
+    tracker.touch('CP1')
+    advance(tracker, 20)
+    tracker.touch('CP1')
+    assert advance(tracker, 29) == []
+    assert advance(tracker, 1) == ['CP1']
+
+
+def test_touch_with_own_interval():
+    tracker = LivenessTracker(interval=10, missed_heartbeats=2,
+                              max_timeout=120)
+    tracker.touch('slow', interval=60)
+    tracker.touch('fast', interval=5)
+    assert advance(tracker, 10) == ['fast']
+    assert advance(tracker, 110) == ['slow']
+
+
+def test_timeout_is_capped_by_the_wheel():
+    tracker = LivenessTracker(interval=10, missed_heartbeats=3,
+                              max_timeout=30)
+    tracker.touch('CP1', interval=3600)
+    assert advance(tracker, 30) == ['CP1']
+
+
+def test_forget():
+    tracker = LivenessTracker(interval=10, missed_heartbeats=3)
+    tracker.touch('CP1')
+    tracker.forget('CP1')
+    tracker.forget('unknown')
+    assert advance(tracker, 40) == []
+    assert len(tracker) == 0
+
+
+def test_adaptive_interval_spreads_the_fleet():
+    intervals = AdaptiveInterval(min_interval=10, max_interval=600,
+                                 heartbeats_per_second=100)
+    assert intervals.interval(100) == 10
+    assert intervals.interval(10000) == 100
+    assert intervals.interval(10 ** 6) == 600
+    intervals.load = 2.0
+    assert intervals.interval(10000) == 200
+
+
+def test_loop_lag_stretches_the_interval():
+    intervals = AdaptiveInterval(min_interval=10, heartbeats_per_second=100,
+                                 lag_target=0.01, tick=0.01)
+
+    async def run():
+        task = asyncio.ensure_future(intervals.run())
+        await asyncio.sleep(0.05)
+        assert intervals.load == 1.0
+        for _ in range(5):
+            # A handler blocking the event loop.
+            time.sleep(0.05)
+            await asyncio.sleep(0)
+        task.cancel()
+
+    asyncio.run(run())
+    assert intervals.load > 2
+    assert intervals.interval(10000) > 200
+
+
+def test_any_traffic_counts_as_liveness():
+    import central_system
+
+    class Connection:
+        async def send(self, message):
+            pass
+
+    async def main():
+        charge_point = central_system.ChargePoint('TEST_LIVENESS',
+                                                  Connection())
+        charge_point.heartbeat_interval = 30
+        # A response to a CALL, not a Heartbeat.
+        await charge_point.route_message('[3,"unknown-call",{}]')
+
+    liveness = central_system.liveness
+    liveness.forget('TEST_LIVENESS')
+    asyncio.run(main())
+    try:
+        assert 'TEST_LIVENESS' in liveness._slot_of
+        ticks = (liveness._slot_of['TEST_LIVENESS'] - liveness._cursor) % \
+            len(liveness._slots)
+        assert ticks == math.ceil(30 * liveness.missed_heartbeats /
+                                  liveness.tick)
+    finally:
+        liveness.forget('TEST_LIVENESS')
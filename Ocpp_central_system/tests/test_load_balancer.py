@@ -0,0 +1,168 @@
+import asyncio
+import math
+
+import numpy as np
+import pytest
+
+import load_balancer
+from connector_status import ConnectorStatusTable
+from load_balancer import SiteLoadBalancer, allocate, parse_capacities
+
+
+def test_allocate_without_contention():
+    assert allocate(100, [10, 20]).tolist() == [10, 20]
+    assert allocate(100, []).tolist() == []
+
+
+def test_allocate_shares_equally():
+    assert allocate(30, [22, 22, 22]).tolist() == [10, 10, 10]
+
+
+def test_allocate_redistributes_unused_power():
+    limits = allocate(30, [4, 22, 22])
+    assert limits.tolist() == [4, 13, 13]
+    assert limits.sum() == pytest.approx(30)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_allocate_water_filling(seed):
+    rng = np.random.default_rng(seed)
+    max_power = rng.uniform(1, 22, 50)
+    capacity = max_power.sum() / 2
+    limits = allocate(capacity, max_power)
+    assert limits.sum() == pytest.approx(capacity)
+    assert (limits <= max_power + 1e-9).all()
+    # Every EVSE below its maximum gets the same level, the highest one.
+    capped = limits < max_power - 1e-9
+    assert np.ptp(limits[capped]) == pytest.approx(0)
+    assert (limits[~capped] <= limits[capped].max() + 1e-9).all()
+
+
+def test_allocate_pauses_beyond_the_minimum():
+    assert allocate(10, [22] * 5, min_power=4).tolist() == [5, 5, 0, 0, 0]
+    assert allocate(3, [22] * 5, min_power=4).tolist() == [0] * 5
+
+
+def test_parse_capacities():
+    assert parse_capacities(['depot=1000', 'a=b=5']) == {'depot': 1000,
+                                                        'a=b': 5}
+    assert parse_capacities(None) == {}
+
+
+def balancer(capacity, push=None, **kwargs):
+    connectors = ConnectorStatusTable({f'CP{i}': 'site' for i in range(10)})
+
+    async def accept(station_id, evse_id, limit):
+        return True
+
+    return connectors, SiteLoadBalancer(
+        connectors, push or accept, {'site': capacity}, evse_max_power=22000,
+        min_power=0, threshold=500, **kwargs)
+
+
+def test_rebalance_only_reports_changes_beyond_the_threshold():
+    connectors, lb = balancer(44000)
+    connectors.update('CP1', 1, 1, 'Occupied', 1)
+    connectors.update('CP2', 1, 1, 'Occupied', 2)
+    changes = lb.rebalance('site')
+    assert [c[:3] for c in changes] == [('CP1', 1, 22000), ('CP2', 1, 22000)]
+    assert all(math.isnan(c[3]) for c in changes)
+    assert lb.rebalance('site') == []
+
+    lb.capacities['site'] = 43800
+    # 100 W less each is below the threshold, but together they would
+    # exceed the capacity.
+    assert [c[2] for c in lb.rebalance('site')] == [21900, 21900]
+
+    # 100 W more isn't worth a push.
+    connectors.update('CP2', 1, 1, 'Available', 3)
+    assert lb.rebalance('site') == []
+    assert lb.limits['site'] == {('CP1', 1): 21900}
+
+
+def run_balancer(lb, until):
+    async def main():
+        task = asyncio.ensure_future(lb.run())
+        await until()
+        task.cancel()
+
+    asyncio.run(main())
+
+
+def test_decreases_are_pushed_before_increases():
+    pushed = []
+
+    async def push(station_id, evse_id, limit):
+        pushed.append((station_id, limit))
+        await asyncio.sleep(0.01)
+        return True
+
+    connectors, lb = balancer(44000, push, settle=0.01)
+    connectors.update('CP1', 1, 1, 'Occupied', 1)
+
+    async def until():
+        await asyncio.sleep(0.1)
+        assert pushed == [('CP1', 22000)]
+        connectors.update('CP2', 1, 1, 'Occupied', 2)
+        lb.set_capacity('site', 30000)
+        await asyncio.sleep(0.1)
+
+    run_balancer(lb, until)
+    # CP2 had no limit and counts as a decrease.
+    assert sorted(pushed[1:]) == [('CP1', 15000), ('CP2', 15000)]
+
+
+def test_failed_decrease_holds_back_increases():
+    pushed = []
+
+    async def push(station_id, evse_id, limit):
+        pushed.append((station_id, limit))
+        return station_id != 'CP3'
+
+    connectors, lb = balancer(30000, push, settle=0.01, retry_backoff=60)
+    connectors.update('CP1', 1, 1, 'Occupied', 1)
+    connectors.update('CP2', 1, 1, 'Occupied', 2)
+
+    async def until():
+        await asyncio.sleep(0.05)
+        pushed.clear()
+        connectors.update('CP3', 1, 1, 'Occupied', 3)
+        lb.set_capacity('site', 60000)
+        await asyncio.sleep(0.05)
+
+    run_balancer(lb, until)
+    # CP3 had no limit; while it didn't accept one the others stay put.
+    assert pushed == [('CP3', 20000)]
+    assert lb.limits['site'] == {}
+    assert lb._failures == {'site': 1}
+
+
+def test_failed_push_is_retried_with_backoff(monkeypatch):
+    # Without jitter the retries come after 0.2 s, then 0.4 s.
+    monkeypatch.setattr(load_balancer.random, 'uniform', lambda a, b: 1.0)
+    pushed = []
+    failing = {'CP2'}
+
+    async def push(station_id, evse_id, limit):
+        pushed.append((station_id, limit))
+        return station_id not in failing
+
+    connectors, lb = balancer(30000, push, settle=0.01, retry_backoff=0.2)
+    connectors.update('CP1', 1, 1, 'Occupied', 1)
+    connectors.update('CP2', 1, 1, 'Occupied', 2)
+
+    async def until():
+        await asyncio.sleep(0.05)
+        assert sorted(pushed) == [('CP1', 15000), ('CP2', 15000)]
+        assert lb.limits['site'] == {('CP1', 1): 15000}
+        assert lb._failures == {'site': 1}
+        await asyncio.sleep(0.3)
+        assert pushed.count(('CP2', 15000)) == 2
+        assert lb._failures == {'site': 2}
+        failing.clear()
+        await asyncio.sleep(0.6)
+
+    run_balancer(lb, until)
+    assert pushed.count(('CP2', 15000)) == 3
+    assert lb.limits['site'] == {('CP1', 1): 15000, ('CP2', 1): 15000}
+    assert 'site' not in lb._failures
@@ -0,0 +1,90 @@
+""" Resumed log uploads of the N01 example station against the artifact
+server.
+"""
+import asyncio
+import functools
+import gzip
+import importlib.util
+import os
+import socket
+
+import pytest
+
+from artifact_server import ArtifactServer
+
+N01_PATH = os.path.join(os.path.dirname(__file__), '..', '..',
+                        'Ocpp_usecase_N01', 'charge_point_N01.py')
+
+
+@pytest.fixture
+def n01(monkeypatch):
+    spec = importlib.util.spec_from_file_location('charge_point_N01',
+                                                  N01_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    # It takes the log file from the command line, which is pytest's here.
+    monkeypatch.setattr(module, 'LOG_FILE', None)
+    # Small chunks, so a short log takes several requests.
+    monkeypatch.setattr(module, 'compressed_chunks', functools.partial(
+        module.compressed_chunks, chunk_size=512))
+    return module
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def test_interrupted_upload_resumes(n01, tmp_path, monkeypatch):
+    statuses = []
+    puts = []
+    put = n01.HTTPUpload.put
+
+    async def flaky_put(self, chunk, first, total):
+        puts.append(first)
+        if len(puts) == 3:
+            raise n01.UploadError("connection lost")
+        return await put(self, chunk, first, total)
+
+    async def log_status_notification(status, request_id):
+        statuses.append(status)
+
+    monkeypatch.setattr(n01.HTTPUpload, 'put', flaky_put)
+
+    async def run():
+        port = free_port()
+        server = ArtifactServer(str(tmp_path / 'firmware'),
+                                str(tmp_path / 'logs'), host='127.0.0.1',
+                                port=port)
+        await server.start()
+        try:
+            charge_point = n01.ChargePoint('CP1', None)
+            charge_point.log_status_notification = log_status_notification
+            # No latestTimestamp: the window ends now, for every attempt.
+            window = charge_point._log_window({
+                'remote_location': server.upload_url('CP1'),
+                'oldest_timestamp': '2024-01-01T00:00:00Z'})
+            await charge_point.upload_log(server.upload_url('CP1'), window,
+                                          7, retries=1, retry_interval=0)
+            return window
+        finally:
+            await server.close()
+
+    window = asyncio.run(run())
+    assert statuses == ['Uploading', 'Uploaded']
+    # The second attempt continued where the server stopped.
+    assert puts[3] == puts[2] > 0
+    with gzip.open(tmp_path / 'logs' / 'CP1' / 'CP1-7.log.gz') as f:
+        assert f.read() == b''.join(n01.generate_log_window(*window))
+    assert not os.path.exists(tmp_path / 'logs' / 'CP1' / 'CP1-7.log.gz.part')
+
+
+def test_log_window_defaults_to_now(n01):
+    oldest, latest = n01.ChargePoint._log_window({})
+    assert oldest is None
+    assert latest.tzinfo is not None
+    oldest, latest = n01.ChargePoint._log_window({
+        'oldest_timestamp': '2024-01-01T00:00:00Z',
+        'latest_timestamp': '2024-01-02T00:00:00'})
+    assert (latest - oldest).days == 1
@@ -0,0 +1,68 @@
+import asyncio
+
+from metrics import UNKNOWN_ACTION, Histogram, Metrics, timed_handler
+
+
+def test_histogram_quantiles():
+    h = Histogram((1, 2, 4))
+    for value in (0.5, 1.5, 1.5, 3, 10):
+        h.observe(value)
+    assert h.count == 5
+    assert h.sum == 16.5
+    assert h.quantile(0.5) == 2
+    assert h.quantile(0.99) == float('inf')
+    assert Histogram((1,)).quantile(0.5) == 0.0
+
+
+def test_render_and_summary():
+    metrics = Metrics()
+    metrics.observe('ocpp_call_seconds', 'GetLog', 0.01)
+    metrics.register('ocpp_queue_depth', 'gauge', "Depth.", lambda: 3)
+    text = metrics.render()
+    assert 'ocpp_call_seconds_count{action="GetLog"} 1' in text
+    assert '# TYPE ocpp_queue_depth gauge\nocpp_queue_depth 3' in text
+    assert 'ocpp_call_seconds GetLog: count=1' in metrics.summary()
+
+
+def test_frames_without_an_action_are_labelled_unknown():
+    # A CALLRESULT received while no CALL is outstanding.
+    metrics = Metrics()
+    metrics.observe('ocpp_payload_bytes_received', None, 100)
+    metrics.observe('ocpp_payload_bytes_received', 'Heartbeat', 100)
+    text = metrics.render()
+    assert f'ocpp_payload_bytes_received_count{{action="{UNKNOWN_ACTION}"}}' \
+        ' 1' in text
+    assert f'ocpp_payload_bytes_received {UNKNOWN_ACTION}: count=1' in \
+        metrics.summary()
+
+
+def test_timed_handler_observes_sync_and_async_handlers():
+    metrics = Metrics()
+
+    async def handler():
+        return 'async'
+
+    assert timed_handler(metrics, 'Heartbeat', lambda: 'sync')() == 'sync'
+    assert asyncio.run(timed_handler(metrics, 'Authorize', handler)()) == \
+        'async'
+    assert metrics.histogram('ocpp_handler_seconds', 'Heartbeat').count == 1
+    assert metrics.histogram('ocpp_handler_seconds', 'Authorize').count == 1
+
+
+def test_result_before_any_call_keeps_metrics_working():
+    import central_system
+
+    class Connection:
+        async def send(self, message):
+            pass
+
+    async def main():
+        charge_point = central_system.ChargePoint('TEST_METRICS',
+                                                  Connection())
+        await charge_point.route_message('[3,"no-such-call",{}]')
+
+    asyncio.run(main())
+    central_system.metrics.observe('ocpp_payload_bytes_received',
+                                   'Heartbeat', 10)
+    assert f'action="{UNKNOWN_ACTION}"' in central_system.metrics.render()
+    assert central_system.metrics.summary()
@@ -0,0 +1,154 @@
+import asyncio
+import time
+
+import pytest
+from ocpp.v201 import call
+
+from outbound_queue import Expired, OutboundQueue, Superseded
+
+
+class Station:
+    """ call() of a station that answers once released, in order. """
+
+    def __init__(self):
+        self.sent = []
+        self.release = asyncio.Event()
+
+    async def call(self, payload, suppress=True):
+        self.sent.append(payload)
+        await self.release.wait()
+        if isinstance(payload, call.GetLogPayload):
+            raise asyncio.TimeoutError()
+        return payload.__class__.__name__[:-7]
+
+
+def set_variables(value='1'):
+    return call.SetVariablesPayload(set_variable_data=[{
+        'attributeValue': value, 'component': {'name': 'C'},
+        'variable': {'name': 'V'}}])
+
+
+def profile(evse_id, profile_id, limit):
+    return call.SetChargingProfilePayload(evse_id=evse_id, charging_profile={
+        'id': profile_id, 'stackLevel': 0,
+        'chargingProfilePurpose': 'TxDefaultProfile',
+        'chargingProfileKind': 'Absolute', 'chargingSchedule': [],
+        'limit': limit})
+
+
+def update_firmware():
+    return call.UpdateFirmwarePayload(request_id=1, firmware={
+        'location': 'x', 'retrieveDateTime': '2020-01-01T00:00:00Z'})
+
+
+def get_log():
+    return call.GetLogPayload(log_type='DiagnosticsLog', request_id=1,
+                              log={'remoteLocation': 'x'})
+
+
+def names(payloads):
+    return [p.__class__.__name__[:-7] for p in payloads]
+
+
+def test_sent_by_priority_then_in_order():
+    async def main():
+        station = Station()
+        queue = OutboundQueue(station.call)
+        futures = [queue.submit(get_log()),
+                   queue.submit(update_firmware()),
+                   queue.submit(set_variables('1')),
+                   queue.submit(profile(1, 1, 10)),
+                   queue.submit(set_variables('2'))]
+        assert len(queue) == 5
+        station.release.set()
+        await asyncio.gather(*futures, return_exceptions=True)
+        return station.sent
+
+    sent = asyncio.run(main())
+    assert names(sent) == ['SetChargingProfile', 'SetVariables',
+                           'SetVariables', 'UpdateFirmware', 'GetLog']
+    assert [p.set_variable_data[0]['attributeValue'] for p in sent[1:3]] == \
+        ['1', '2']
+
+
+def test_queued_behind_the_request_in_flight():
+    async def main():
+        station = Station()
+        queue = OutboundQueue(station.call)
+        futures = [queue.submit(update_firmware())]
+        await asyncio.sleep(0)
+        futures += [queue.submit(set_variables()),
+                    queue.submit(get_log(), priority=-1)]
+        station.release.set()
+        await asyncio.gather(*futures, return_exceptions=True)
+        return station.sent
+
+    assert names(asyncio.run(main())) == ['UpdateFirmware', 'GetLog',
+                                          'SetVariables']
+
+
+def test_newer_profile_supersedes_queued_one():
+    async def main():
+        station = Station()
+        queue = OutboundQueue(station.call)
+        busy = queue.submit(set_variables())
+        old = queue.submit(profile(1, 7, 10))
+        other_evse = queue.submit(profile(2, 7, 10))
+        new = queue.submit(profile(1, 7, 20))
+        station.release.set()
+        results = await asyncio.gather(busy, old, other_evse, new,
+                                       return_exceptions=True)
+        return station.sent, results
+
+    sent, results = asyncio.run(main())
+    assert isinstance(results[1], Superseded)
+    assert results[2] == results[3] == 'SetChargingProfile'
+    assert [(p.evse_id, p.charging_profile['limit']) for p in sent
+            if isinstance(p, call.SetChargingProfilePayload)] == \
+        [(2, 10), (1, 20)]
+
+
+def test_expired_request_is_dropped_unsent():
+    async def main():
+        station = Station()
+        queue = OutboundQueue(station.call)
+        busy = queue.submit(set_variables())
+        late = queue.submit(update_firmware(),
+                            deadline=time.monotonic() + 0.05)
+        await asyncio.sleep(0.1)
+        station.release.set()
+        await busy
+        with pytest.raises(Expired):
+            await late
+        assert len(queue) == 0
+        return station.sent
+
+    assert names(asyncio.run(main())) == ['SetVariables']
+
+
+def test_errors_reach_the_caller():
+    async def main():
+        station = Station()
+        station.release.set()
+        queue = OutboundQueue(station.call)
+        with pytest.raises(asyncio.TimeoutError):
+            await queue.submit(get_log())
+        assert await queue.submit(set_variables()) == 'SetVariables'
+
+    asyncio.run(main())
+
+
+def test_close_fails_everything():
+    async def main():
+        station = Station()
+        queue = OutboundQueue(station.call)
+        futures = [queue.submit(set_variables()),
+                   queue.submit(update_firmware())]
+        await asyncio.sleep(0)
+        queue.close()
+        results = await asyncio.gather(*futures, return_exceptions=True)
+        return station.sent, results
+
+    sent, results = asyncio.run(main())
+    assert names(sent) == ['SetVariables']
+    assert all(isinstance(r, ConnectionError) for r in results)
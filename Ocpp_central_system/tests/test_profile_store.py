@@ -0,0 +1,130 @@
+import asyncio
+
+from profile_store import ChargingProfileStore
+
+
+def profile(profile_id, stack_level=0, purpose='TxDefaultProfile', **extra):
+    return dict({'id': profile_id, 'stackLevel': stack_level,
+                 'chargingProfilePurpose': purpose,
+                 'chargingProfileKind': 'Absolute',
+                 'chargingSchedule': []}, **extra)
+
+
+def test_install_and_query(tmp_path):
+    store = ChargingProfileStore(str(tmp_path / 'profiles.jsonl'))
+    store.install('CP1', 1, profile(10))
+    store.install('CP1', 2, profile(20))
+    assert store.get('CP1', 10)['id'] == 10
+    assert len(store.profiles('CP1')) == 2
+    assert store.profiles('CP1', 2) == [(2, profile(20))]
+    assert store.by_stack_level('CP1', 1, 'TxDefaultProfile', 0)['id'] == 10
+    assert store.get('CP2', 10) is None
+
+
+def test_same_stack_level_replaces(tmp_path):
+    store = ChargingProfileStore(str(tmp_path / 'profiles.jsonl'))
+    store.install('CP1', 1, profile(10, stack_level=3))
+    store.install('CP1', 1, profile(11, stack_level=3))
+    assert store.get('CP1', 10) is None
+    assert [p['id'] for _, p in store.profiles('CP1')] == [11]
+
+
+def test_same_id_replaces(tmp_path):
+    store = ChargingProfileStore(str(tmp_path / 'profiles.jsonl'))
+    store.install('CP1', 1, profile(10, stack_level=1))
+    store.install('CP1', 2, profile(10, stack_level=2))
+    assert store.profiles('CP1') == [(2, profile(10, stack_level=2))]
+
+
+def test_snake_case_profiles_are_normalized(tmp_path):
+    store = ChargingProfileStore(str(tmp_path / 'profiles.jsonl'))
+    store.install('CP1', 1, {'id': 10, 'stack_level': 0,
+                             'charging_profile_purpose': 'TxProfile',
+                             'charging_profile_kind': 'Absolute',
+                             'charging_schedule': []})
+    assert store.by_stack_level('CP1', 1, 'TxProfile', 0)['id'] == 10
+
+
+def test_remove_matching(tmp_path):
+    store = ChargingProfileStore(str(tmp_path / 'profiles.jsonl'))
+    store.install('CP1', 1, profile(10, purpose='TxProfile',
+                                    transactionId='T1'))
+    store.install('CP1', 1, profile(11, stack_level=1, purpose='TxProfile'))
+    store.install('CP1', 1, profile(12, purpose='TxProfile',
+                                    stack_level=2, transactionId='T2'))
+    store.install('CP1', 2, profile(20))
+    assert sorted(store.remove_matching('CP1', 1, 'TxProfile',
+                                        transaction_id='T1')) == [10, 11]
+    assert [p['id'] for _, p in store.profiles('CP1')] == [12, 20]
+    assert store.remove_matching('CP1', purpose='TxDefaultProfile') == [20]
+
+
+def test_listeners_see_changes(tmp_path):
+    store = ChargingProfileStore(str(tmp_path / 'profiles.jsonl'))
+    changes = []
+    store.add_listener(lambda station_id, evse_id:
+                       changes.append((station_id, evse_id)))
+    store.install('CP1', 1, profile(10))
+    store.remove('CP1', 10)
+    store.remove('CP1', 10)
+    assert changes == [('CP1', 1), ('CP1', 1)]
+
+
+def test_recovers_from_the_file(tmp_path):
+    path = str(tmp_path / 'profiles.jsonl')
+    store = ChargingProfileStore(path)
+    store.install('CP1', 1, profile(10))
+    store.install('CP1', 1, profile(11, stack_level=1))
+    store.remove('CP1', 10)
+    asyncio.run(store.flush())
+    with open(path, 'a') as f:
+        f.write('{"op": "install", "sta')
+
+    recovered = ChargingProfileStore(path)
+    recovered.load()
+    assert recovered.profiles('CP1') == store.profiles('CP1')
+
+
+def test_compaction_keeps_the_installed_profiles(tmp_path):
+    path = str(tmp_path / 'profiles.jsonl')
+    store = ChargingProfileStore(path, compact_min_records=10)
+    for i in range(20):
+        store.install('CP1', 1, profile(i))
+    asyncio.run(store.flush())
+    with open(path) as f:
+        assert len(f.readlines()) == 1
+
+    recovered = ChargingProfileStore(path)
+    recovered.load()
+    assert recovered.profiles('CP1') == [(1, profile(19))]
+
+
+def test_records_of_other_stations_are_forwarded(tmp_path):
+    path = str(tmp_path / 'profiles.jsonl')
+    forwarded = []
+    store = ChargingProfileStore(path)
+    store.persists = lambda station_id: station_id == 'home'
+    store.forward = forwarded.append
+    store.install('home', 1, profile(10))
+    store.install('guest', 1, profile(20))
+    asyncio.run(store.flush())
+
+    assert [r['station'] for r in forwarded] == ['guest']
+    home = ChargingProfileStore(str(tmp_path / 'home.jsonl'))
+    home.apply_remote(forwarded[0])
+    assert home.profiles('guest') == store.profiles('guest')
+
+    recovered = ChargingProfileStore(path)
+    recovered.load()
+    assert list(recovered.stations()) == ['home']
+
+
+def test_adopt_and_drop(tmp_path):
+    store = ChargingProfileStore(str(tmp_path / 'profiles.jsonl'))
+    store.install('CP1', 1, profile(10))
+    other = ChargingProfileStore(str(tmp_path / 'other.jsonl'))
+    other.install('CP1', 2, profile(99))
+    other.adopt('CP1', store.export('CP1'))
+    assert other.profiles('CP1') == [(1, profile(10))]
+    other.drop('CP1')
+    assert other.profiles('CP1') == []
@@ -0,0 +1,46 @@
+from types import SimpleNamespace
+
+from central_system import StationRegistry
+
+
+def station(station_id):
+    return SimpleNamespace(id=station_id)
+
+
+def test_register_and_lookup():
+    registry = StationRegistry()
+    cp = station('CP1')
+    assert registry.register(cp) is None
+    assert registry.get('CP1') is cp
+    assert 'CP1' in registry
+    assert 'CP2' not in registry
+    assert len(registry) == 1
+    assert list(registry) == [cp]
+
+
+def test_reconnect_replaces_connection():
+    registry = StationRegistry()
+    old, new = station('CP1'), station('CP1')
+    registry.register(old)
+    assert registry.register(new) is old
+    assert registry.get('CP1') is new
+
+
+def test_stale_connection_does_not_unregister_new_one():
+    registry = StationRegistry()
+    old, new = station('CP1'), station('CP1')
+    registry.register(old)
+    registry.register(new)
+    registry.unregister(old)
+    assert registry.get('CP1') is new
+    registry.unregister(new)
+    assert 'CP1' not in registry
+
+
+def test_iteration_tolerates_changes():
+    registry = StationRegistry()
+    for i in range(3):
+        registry.register(station(f'CP{i}'))
+    for cp in registry:
+        registry.unregister(cp)
+    assert len(registry) == 0
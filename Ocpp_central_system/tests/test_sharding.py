@@ -0,0 +1,126 @@
+import asyncio
+
+import pytest
+
+from sharding import Broker, RemoteError, WorkerBus, home_worker
+
+
+def test_home_worker_is_stable():
+    # crc32 of the id, the same in every process.
+    assert home_worker('CP1', 4) == 1
+    assert {home_worker(f'CP{i}', 4) for i in range(100)} == {0, 1, 2, 3}
+
+
+async def connect(tmp_path, workers, execute=None, timeout=1):
+    path = str(tmp_path / 'bus.sock')
+    broker = Broker(path, timeout=timeout)
+    await broker.start()
+    buses, events = [], []
+    for worker_id in range(workers):
+        def on_event(event, worker_id=worker_id, **kwargs):
+            events.append((worker_id, event, kwargs))
+            return {'worker': worker_id, **kwargs}
+
+        async def run(station_id, operation, worker_id=worker_id, **kwargs):
+            if execute is not None:
+                return await execute(worker_id, station_id, operation,
+                                     **kwargs)
+            return [worker_id, station_id, operation, kwargs]
+
+        bus = WorkerBus(path, worker_id, run, None, timeout=timeout,
+                        on_event=on_event)
+        await bus.connect()
+        bus.task = asyncio.ensure_future(bus.run())
+        buses.append(bus)
+    await asyncio.sleep(0.05)
+    return broker, buses, events
+
+
+async def disconnect(broker, buses):
+    for bus in buses:
+        bus._writer.close()
+        await bus.task
+    await asyncio.sleep(0.05)
+    await broker.close()
+
+
+def test_route_to_the_worker_holding_the_station(tmp_path):
+    async def main():
+        broker, buses, _ = await connect(tmp_path, 2)
+        await buses[1].register('CP1')
+        await asyncio.sleep(0.01)
+        results = [await buses[0].route('CP1', 'get_log_request',
+                                        {'request_id': 1}),
+                   await broker.route('CP1', 'get_log_request')]
+        with pytest.raises(RemoteError):
+            await buses[0].route('CP2', 'get_log_request')
+        await buses[1].unregister('CP1')
+        await asyncio.sleep(0.01)
+        with pytest.raises(RemoteError):
+            await buses[0].route('CP1', 'get_log_request')
+        await disconnect(broker, buses)
+        return results
+
+    assert asyncio.run(main()) == [
+        [1, 'CP1', 'get_log_request', {'request_id': 1}],
+        [1, 'CP1', 'get_log_request', {}]]
+
+
+def test_route_timeout_per_call(tmp_path):
+    async def slow(worker_id, station_id, operation):
+        await asyncio.sleep(0.2)
+        return 'done'
+
+    async def main():
+        broker, buses, _ = await connect(tmp_path, 2, slow, timeout=0.05)
+        await buses[1].register('CP1')
+        await asyncio.sleep(0.01)
+        with pytest.raises(asyncio.TimeoutError):
+            await buses[0].route('CP1', 'x')
+        result = await buses[0].route('CP1', 'x', timeout=1)
+        await disconnect(broker, buses)
+        return result
+
+    assert asyncio.run(main()) == 'done'
+
+
+def test_events_and_queries_between_workers(tmp_path):
+    async def main():
+        broker, buses, events = await connect(tmp_path, 2)
+        buses[0].notify(1, 'firmware_status', {'request_id': 1001})
+        # Dropped, there is no such worker.
+        buses[0].notify(5, 'firmware_status')
+        answer = await buses[0].ask(1, 'station_state', {'station_id': 'A'})
+        with pytest.raises(RemoteError):
+            await buses[0].ask(5, 'station_state')
+        await disconnect(broker, buses)
+        return events, answer
+
+    events, answer = asyncio.run(main())
+    assert events == [(1, 'firmware_status', {'request_id': 1001}),
+                      (1, 'station_state', {'station_id': 'A'})]
+    assert answer == {'worker': 1, 'station_id': 'A'}
+
+
+def test_previous_worker_hears_that_a_station_moved(tmp_path):
+    async def main():
+        broker, buses, events = await connect(tmp_path, 3)
+        await buses[0].register('CP1')
+        await buses[0].unregister('CP1')
+        await asyncio.sleep(0.01)
+        await buses[0].register('CP1')
+        await asyncio.sleep(0.01)
+        assert events == []
+        # Reconnected elsewhere before the old socket was torn down.
+        await buses[1].register('CP1')
+        await asyncio.sleep(0.01)
+        await buses[1].unregister('CP1')
+        await asyncio.sleep(0.01)
+        await buses[2].register('CP1')
+        await asyncio.sleep(0.01)
+        await disconnect(broker, buses)
+        return events
+
+    assert asyncio.run(main()) == [
+        (0, 'station_moved', {'station_id': 'CP1'}),
+        (1, 'station_moved', {'station_id': 'CP1'})]
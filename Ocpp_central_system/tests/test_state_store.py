@@ -0,0 +1,128 @@
+import asyncio
+import os
+
+import codec
+from state_store import StateStore
+
+
+def recover(directory):
+    store = StateStore(str(directory))
+    store.load()
+    return store
+
+
+def fill(store):
+    store.boot('CP1', {'model': 'M', 'vendorName': 'V'}, 'PowerUp', 60)
+    store.status('CP1', 1, 1, 'Occupied')
+    store.status('CP1', 1, 1, 'Available')
+    store.start_request('CP1', 7, 'UpdateFirmware')
+    store.request_status('CP1', 7, 'Downloading', False)
+    store.start_request('CP1', 8, 'GetLog')
+    store.request_status('CP1', 8, 'Uploaded', True)
+    store.operation_done('CP1', 'set_variables_request')
+    store.variable('CP1', ('OCPPCommCtrlr', None, None, None,
+                           'HeartbeatInterval', None, 'Actual'), '60')
+
+
+def check(store):
+    assert store.get('CP1')['boot'] == {
+        'station': {'model': 'M', 'vendorName': 'V'}, 'reason': 'PowerUp'}
+    assert store.heartbeat_interval('CP1') == 60
+    assert store.get('CP1')['connectors'] == {'1/1': 'Available'}
+    assert store.pending('CP1') == {
+        '7': {'op': 'UpdateFirmware', 'status': 'Downloading'}}
+    assert store.done('CP1', 'set_variables_request')
+    assert not store.done('CP1', 'get_log_request')
+    assert list(store.variables('CP1')) == [
+        (('OCPPCommCtrlr', None, None, None, 'HeartbeatInterval', None,
+          'Actual'), '60')]
+
+
+def test_queries_of_unknown_station(tmp_path):
+    store = recover(tmp_path)
+    assert len(store) == 0
+    assert store.heartbeat_interval('CP1') is None
+    assert store.pending('CP1') == {}
+    assert not store.done('CP1', 'get_log_request')
+    assert list(store.variables('CP1')) == []
+    store.request_status('CP1', 1, 'Downloaded', False)
+    assert 'CP1' not in store
+
+
+def test_recovers_from_the_log(tmp_path):
+    store = StateStore(str(tmp_path))
+    fill(store)
+    check(store)
+    asyncio.run(store.flush())
+    assert not os.path.exists(store.snapshot_path)
+    check(recover(tmp_path))
+
+
+def test_recovers_from_snapshot_and_log(tmp_path):
+    store = StateStore(str(tmp_path), snapshot_min_records=5)
+    fill(store)
+    asyncio.run(store.flush())
+    assert os.path.exists(store.snapshot_path)
+    assert os.path.getsize(store.log_path) == 0
+    store.status('CP1', 1, 2, 'Faulted')
+    asyncio.run(store.flush())
+
+    recovered = recover(tmp_path)
+    assert recovered.get('CP1')['connectors'] == {'1/1': 'Available',
+                                                   '1/2': 'Faulted'}
+    recovered.get('CP1')['connectors'].pop('1/2')
+    check(recovered)
+
+
+def test_replaying_the_log_over_its_snapshot_is_harmless(tmp_path):
+    store = StateStore(str(tmp_path))
+    fill(store)
+    asyncio.run(store.flush())
+    with open(store.log_path) as f:
+        log = f.read()
+    # A crash after the snapshot was written, before the log was emptied.
+    store._write_snapshot(codec.dumps(store.stations))
+    with open(store.log_path, 'w') as f:
+        f.write(log)
+    check(recover(tmp_path))
+
+
+def test_torn_last_record_is_skipped(tmp_path):
+    store = StateStore(str(tmp_path))
+    fill(store)
+    asyncio.run(store.flush())
+    with open(store.log_path, 'a') as f:
+        f.write('{"k": "status", "s": "CP1", "c": "1/')
+    check(recover(tmp_path))
+
+
+def test_records_of_other_stations_are_forwarded(tmp_path):
+    forwarded = []
+    store = StateStore(str(tmp_path), snapshot_min_records=1)
+    store.persists = lambda station_id: station_id == 'CP1'
+    store.forward = forwarded.append
+    fill(store)
+    store.boot('guest', {}, 'PowerUp', 30)
+    asyncio.run(store.flush())
+
+    assert [r['s'] for r in forwarded] == ['guest']
+    assert store.heartbeat_interval('guest') == 30
+    recovered = recover(tmp_path)
+    assert 'guest' not in recovered
+    check(recovered)
+
+    home = StateStore(str(tmp_path / 'home'))
+    home.apply_remote(forwarded[0])
+    assert home.heartbeat_interval('guest') == 30
+
+
+def test_adopt_and_drop(tmp_path):
+    store = StateStore(str(tmp_path))
+    fill(store)
+    other = StateStore(str(tmp_path / 'other'))
+    other.adopt('CP1', store.export('CP1'))
+    check(other)
+    other.drop('CP1')
+    assert 'CP1' not in other
+    other.adopt('CP1', None)
+    assert 'CP1' not in other
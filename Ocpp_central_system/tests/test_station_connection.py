@@ -0,0 +1,130 @@
+import asyncio
+import json
+import sys
+
+import pytest
+from ocpp.routing import after, on
+from ocpp.v201 import ChargePoint, call, call_result
+
+from call_table import CallTable
+from station_connection import StationConnection
+
+
+class Connection:
+
+    def __init__(self, on_send=None):
+        self.frames = []
+        self.on_send = on_send
+
+    async def send(self, message):
+        self.frames.append(json.loads(message))
+        if self.on_send is not None:
+            await self.on_send(json.loads(message))
+
+
+wrapped = []
+
+
+class Station(StationConnection):
+
+    __slots__ = ('after_boot',)
+
+    @classmethod
+    def wrap_handler(cls, action, handler):
+        wrapped.append(action)
+        return handler
+
+    def __init__(self, id, connection, **kwargs):
+        super().__init__(id, connection, **kwargs)
+        self.after_boot = None
+
+    @on('BootNotification')
+    def on_boot_notification(self, charging_station, reason, **kwargs):
+        return call_result.BootNotificationPayload(
+            current_time='2024-01-01T00:00:00Z', interval=10,
+            status='Accepted')
+
+    @after('BootNotification')
+    def after_boot_notification(self, reason, **kwargs):
+        self.after_boot = reason
+
+    @on('Heartbeat')
+    async def on_heartbeat(self):
+        return call_result.HeartbeatPayload(
+            current_time='2024-01-01T00:00:00Z')
+
+
+def test_routes_are_built_once_per_class():
+    assert sorted(wrapped) == ['BootNotification', 'Heartbeat']
+    Station('CP1', Connection())
+    Station('CP2', Connection())
+    assert len(wrapped) == 2
+    assert Station.route_map['BootNotification']['_unbound']
+
+
+def test_connections_have_no_instance_dict():
+    station = Station('CP1', Connection())
+    assert not hasattr(station, '__dict__')
+    with pytest.raises(AttributeError):
+        station.anything = 1
+    # Smaller than a library ChargePoint before it even routes a frame.
+    library = ChargePoint('CP1', Connection())
+    assert sys.getsizeof(station) < sys.getsizeof(library) + \
+        sys.getsizeof(vars(library))
+
+
+def test_handlers():
+    station = Station('CP1', Connection())
+
+    async def run():
+        await station.route_message(json.dumps(
+            [2, 'b1', 'BootNotification',
+             {'chargingStation': {'model': 'M', 'vendorName': 'V'},
+              'reason': 'PowerUp'}]))
+        await station.route_message('[2,"h1","Heartbeat",{}]')
+        await station.route_message('[2,"x1","Authorize",{}]')
+
+    asyncio.run(run())
+    boot, heartbeat, authorize = station._connection.frames
+    assert boot[:2] == [3, 'b1'] and boot[2]['status'] == 'Accepted'
+    assert heartbeat == [3, 'h1', {'currentTime': '2024-01-01T00:00:00Z'}]
+    assert authorize[:3] == [4, 'x1', 'NotSupported']
+    assert station.after_boot == 'PowerUp'
+
+
+def test_response_overtaking_the_call():
+    async def answer(message):
+        # Answered while call() is still in _send().
+        await station.route_message(json.dumps(
+            [3, message[1], {'status': 'Accepted'}]))
+
+    station = Station('CP1', Connection(answer))
+    result = asyncio.run(station.call(call.TriggerMessagePayload(
+        requested_message='Heartbeat')))
+    assert result == call_result.TriggerMessagePayload(status='Accepted')
+
+
+def test_unknown_responses_are_ignored():
+    station = Station('CP1', Connection(), response_timeout=0.05)
+
+    async def run():
+        calling = asyncio.ensure_future(station.call(
+            call.TriggerMessagePayload(requested_message='Heartbeat')))
+        await asyncio.sleep(0.01)
+        await station.route_message('[3,"other-id",{"status":"Accepted"}]')
+        with pytest.raises(asyncio.TimeoutError):
+            await calling
+
+    asyncio.run(run())
+
+
+def test_call_table_timeouts(monkeypatch):
+    table = CallTable(timeouts={'TriggerMessage': 0.05})
+    monkeypatch.setattr(Station, 'call_table', table)
+    station = Station('CP1', Connection())
+
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(station.call(call.TriggerMessagePayload(
+            requested_message='Heartbeat')))
+    assert table.timed_out == 1
+    assert len(table) == 0
@@ -0,0 +1,134 @@
+import atexit
+import functools
+import io
+import json
+import logging
+import queue
+import threading
+import time
+
+import pytest
+
+import structured_log
+from admission import TokenBucket
+from structured_log import NonBlockingQueueHandler, SamplingFilter, \
+    StationLogger, parse_sample_rates, setup_logging
+
+
+class Clock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class SlowStream(io.StringIO):
+    """ A stdout that takes its time. """
+
+    def write(self, text):
+        time.sleep(0.001)
+        return super().write(text)
+
+
+@pytest.fixture
+def root_logger():
+    """ Restore the root logger after setup_logging() replaced its
+    handlers.
+    """
+    root = logging.getLogger()
+    handlers, level = root.handlers[:], root.level
+    listeners = []
+    yield listeners
+    for listener in listeners:
+        atexit.unregister(listener.stop)
+        if listener._thread is not None:
+            listener.stop()
+    root.handlers[:] = handlers
+    root.setLevel(level)
+
+
+def record(name='test', action=None, level=logging.INFO):
+    record = logging.LogRecord(name, level, '', 0, 'message', None, None)
+    if action is not None:
+        record.action = action
+    return record
+
+
+def test_background_writer_flushes_on_shutdown(root_logger):
+    stream = SlowStream()
+    listener = setup_logging(stream=stream, sample_rates={}, rate_limit=None)
+    root_logger.append(listener)
+    log = StationLogger(logging.getLogger('central_system.test'), 'CP1')
+
+    start = time.perf_counter()
+    for i in range(200):
+        log.info("Handled %d", i, action='Authorize')
+    # Writing takes at least 0.2 s; logging only queued the records.
+    assert time.perf_counter() - start < 0.1
+    assert threading.current_thread() is threading.main_thread()
+
+    listener.stop()
+    lines = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert [line['msg'] for line in lines] == \
+        [f'Handled {i}' for i in range(200)]
+    assert lines[0]['station'] == 'CP1'
+    assert lines[0]['action'] == 'Authorize'
+    assert lines[0]['logger'] == 'central_system.test'
+    assert lines[0]['level'] == 'INFO'
+
+
+def test_text_format(root_logger):
+    stream = io.StringIO()
+    listener = setup_logging(fmt='text', stream=stream)
+    root_logger.append(listener)
+    StationLogger(logging.getLogger('central_system.test'), 'CP1').warning(
+        "Rejected", action='Authorize')
+    listener.stop()
+    assert stream.getvalue() == \
+        'WARNING:central_system.test:Rejected [station=CP1 action=Authorize]\n'
+
+
+def test_full_queue_drops_records():
+    handler = NonBlockingQueueHandler(queue.Queue(2))
+    for _ in range(5):
+        handler.emit(record())
+    assert handler.queue.qsize() == 2
+    assert handler.dropped == 3
+
+
+def test_sample_rates(monkeypatch):
+    values = iter([0.5, 0.0005, 0.2])
+    monkeypatch.setattr(structured_log.random, 'random',
+                        lambda: next(values))
+    sampling = SamplingFilter({'Heartbeat': 0.001, 'test': 0.3})
+    assert not sampling.filter(record(action='Heartbeat'))
+    assert sampling.filter(record(action='Heartbeat'))
+    # Without an action the logger name is the key.
+    assert sampling.filter(record())
+    assert sampling.filter(record(action='Heartbeat', level=logging.ERROR))
+
+
+def test_rate_limit_reports_dropped_records(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(structured_log, 'TokenBucket',
+                        functools.partial(TokenBucket, clock=clock))
+    sampling = SamplingFilter(rate_limit=2)
+    assert [sampling.filter(record(action='Authorize'))
+            for _ in range(5)] == [True, True, False, False, False]
+    # Other actions have their own budget.
+    assert sampling.filter(record(action='StatusNotification'))
+    clock.now += 0.5
+    passed = record(action='Authorize')
+    assert sampling.filter(passed)
+    assert passed.dropped == 3
+    clock.now += 0.5
+    passed = record(action='Authorize')
+    assert sampling.filter(passed)
+    assert not hasattr(passed, 'dropped')
+
+
+def test_parse_sample_rates():
+    assert parse_sample_rates(['Heartbeat=0.5', 'Authorize=0.1']) == dict(
+        structured_log.DEFAULT_SAMPLE_RATES, Heartbeat=0.5, Authorize=0.1)
@@ -0,0 +1,119 @@
+import argparse
+import asyncio
+import json
+import os
+import socket
+
+import pytest
+import websockets
+
+import replay_journal
+from traffic_journal import IN, OUT, TrafficJournal, read_journal, segments
+
+BOOT = ('[2,"b1","BootNotification",{"chargingStation":{"model":"M",'
+        '"vendorName":"V"},"reason":"PowerUp"}]')
+HEARTBEAT = '[2,"h1","Heartbeat",{}]'
+TRIGGER = '[2,"t1","TriggerMessage",{"requestedMessage":"Heartbeat"}]'
+TRIGGER_RESULT = '[3,"t1",{"status":"Accepted"}]'
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def test_write_and_read_across_segments(tmp_path):
+    directory = str(tmp_path / 'journal')
+    journal = TrafficJournal(directory, segment_size=256)
+    journal.open()
+    written = []
+    for i in range(20):
+        frame = f'[2,"{i}","DataTransfer",{{"vendorId":"ü{i}"}}]'
+        direction = IN if i % 2 else OUT
+        journal.record(f'CP-{i % 3}', direction, 'DataTransfer', frame)
+        written.append((direction, f'CP-{i % 3}', 'DataTransfer', frame))
+    # Doesn't fit in a segment at all.
+    journal.record('CP-0', IN, 'DataTransfer', 'x' * 300)
+    journal.close()
+
+    assert journal.records == 20 and journal.dropped == 1
+    assert len(segments(directory)) > 1
+    for path in segments(directory):
+        assert os.path.getsize(path) < 256
+    records = list(read_journal(directory))
+    assert [record[1:] for record in records] == written
+    timestamps = [record[0] for record in records]
+    assert timestamps == sorted(timestamps)
+
+    # Reopening starts a new segment after the existing ones.
+    count = len(segments(directory))
+    journal = TrafficJournal(directory, segment_size=256)
+    journal.open()
+    journal.record('CP-9', IN, None, HEARTBEAT)
+    journal.close()
+    assert len(segments(directory)) == count + 1
+    assert list(read_journal(directory))[-1][1:] == \
+        (IN, 'CP-9', '', HEARTBEAT)
+
+
+def test_torn_record_ends_the_segment(tmp_path):
+    directory = str(tmp_path / 'journal')
+    journal = TrafficJournal(directory)
+    journal.open()
+    journal.record('CP1', IN, 'Heartbeat', HEARTBEAT)
+    journal.record('CP1', IN, 'BootNotification', BOOT)
+    journal.close()
+    path, = segments(directory)
+    with open(path, 'r+b') as f:
+        f.truncate(os.path.getsize(path) - 20)
+    assert [record[4] for record in read_journal(directory)] == [HEARTBEAT]
+    with open(path, 'r+b') as f:
+        f.write(b'NOTAJRNL')
+    with pytest.raises(ValueError):
+        list(read_journal(directory))
+
+
+def test_replay_sends_the_recorded_traffic(tmp_path):
+    directory = str(tmp_path / 'journal')
+    journal = TrafficJournal(directory)
+    journal.open()
+    journal.record('CP1', IN, 'BootNotification', BOOT)
+    journal.record('CP1', OUT, 'BootNotification',
+                   '[3,"b1",{"status":"Accepted"}]')
+    journal.record('CP1', OUT, 'TriggerMessage', TRIGGER)
+    journal.record('CP1', IN, 'TriggerMessage', TRIGGER_RESULT)
+    journal.record('CP1', IN, 'Heartbeat', HEARTBEAT)
+    journal.record('CP2', IN, 'Heartbeat', HEARTBEAT.replace('h1', 'h2'))
+    journal.close()
+
+    received = {}
+    answers = []
+
+    async def central_system(ws, path):
+        station_id = path.strip('/')
+        async for raw in ws:
+            message = json.loads(raw)
+            if message[0] == 2:
+                received.setdefault(station_id, []).append(raw)
+                await ws.send(json.dumps([3, message[1], {}]))
+                if station_id == 'replay-CP1' and \
+                        message[2] == 'BootNotification':
+                    await ws.send(TRIGGER.replace('t1', 'new-id'))
+            else:
+                answers.append(message)
+
+    async def run():
+        port = free_port()
+        args = argparse.Namespace(
+            journal=directory, url=f'ws://127.0.0.1:{port}', speed=0,
+            prefix='replay-', linger=0.1, connect_timeout=5,
+            response_timeout=5)
+        async with websockets.serve(central_system, '127.0.0.1', port):
+            await replay_journal.replay(args)
+
+    asyncio.run(run())
+    assert received == {'replay-CP1': [BOOT, HEARTBEAT],
+                        'replay-CP2': [HEARTBEAT.replace('h1', 'h2')]}
+    # Answered with the recorded response, under the new message id.
+    assert answers == [[3, 'new-id', {'status': 'Accepted'}]]
@@ -0,0 +1,164 @@
+import asyncio
+import json
+
+import pytest
+from ocpp.exceptions import OCPPError
+from ocpp.messages import Call, CallResult, validate_payload
+from ocpp.routing import on
+from ocpp.v201 import call, call_result
+
+import codec
+import validation
+from station_connection import StationConnection
+from validation import ValidationPolicy, validate
+
+STATUS_NOTIFICATION = {'timestamp': '2024-01-01T00:00:00Z',
+                       'connectorStatus': 'Available', 'evseId': 1,
+                       'connectorId': 1}
+
+
+def random_values(monkeypatch, *values):
+    values = iter(values)
+    monkeypatch.setattr(validation.random, 'random', lambda: next(values))
+
+
+def test_validate_matches_library():
+    valid = Call('1', 'StatusNotification', STATUS_NOTIFICATION)
+    validate(valid, '2.0.1')
+    for payload in [{}, dict(STATUS_NOTIFICATION, evseId='one'),
+                    dict(STATUS_NOTIFICATION, connectorStatus='Broken')]:
+        invalid = Call('1', 'StatusNotification', payload)
+        with pytest.raises(OCPPError) as expected:
+            validate_payload(invalid, '2.0.1')
+        with pytest.raises(OCPPError) as error:
+            validate(invalid, '2.0.1')
+        assert type(error.value) is type(expected.value)
+    validate(CallResult('1', {'status': 'Accepted'}, 'TriggerMessage'),
+             '2.0.1')
+
+
+def test_trusted_station_is_sampled(monkeypatch):
+    policy = ValidationPolicy(trust_after=3, sample_rate=0.25,
+                              always_validate=['Authorize'])
+    assert [policy.inbound('CP1', 'Heartbeat') for _ in range(3)] == \
+        [True] * 3
+    random_values(monkeypatch, 0.5, 0.1, 0.9)
+    assert [policy.inbound('CP1', 'Heartbeat') for _ in range(3)] == \
+        [False, True, False]
+    assert policy.inbound('CP1', 'Authorize')
+    # Every station earns its own trust.
+    assert policy.inbound('CP2', 'Heartbeat')
+    assert (policy.validated, policy.skipped) == (6, 2)
+
+
+def test_violation_revokes_trust():
+    policy = ValidationPolicy(trust_after=2, sample_rate=0)
+    for _ in range(2):
+        policy.inbound('CP1', 'Heartbeat')
+        policy.outbound('SetVariables')
+    assert not policy.inbound('CP1', 'Heartbeat')
+    assert not policy.outbound('SetVariables')
+
+    policy.violation('CP1', 'Heartbeat')
+    assert [policy.inbound('CP1', 'Heartbeat') for _ in range(3)] == \
+        [True, True, False]
+    assert not policy.outbound('SetVariables')
+    policy.violation(None, 'SetVariables')
+    assert policy.outbound('SetVariables')
+    assert policy.violations == 2
+
+    policy.forget('CP1')
+    assert policy.inbound('CP1', 'Heartbeat')
+
+
+class Connection:
+
+    def __init__(self):
+        self.frames = []
+
+    async def send(self, message):
+        self.frames.append(json.loads(message))
+
+
+class Station(StationConnection):
+
+    __slots__ = ()
+
+    validation_policy = None
+
+    @on('StatusNotification')
+    def on_status_notification(self, timestamp, connector_status, evse_id,
+                               connector_id, **kwargs):
+        return call_result.StatusNotificationPayload()
+
+
+@pytest.fixture
+def trusted(monkeypatch):
+    """ A policy trusting every payload without sampling. """
+    policy = ValidationPolicy(trust_after=0, sample_rate=0)
+    monkeypatch.setattr(Station, 'validation_policy', policy)
+    return policy
+
+
+def receive(station, payload):
+    asyncio.run(station.route_message(json.dumps(
+        [2, 'id-1', 'StatusNotification', payload])))
+    return station._connection.frames[-1]
+
+
+def test_trusted_payloads_are_not_validated(trusted):
+    station = Station('CP1', Connection())
+    # Wrong type, but the handler doesn't care.
+    assert receive(station, dict(STATUS_NOTIFICATION, evseId='one')) == \
+        [3, 'id-1', {}]
+    # Neither the payload nor the response was validated.
+    assert trusted.skipped == 2 and trusted.violations == 0
+
+
+def test_failing_handler_reports_the_schema_violation(trusted):
+    station = Station('CP1', Connection())
+    payload = dict(STATUS_NOTIFICATION)
+    del payload['connectorStatus']
+    with pytest.raises(OCPPError) as expected:
+        validate_payload(Call('id-1', 'StatusNotification', payload),
+                         '2.0.1')
+
+    frame = receive(station, payload)
+    # Not the handler's TypeError, but what validating would have said.
+    assert frame[:3] == [4, 'id-1', expected.value.code]
+    assert trusted.violations == 1
+    # The station has to earn the trust again.
+    trusted.trust_after = 1
+    assert trusted.inbound('CP1', 'StatusNotification')
+
+
+def test_invalid_result_reports_the_schema_violation(trusted):
+    station = Station('CP1', Connection())
+    response = CallResult('id-1', {'status': 'Accepted', 'unknown': 1})
+    with pytest.raises(OCPPError):
+        codec.decode_result(station, response, 'TriggerMessage',
+                            'TriggerMessagePayload')
+    assert trusted.violations == 1
+    result = codec.decode_result(
+        station, CallResult('id-2', {'status': 'Accepted'}),
+        'TriggerMessage', 'TriggerMessagePayload')
+    assert result == call_result.TriggerMessagePayload(status='Accepted')
+
+
+def test_invalid_outbound_payload_is_not_sent(monkeypatch):
+    policy = ValidationPolicy(trust_after=1, sample_rate=0)
+    monkeypatch.setattr(Station, 'validation_policy', policy)
+    station = Station('CP1', Connection(), response_timeout=0.01)
+    invalid = call.TriggerMessagePayload(requested_message='Nonsense')
+
+    with pytest.raises(OCPPError):
+        asyncio.run(station.call(invalid))
+    assert station._connection.frames == []
+    assert policy.violations == 1
+
+    # Once the action is trusted again, payloads go out unchecked.
+    policy.outbound('TriggerMessage')
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(station.call(invalid))
+    assert station._connection.frames[-1][2:] == [
+        'TriggerMessage', {'requestedMessage': 'Nonsense'}]
@@ -0,0 +1,151 @@
+""" Binary journal of all OCPP frames sent and received.
+
+The journal is a directory of segment files of a fixed size. A segment is
+created sparse, memory-mapped and filled with records, so recording a frame
+is a copy into the page cache without a system call; the kernel writes the
+pages back on its own. When a segment is full the next one is started and
+the finished one is truncated to the bytes used.
+
+Segment layout:
+
+    MAGIC
+    record*
+    0 (uint32, end of records)
+
+Record layout, little endian:
+
+    uint32  length of the rest of the record
+    float64 timestamp (seconds since the epoch)
+    uint8   direction (IN: station -> central system, OUT: the reverse)
+    uint8   length of the action
+    uint16  length of the station id
+    bytes   station id, action, frame (UTF-8)
+
+read_journal() iterates over the records of all segments through
+read-only memory maps.
+"""
+import glob
+import logging
+import mmap
+import os
+import struct
+import time
+
+LOGGER = logging.getLogger('central_system.traffic_journal')
+
+MAGIC = b'OCPPJRN1'
+LENGTH = struct.Struct('<I')
+HEADER = struct.Struct('<dBBH')
+
+IN = 0
+OUT = 1
+
+SEGMENT_SIZE = 64 * 1024 * 1024
+
+
+class TrafficJournal:
+
+    def __init__(self, directory, segment_size=SEGMENT_SIZE):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.records = 0
+        self.dropped = 0
+        self._index = 0
+        self._file = None
+        self._map = None
+        self._offset = 0
+
+    def open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        existing = segments(self.directory)
+        if existing:
+            self._index = int(os.path.basename(existing[-1])[8:14]) + 1
+        self._new_segment()
+
+    def _new_segment(self):
+        path = os.path.join(self.directory,
+                            f'journal-{self._index:06d}.seg')
+        self._index += 1
+        self._file = open(path, 'w+b')
+        self._file.truncate(self.segment_size)
+        self._map = mmap.mmap(self._file.fileno(), self.segment_size)
+        self._map[:len(MAGIC)] = MAGIC
+        self._offset = len(MAGIC)
+        LOGGER.info("Recording traffic to %s", path)
+
+    def _close_segment(self):
+        self._map.close()
+        # Keep the end marker after the last record.
+        self._file.truncate(self._offset + LENGTH.size)
+        self._file.close()
+        self._map = self._file = None
+
+    def record(self, station_id, direction, action, frame):
+        station = station_id.encode()
+        action = (action or '').encode()[:255]
+        data = frame.encode()
+        length = HEADER.size + len(station) + len(action) + len(data)
+        size = LENGTH.size + length
+        # Room for the record and the end marker.
+        if self._offset + size + LENGTH.size > self.segment_size:
+            if len(MAGIC) + size + LENGTH.size > self.segment_size:
+                self.dropped += 1
+                return
+            self._close_segment()
+            self._new_segment()
+
+        offset = self._offset
+        LENGTH.pack_into(self._map, offset, length)
+        HEADER.pack_into(self._map, offset + LENGTH.size, time.time(),
+                         direction, len(action), len(station))
+        offset += LENGTH.size + HEADER.size
+        end = offset + len(station)
+        self._map[offset:end] = station
+        offset, end = end, end + len(action)
+        self._map[offset:end] = action
+        offset, end = end, end + len(data)
+        self._map[offset:end] = data
+        self._offset = end
+        self.records += 1
+
+    def close(self):
+        if self._map is not None:
+            self._close_segment()
+
+
+def segments(directory):
+    return sorted(glob.glob(os.path.join(directory, 'journal-*.seg')))
+
+
+def read_segment(path):
+    """ Yield (timestamp, direction, station id, action, frame) records. """
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size < len(MAGIC):
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            if data[:len(MAGIC)] != MAGIC:
+                raise ValueError(f"{path} is not a traffic journal segment")
+            offset = len(MAGIC)
+            end_of_data = len(data) - LENGTH.size
+            while offset <= end_of_data:
+                length, = LENGTH.unpack_from(data, offset)
+                if length == 0 or offset + LENGTH.size + length > len(data):
+                    # End marker, or a record torn by a crash.
+                    return
+                offset += LENGTH.size
+                timestamp, direction, action_length, station_length = \
+                    HEADER.unpack_from(data, offset)
+                start = offset + HEADER.size
+                station = data[start:start + station_length].decode()
+                start += station_length
+                action = data[start:start + action_length].decode()
+                start += action_length
+                frame = data[start:offset + length].decode()
+                offset += length
+                yield timestamp, direction, station, action, frame
+
+
+def read_journal(directory):
+    """ Yield the records of all segments of a journal, oldest first. """
+    for path in segments(directory):
+        yield from read_segment(path)
@@ -0,0 +1,130 @@
+""" Compiled payload validation and trust-based validation sampling.
+
+The ocpp library validates every payload with jsonschema's Draft4Validator,
+which interprets the schema on every call. validate() compiles each schema
+to Python code with fastjsonschema, once per message type and action, and
+shares the compiled validators between all connections. A payload rejected
+by a compiled validator is checked again by the library, so violations are
+reported with the library's OCPP error codes. Without fastjsonschema the
+library validates every payload.
+
+ValidationPolicy decides which payloads are validated at all:
+
+* payloads received from a station are validated until the station has sent
+  `trust_after` messages without a schema violation, then only a
+  `sample_rate` fraction of them is,
+* a violation withdraws the trust, so the station's payloads are validated
+  in full again. Violations are found by samples, and by validating an
+  unchecked payload after its handler failed on it,
+* actions in `always_validate` are validated for every station,
+* payloads sent by the central system are trusted per action in the same
+  way.
+"""
+import json
+import logging
+import random
+
+from ocpp.messages import Call, CallResult, get_validator, validate_payload
+
+try:
+    import fastjsonschema
+except ModuleNotFoundError:
+    fastjsonschema = None
+
+LOGGER = logging.getLogger('central_system.validation')
+
+DRAFT_4 = 'http://json-schema.org/draft-04/schema#'
+
+# (message type id, action, ocpp version) -> compiled validator
+_compiled = {}
+
+
+def _compile(message_type_id, action, ocpp_version):
+    schema = get_validator(message_type_id, action, ocpp_version).schema
+    # Behave like the library's Draft4Validator: draft 4 semantics, formats
+    # aren't checked and defaults must not be inserted into the payload.
+    schema = dict(schema, **{'$schema': DRAFT_4})
+    return fastjsonschema.compile(schema, use_default=False,
+                                  use_formats=False)
+
+
+def validate(message, ocpp_version):
+    """ Drop-in replacement for ocpp.messages.validate_payload(). """
+    # OCPP 1.6 needs the library's Decimal handling of some payloads.
+    if fastjsonschema is None or ocpp_version == '1.6' or \
+            type(message) not in (Call, CallResult):
+        return validate_payload(message, ocpp_version)
+
+    key = (message.message_type_id, message.action, ocpp_version)
+    validator = _compiled.get(key)
+    if validator is None:
+        try:
+            validator = _compiled[key] = _compile(*key)
+        except (OSError, ValueError, json.JSONDecodeError):
+            # Let the library raise its error for unknown actions.
+            return validate_payload(message, ocpp_version)
+
+    try:
+        validator(message.payload)
+    except fastjsonschema.JsonSchemaException:
+        validate_payload(message, ocpp_version)
+
+
+class ValidationPolicy:
+
+    def __init__(self, trust_after=1000, sample_rate=0.01,
+                 always_validate=()):
+        """
+        Args:
+
+            trust_after (int): Messages without a violation after which a
+                station (or an outbound action) is trusted.
+            sample_rate (float): Fraction of trusted payloads still
+                validated, 0 to skip validation of trusted payloads.
+            always_validate: Actions whose payloads are always validated.
+
+        """
+        self.trust_after = trust_after
+        self.sample_rate = sample_rate
+        self.always_validate = frozenset(always_validate)
+        # station id -> messages since the last violation
+        self._clean = {}
+        # action -> outbound payloads since the last violation
+        self._clean_outbound = {}
+        self.validated = 0
+        self.skipped = 0
+        self.violations = 0
+
+    def _decide(self, counts, key, action):
+        clean = counts.get(key, 0)
+        counts[key] = clean + 1
+        if clean < self.trust_after or action in self.always_validate or \
+                random.random() < self.sample_rate:
+            self.validated += 1
+            return True
+        self.skipped += 1
+        return False
+
+    def inbound(self, station_id, action):
+        """ Whether to validate a payload received from the station. """
+        return self._decide(self._clean, station_id, action)
+
+    def outbound(self, action):
+        """ Whether to validate a payload sent to a station. """
+        return self._decide(self._clean_outbound, action, action)
+
+    def violation(self, station_id, action):
+        """ Withdraw the trust after a schema violation. station_id is None
+        for outbound payloads.
+        """
+        self.violations += 1
+        if station_id is None:
+            self._clean_outbound[action] = 0
+            return
+        if self._clean.get(station_id, 0) > self.trust_after:
+            LOGGER.warning("Station %s sent an invalid %s payload, validating "
+                           "all of its payloads again", station_id, action)
+        self._clean[station_id] = 0
+
+    def forget(self, station_id):
+        self._clean.pop(station_id, None)
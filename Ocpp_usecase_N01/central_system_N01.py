@@ -1,6 +1,6 @@
 import asyncio
 import logging
-from datetime import datetime
+import os
 
 try:
     import websockets
@@ -18,6 +18,11 @@ from ocpp.v201 import call,call_result
 
 logging.basicConfig(level=logging.INFO)
 
+# Public base URL of the artifact server receiving the logs, like
+# --artifact-url of the central system. Uploads go to <url>/logs/<station>/.
+ARTIFACT_URL = os.environ.get('ARTIFACT_URL',
+                              'http://localhost:8080').rstrip('/')
+
 
 class ChargePoint(cp):
     async def get_log_request(self):
@@ -28,7 +33,7 @@ class ChargePoint(cp):
           retry_interval= 30,
           log=
               {
-                  'remoteLocation': 'eiusmod ut',
+                  'remoteLocation': f'{ARTIFACT_URL}/logs/{self.id}/',
                   'oldestTimestamp': '2007-05-29T05:26:25.665Z',
                   'latestTimestamp': '2020-12-05T19:31:32.232Z'
               }
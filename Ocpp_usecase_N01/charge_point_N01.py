@@ -1,7 +1,13 @@
 import asyncio
 import logging
+import random
+import ssl
+import sys
+import zlib
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlsplit
 
-from ocpp.routing import on
+from ocpp.routing import after, on
 
 try:
     import websockets
@@ -10,7 +16,6 @@ except ModuleNotFoundError:
     print("Please install it by running: ")
     print()
     print(" $ pip install websockets")
-    import sys
     sys.exit(1)
 
 
@@ -19,25 +24,283 @@ from ocpp.v201 import ChargePoint as cp
 
 logging.basicConfig(level=logging.INFO)
 
+# Log file to upload, one record per line starting with an ISO 8601
+# timestamp. Without one a diagnostics log is generated on the fly.
+LOG_FILE = sys.argv[1] if len(sys.argv) > 1 else None
+
+# Compressed bytes sent per HTTP request; also the most that is held in
+# memory, whatever the size of the log.
+CHUNK_SIZE = 256 * 1024
+READ_SIZE = 64 * 1024
+
+# Used when GetLog leaves the retries to the station.
+DEFAULT_RETRIES = 3
+DEFAULT_RETRY_INTERVAL = 30
+HTTP_TIMEOUT = 30
+
+
+class UploadError(Exception):
+    pass
+
+
+def _parse_timestamp(value):
+    timestamp = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return timestamp
+
+
+def read_log_window(path, oldest=None, latest=None):
+    """ Yield the lines of the log file between the oldest and latest
+    timestamps. The file is in time order, so reading stops after `latest`.
+    Lines without a timestamp continue the previous record and go with it.
+    """
+    in_window = True
+    with open(path, 'rb') as f:
+        for line in f:
+            try:
+                timestamp = _parse_timestamp(line.split(None, 1)[0].decode())
+            except (IndexError, ValueError):
+                # Continuation of the previous record.
+                if in_window:
+                    yield line
+                continue
+            if latest is not None and timestamp > latest:
+                return
+            in_window = oldest is None or timestamp >= oldest
+            if in_window:
+                yield line
+
+
+def generate_log_window(oldest=None, latest=None, step=timedelta(hours=1)):
+    """ Yield the lines of a diagnostics log between the timestamps, for
+    stations without a log file.
+    """
+    latest = latest or datetime.now(timezone.utc)
+    timestamp = oldest or latest - timedelta(days=30)
+    counter = 0
+    while timestamp <= latest:
+        counter += 1
+        yield (f'{timestamp.isoformat(timespec="seconds")} INFO '
+               f'diagnostics seq={counter} temperature=31.5 '
+               f'supply_voltage=229.8 meter=12034.7\n').encode()
+        timestamp += step
+
+
+def compressed_chunks(lines, chunk_size=CHUNK_SIZE):
+    """ gzip the lines on the fly and yield (chunk, last) pieces of
+    chunk_size bytes. zlib is deterministic, so compressing the same lines
+    again yields the same bytes; that is what makes resuming at an offset
+    possible without keeping anything.
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    pending = bytearray()
+    buffered = []
+    size = 0
+    for line in lines:
+        buffered.append(line)
+        size += len(line)
+        if size < READ_SIZE:
+            continue
+        pending += compressor.compress(b''.join(buffered))
+        buffered, size = [], 0
+        while len(pending) > chunk_size:
+            yield bytes(pending[:chunk_size]), False
+            del pending[:chunk_size]
+    pending += compressor.compress(b''.join(buffered))
+    pending += compressor.flush()
+    while len(pending) > chunk_size:
+        yield bytes(pending[:chunk_size]), False
+        del pending[:chunk_size]
+    yield bytes(pending), True
+
+
+class HTTPUpload:
+    """ Resumable upload of one file over a keep-alive HTTP/1.1 connection:
+    each chunk is PUT with a Content-Range, and HEAD returns the number of
+    bytes the server has (Upload-Offset).
+    """
+
+    def __init__(self, url):
+        self.url = urlsplit(url)
+        if self.url.scheme not in ('http', 'https') or not self.url.hostname:
+            raise ValueError(f"Unsupported upload location {url!r}")
+        self.port = self.url.port or (443 if self.url.scheme == 'https'
+                                      else 80)
+        self.reader = self.writer = None
+
+    async def connect(self):
+        context = ssl.create_default_context() \
+            if self.url.scheme == 'https' else None
+        self.reader, self.writer = await asyncio.wait_for(
+            asyncio.open_connection(self.url.hostname, self.port,
+                                    ssl=context),
+            HTTP_TIMEOUT)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.reader = self.writer = None
+
+    async def _request(self, method, headers, body=b''):
+        lines = [f'{method} {self.url.path or "/"} HTTP/1.1',
+                 f'Host: {self.url.netloc}',
+                 f'Content-Length: {len(body)}']
+        lines += [f'{name}: {value}' for name, value in headers.items()]
+        self.writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+        self.writer.write(body)
+        await self.writer.drain()
+
+        head = await asyncio.wait_for(self.reader.readuntil(b'\r\n\r\n'),
+                                      HTTP_TIMEOUT)
+        status_line, *header_lines = head.decode('latin-1').split('\r\n')
+        status = int(status_line.split(' ', 2)[1])
+        response_headers = {}
+        for line in header_lines:
+            if ':' in line:
+                name, value = line.split(':', 1)
+                response_headers[name.strip().lower()] = value.strip()
+        length = int(response_headers.get('content-length', 0))
+        if length and method != 'HEAD':
+            await self.reader.readexactly(length)
+        return status, response_headers
+
+    async def offset(self):
+        """ Bytes of the file the server already has. """
+        status, headers = await self._request('HEAD', {})
+        if status == 404:
+            return 0
+        if status >= 300:
+            raise UploadError(f"HEAD {self.url.path} answered {status}")
+        return int(headers.get('upload-offset', 0))
+
+    async def put(self, chunk, first, total):
+        """ Send the chunk starting at byte `first`; total is None until the
+        last chunk. Returns the offset the server acknowledged.
+        """
+        last = first + len(chunk) - 1
+        status, headers = await self._request('PUT', {
+            'Content-Type': 'application/gzip',
+            'Content-Range':
+                f'bytes {first}-{last}/{"*" if total is None else total}',
+        }, chunk)
+        if status >= 300:
+            raise UploadError(f"PUT {self.url.path} answered {status}")
+        return int(headers.get('upload-offset', last + 1))
+
 
 class ChargePoint(cp):
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._upload = None
+
     @on('GetLog')
-    def on_get_log(self, **kwargs):
-        print('Got a GetLogRequest!')
-        return call_result.GetLogPayload(
-            status='Accepted'
-        )
+    def on_get_log(self, log, **kwargs):
+        if urlsplit(log['remote_location']).scheme not in ('http', 'https'):
+            return call_result.GetLogPayload(status='Rejected')
+        if self._upload is not None and not self._upload.done():
+            # A new request replaces the upload in progress.
+            self._upload.cancel()
+            return call_result.GetLogPayload(status='AcceptedCanceled')
+        return call_result.GetLogPayload(status='Accepted')
+
+    @after('GetLog')
+    def after_get_log(self, log, request_id, retries=None,
+                      retry_interval=None, **kwargs):
+        if urlsplit(log['remote_location']).scheme not in ('http', 'https'):
+            return
+        self._upload = asyncio.ensure_future(self.upload_log(
+            log['remote_location'], self._log_window(log), request_id,
+            DEFAULT_RETRIES if retries is None else retries,
+            DEFAULT_RETRY_INTERVAL if retry_interval is None
+            else retry_interval))
+
+    @staticmethod
+    def _log_window(log):
+        """ (oldest, latest) timestamps of the requested log. Without a
+        latestTimestamp the window ends at the request, so that every upload
+        attempt compresses the same lines, into the same bytes, and can
+        resume where the previous one stopped.
+        """
+        oldest = log.get('oldest_timestamp')
+        latest = log.get('latest_timestamp')
+        oldest = _parse_timestamp(oldest) if oldest else None
+        latest = _parse_timestamp(latest) if latest \
+            else datetime.now(timezone.utc)
+        return oldest, latest
+
+    @staticmethod
+    def _log_lines(oldest, latest):
+        if LOG_FILE is not None:
+            return read_log_window(LOG_FILE, oldest, latest)
+        return generate_log_window(oldest, latest)
 
-    async def log_status_notification(self):
-       await asyncio.sleep(10)
-       for i in ['Uploading', 'Uploaded'] :
+    async def upload_log(self, url, window, request_id, retries,
+                         retry_interval):
+        if url.endswith('/'):
+            url += f'{self.id}-{request_id}.log.gz'
+        await self.log_status_notification('Uploading', request_id)
+        for attempt in range(retries + 1):
+            if attempt:
+                # Jittered so a fleet retrying after an outage of the
+                # server doesn't come back all at once.
+                await asyncio.sleep(retry_interval * random.uniform(0.5, 1.5))
+            try:
+                sent = await self._upload_once(url, window)
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError,
+                    UploadError, ValueError) as e:
+                logging.warning("Log upload attempt %d of %d failed: %r",
+                                attempt + 1, retries + 1, e)
+                continue
+            logging.info("Uploaded %d compressed bytes to %s", sent, url)
+            await self.log_status_notification('Uploaded', request_id)
+            return
+        await self.log_status_notification('UploadFailure', request_id)
+
+    async def _upload_once(self, url, window):
+        """ Upload the log, starting at the offset the server acknowledged.
+        The server is asked on the first attempt too: a station that
+        rebooted mid-upload and gets the same GetLog again resumes as well.
+        Compression runs on a worker thread so the websocket stays
+        responsive.
+        """
+        loop = asyncio.get_running_loop()
+        upload = HTTPUpload(url)
+        await upload.connect()
+        try:
+            acknowledged = await upload.offset()
+            chunks = compressed_chunks(self._log_lines(*window))
+            position = 0
+            while True:
+                chunk, last = await loop.run_in_executor(None, next, chunks)
+                end = position + len(chunk)
+                # Skip what the server already has.
+                while acknowledged < end:
+                    if acknowledged < position:
+                        raise UploadError(
+                            f"Server went back to offset {acknowledged}")
+                    previous = acknowledged
+                    acknowledged = await upload.put(
+                        chunk[acknowledged - position:], acknowledged,
+                        end if last else None)
+                    if acknowledged <= previous:
+                        raise UploadError("Server made no progress")
+                position = end
+                if last:
+                    if acknowledged != end:
+                        raise UploadError(
+                            f"Server has {acknowledged} of {end} bytes")
+                    return end
+        finally:
+            upload.close()
+
+    async def log_status_notification(self, status, request_id):
         request = call.LogStatusNotificationPayload(
-            status= i,
-            request_id=1234
-                    )
+            status=status,
+            request_id=request_id
+        )
         await self.call(request)
-        await asyncio.sleep(3)
 
 
 async def main():
@@ -47,8 +310,7 @@ async def main():
     ) as ws:
 
         charge_point = ChargePoint('EVA_1', ws)
-        await asyncio.gather(charge_point.start(),
-                             charge_point.log_status_notification())
+        await charge_point.start()
 
 
 if __name__ == '__main__':